@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the service.
+
+Starts a local Redis, an S3 stand-in (moto server or a MinIO binary), the FastAPI app and N workers
+running the identity model, drives a concurrent workload against the API and reports throughput,
+latency percentiles per endpoint and job end-to-end times as JSON.
+
+Example:
+    python -m benchmarks.load_test --users 8 --workers 2 --duration 60 --audio-durations 2,10,60 --output bench.json
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import defaultdict
+
+import boto3
+import click
+import httpx
+
+PASSWORD = "benchmark"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: list[float], q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def _summary(values: list[float], scale: float = 1.0) -> dict:
+    return {
+        "p50": _percentile(values, 0.50) * scale if values else None,
+        "p95": _percentile(values, 0.95) * scale if values else None,
+        "p99": _percentile(values, 0.99) * scale if values else None,
+        "mean": sum(values) / len(values) * scale if values else None,
+    }
+
+
+def _make_wav(duration_s: float, sample_rate: int = 16000) -> bytes:
+    """Mono 16-bit noise, generated with the standard library only"""
+    rng = random.Random(0)
+    num_samples = int(duration_s * sample_rate)
+    samples = struct.pack(f"<{num_samples}h", *(rng.randint(-8000, 8000) for _ in range(num_samples)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples)
+    return buffer.getvalue()
+
+
+def _wait_until(check, timeout_s: float, what: str):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        with contextlib.suppress(Exception):
+            if check():
+                return
+        time.sleep(0.2)
+    raise TimeoutError(f"{what} did not start within {timeout_s} s")
+
+
+class Stack:
+    """Local Redis, S3, app and workers running as subprocesses"""
+
+    def __init__(self, workers: int, s3_backend: str, keep_limits: bool, keep_logs: bool):
+        self.workers = workers
+        self.s3_backend = s3_backend
+        self.keep_limits = keep_limits
+        self.keep_logs = keep_logs
+        self.processes = []
+        self.temp_dir = tempfile.mkdtemp(prefix="speech-bench-")
+        self.redis_port = _free_port()
+        self.s3_port = _free_port()
+        self.app_port = _free_port()
+
+    @property
+    def app_url(self) -> str:
+        return f"http://127.0.0.1:{self.app_port}"
+
+    def env(self) -> dict:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{self.temp_dir}/app.db",
+            "REDIS_HOST": "127.0.0.1",
+            "REDIS_PORT": str(self.redis_port),
+            "REDIS_DB": "0",
+            "S3_HOST": "127.0.0.1",
+            "S3_PORT": str(self.s3_port),
+            "MODEL_BACKEND": "identity",
+            "DEFAULT_MODEL_DEVICE": "cpu",
+            # Several workers share the host, their metrics exporters would fight over one port
+            "WORKER_METRICS_PORT": "0",
+        }
+        if not self.keep_limits:
+            env["RATE_LIMIT_PER_MINUTE"] = "free=1000000"
+            env["RATE_LIMIT_BURST"] = "free=1000000"
+            env["MAX_INFLIGHT_JOBS"] = "free=1000000"
+        return env
+
+    def _spawn(self, args: list[str], log_name: str):
+        log = open(os.path.join(self.temp_dir, f"{log_name}.log"), "wb")
+        process = subprocess.Popen(args, env=self.env(), stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start(self):
+        import redis
+
+        self._spawn(
+            ["redis-server", "--port", str(self.redis_port), "--save", "", "--appendonly", "no"],
+            "redis",
+        )
+        _wait_until(lambda: redis.Redis(port=self.redis_port).ping(), 10, "Redis")
+
+        if self.s3_backend == "minio":
+            data_dir = os.path.join(self.temp_dir, "minio")
+            self._spawn(["minio", "server", data_dir, "--address", f"127.0.0.1:{self.s3_port}"], "s3")
+        else:
+            self._spawn(["moto_server", "-H", "127.0.0.1", "-p", str(self.s3_port)], "s3")
+
+        env = self.env()
+        s3_client = boto3.client(
+            "s3",
+            endpoint_url=f"http://127.0.0.1:{self.s3_port}",
+            aws_access_key_id=env.get("S3_ACCESS_KEY", "minioadmin"),
+            aws_secret_access_key=env.get("S3_SECRET_KEY", "minioadmin"),
+            region_name="us-east-1",
+        )
+        _wait_until(lambda: s3_client.list_buckets() is not None, 30, "S3")
+        for bucket in (env.get("S3_UPLOADS_BUCKET", "audio-uploads"), env.get("S3_RESULTS_BUCKET", "audio-results")):
+            s3_client.create_bucket(Bucket=bucket)
+
+        self._spawn(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(self.app_port)],
+            "app",
+        )
+        _wait_until(lambda: httpx.get(f"{self.app_url}/models/").status_code == 200, 60, "App")
+
+        for i in range(self.workers):
+            self._spawn([sys.executable, "-m", "src.workers.enhance"], f"worker-{i}")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                process.wait(timeout=10)
+        if self.keep_logs:
+            print(f"Logs are kept in {self.temp_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.jobs = []
+        self.failed_jobs = 0
+
+    async def request(self, client: httpx.AsyncClient, method: str, route: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[f"{method} {route}"][type(e).__name__] += 1
+            return None
+        self.latencies[f"{method} {route}"].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[f"{method} {route}"][str(response.status_code)] += 1
+        return response
+
+    def report(self, elapsed_s: float) -> dict:
+        endpoints = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies[name]
+            endpoints[name] = {
+                "requests": len(latencies),
+                "throughput_rps": len(latencies) / elapsed_s,
+                "errors": dict(self.errors[name]),
+                "latency_ms": _summary(latencies, scale=1000),
+            }
+        return {
+            "endpoints": endpoints,
+            "jobs": {
+                "completed": len(self.jobs),
+                "failed": self.failed_jobs,
+                "throughput_jobs_per_s": len(self.jobs) / elapsed_s,
+                "end_to_end_s": _summary(self.jobs),
+            },
+        }
+
+
+async def _track_job(client, recorder, task_id, submitted_at, poll_interval_s, deadline):
+    while time.monotonic() < deadline:
+        await asyncio.sleep(poll_interval_s)
+        response = await recorder.request(client, "GET", "/tasks/{task_id}", f"/tasks/{task_id}")
+        if response is None or response.status_code != 200:
+            continue
+        task_status = response.json()["status"]
+        if task_status == "completed":
+            recorder.jobs.append(time.monotonic() - submitted_at)
+            return
+        if task_status == "failed":
+            recorder.failed_jobs += 1
+            return
+
+
+async def _virtual_user(index, app_url, recorder, files, mix, model_name, poll_interval_s, deadline, drain_s):
+    username = f"bench-{index}-{random.getrandbits(32)}"
+    auth = (username, PASSWORD)
+    async with httpx.AsyncClient(base_url=app_url, auth=auth, timeout=120) as client:
+        await recorder.request(client, "POST", "/users/", "/users/", data={"username": username, "password": PASSWORD})
+        await recorder.request(client, "POST", "/tokens/add/", "/tokens/add/", data={"amount": 1e9})
+
+        trackers = []
+        actions, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            action = random.choices(actions, weights)[0]
+            if action == "submit":
+                filename, contents = random.choice(files)
+                submitted_at = time.monotonic()
+                response = await recorder.request(
+                    client,
+                    "POST",
+                    "/models/use/",
+                    "/models/use/",
+                    data={"model_name": model_name},
+                    files={"audio_file": (filename, contents, "audio/wav")},
+                )
+                if response is not None and response.status_code == 200:
+                    task_id = response.json()["task_id"]
+                    trackers.append(
+                        asyncio.create_task(
+                            _track_job(client, recorder, task_id, submitted_at, poll_interval_s, deadline + drain_s)
+                        )
+                    )
+            elif action == "history":
+                await recorder.request(client, "GET", "/usage/history/", "/usage/history/")
+            elif action == "balance":
+                await recorder.request(client, "GET", "/tokens/balance/", "/tokens/balance/")
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*trackers)
+
+
+async def _run_workload(app_url, users, duration_s, files, mix, model_name, poll_interval_s, drain_s):
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + duration_s
+    await asyncio.gather(
+        *(
+            _virtual_user(i, app_url, recorder, files, mix, model_name, poll_interval_s, deadline, drain_s)
+            for i in range(users)
+        )
+    )
+    return recorder.report(time.monotonic() - start)
+
+
+def _git_commit():
+    with contextlib.suppress(Exception):
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    return None
+
+
+@click.command()
+@click.option("--users", default=4, show_default=True, help="Concurrent virtual users")
+@click.option("--workers", default=2, show_default=True, help="Worker processes to start")
+@click.option("--duration", default=30.0, show_default=True, help="Workload duration in seconds")
+@click.option("--drain", default=60.0, show_default=True, help="Extra time to wait for queued jobs to finish")
+@click.option("--audio-durations", default="2,10", show_default=True, help="Comma separated input durations, s")
+@click.option(
+    "--mix",
+    default="submit=1,history=2,balance=2",
+    show_default=True,
+    help="Relative weights of user actions; submitted tasks are polled in the background",
+)
+@click.option("--model", "model_name", default="audio_denoiser", show_default=True)
+@click.option("--poll-interval", default=0.5, show_default=True, help="Task status polling interval, s")
+@click.option("--s3", "s3_backend", type=click.Choice(["moto", "minio"]), default="moto", show_default=True)
+@click.option("--app-url", default=None, help="Benchmark an already running deployment instead of a local stack")
+@click.option("--keep-limits", is_flag=True, help="Keep the configured rate limits instead of disabling them")
+@click.option("--keep-logs", is_flag=True, help="Keep the temporary directory with service logs")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the JSON report to a file")
+def main(
+    users,
+    workers,
+    duration,
+    drain,
+    audio_durations,
+    mix,
+    model_name,
+    poll_interval,
+    s3_backend,
+    app_url,
+    keep_limits,
+    keep_logs,
+    output,
+):
+    files = [(f"noise_{d}s.wav", _make_wav(float(d))) for d in audio_durations.split(",")]
+    action_mix = {action: float(weight) for action, weight in (item.split("=") for item in mix.split(","))}
+
+    stack = None
+    try:
+        if app_url is None:
+            stack = Stack(workers, s3_backend, keep_limits, keep_logs)
+            stack.start()
+            app_url = stack.app_url
+
+        report = asyncio.run(
+            _run_workload(app_url, users, duration, files, action_mix, model_name, poll_interval, drain)
+        )
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "config": {
+            "users": users,
+            "workers": workers if stack is not None else None,
+            "duration_s": duration,
+            "audio_durations_s": [float(d) for d in audio_durations.split(",")],
+            "mix": action_mix,
+            "model": model_name,
+            "s3": s3_backend if stack is not None else None,
+            "app_url": None if stack is not None else app_url,
+        },
+        **report,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of EnhancerModel processing stages.
+
+Times resampling, chunking/normalization, the forward pass, offset alignment and overlap-add separately
+for every combination of input duration and sample rate, and reports the peak memory growth of each stage.
+With `--model identity` the network is replaced by a pass-through, so pre/post-processing can be measured
+without downloading weights. `--backend onnx` runs the denoiser network with ONNX Runtime, to compare the forward
+pass throughput against PyTorch.
+
+Example:
+    python -m benchmarks.model_stages --durations 10,60,300 --sample-rates 16000,44100 --output stages.json
+    python -m benchmarks.model_stages --model denoiser --backend onnx --threads 4 --durations 60 --sample-rates 44100
+"""
+import gc
+import json
+import os
+import resource
+import statistics
+import threading
+import time
+
+import click
+import torch
+
+from src import config
+from src.models.enhancer import DenoiserModel, EnhancerModel, IdentityModel
+
+MODELS = {"identity": IdentityModel, "denoiser": DenoiserModel, "enhancer": EnhancerModel}
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux and only grows, but is better than nothing elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """Samples process RSS in a background thread and records the peak growth over the block"""
+
+    def __init__(self, device: str, interval_s: float = 0.001):
+        self._device = device
+        self._interval_s = interval_s
+        self._stop = threading.Event()
+        self.peak_rss_bytes = 0
+        self.peak_cuda_bytes = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._peak = max(self._peak, _rss_bytes())
+            time.sleep(self._interval_s)
+
+    def __enter__(self):
+        gc.collect()
+        if self._device.startswith("cuda"):
+            torch.cuda.reset_peak_memory_stats()
+        self._baseline = self._peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, _rss_bytes())
+        self.peak_rss_bytes = self._peak - self._baseline
+        if self._device.startswith("cuda"):
+            torch.cuda.synchronize()
+            self.peak_cuda_bytes = torch.cuda.max_memory_allocated()
+
+
+def _measure(fn, device: str, repeats: int):
+    """Run `fn` `repeats` times, returns its last result, median wall time and the largest peak memory growth"""
+    times, peak_rss, peak_cuda = [], 0, None
+    for _ in range(repeats):
+        with PeakMemory(device) as memory:
+            start = time.perf_counter()
+            result = fn()
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+        peak_rss = max(peak_rss, memory.peak_rss_bytes)
+        if memory.peak_cuda_bytes is not None:
+            peak_cuda = max(peak_cuda or 0, memory.peak_cuda_bytes)
+    return result, {"seconds": statistics.median(times), "peak_rss_mb": peak_rss / 2**20, "peak_cuda_mb": peak_cuda}
+
+
+def benchmark_stages(model: EnhancerModel, duration_s: float, sample_rate: int, device: str, repeats: int) -> dict:
+    audio = torch.randn(1, int(duration_s * sample_rate))
+
+    stages = {}
+    resampled, stages["resample"] = _measure(lambda: model._resample(audio, sample_rate), device, repeats)
+    chunks, stages["chunking"] = _measure(lambda: model._split_chunks(resampled), device, repeats)
+    enhanced, stages["forward"] = _measure(lambda: model._forward(chunks), device, repeats)
+    offsets, stages["offset_alignment"] = _measure(lambda: model._compute_offsets(enhanced), device, repeats)
+    _, stages["overlap_add"] = _measure(
+        lambda: model._overlap_add(enhanced, offsets, resampled.shape[0]), device, repeats
+    )
+
+    total_s = sum(stage["seconds"] for stage in stages.values())
+    return {
+        "duration_s": duration_s,
+        "sample_rate": sample_rate,
+        "chunks": len(chunks),
+        "total_s": total_s,
+        "real_time_factor": total_s / duration_s,
+        "stages": stages,
+    }
+
+
+@click.command()
+@click.option("--model", "model_name", type=click.Choice(list(MODELS)), default="identity", show_default=True)
+@click.option("--device", default="cpu", show_default=True)
+@click.option("--backend", type=click.Choice(["torch", "onnx"]), default="torch", show_default=True)
+@click.option("--durations", default="1,10,60", show_default=True, help="Comma separated input durations, s")
+@click.option("--sample-rates", default="16000,44100,48000", show_default=True)
+@click.option("--repeats", default=3, show_default=True, help="Runs per stage, the median time is reported")
+@click.option("--threads", default=None, type=int, help="torch and ONNX Runtime intra-op threads")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the JSON report to a file")
+def main(model_name, device, backend, durations, sample_rates, repeats, threads, output):
+    if threads is not None:
+        torch.set_num_threads(threads)
+        config.ONNX_INTRA_OP_THREADS = threads
+
+    start = time.perf_counter()
+    if model_name == "identity":
+        model = MODELS[model_name](device=device)
+    else:
+        model = MODELS[model_name](device=device, backend=backend)
+    load_s = time.perf_counter() - start
+
+    results = [
+        benchmark_stages(model, float(duration), int(sample_rate), device, repeats)
+        for duration in durations.split(",")
+        for sample_rate in sample_rates.split(",")
+    ]
+
+    report = {
+        "model": model_name,
+        "device": device,
+        "backend": backend,
+        "threads": torch.get_num_threads(),
+        "model_load_s": load_s,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
+
+    for row in results:
+        stages = ", ".join(f"{name} {stage['seconds'] * 1000:.1f} ms" for name, stage in row["stages"].items())
+        click.echo(f"{row['duration_s']:>7.1f} s @ {row['sample_rate']:>5} Hz: {stages}", err=True)
+
+
+if __name__ == "__main__":
+    main()
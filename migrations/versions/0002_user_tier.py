@@ -0,0 +1,23 @@
+"""Per-user tier selecting rate limits and queue priority
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 03:02:37.806114
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("tier", sa.String(length=50), nullable=False, server_default="free"))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("tier")
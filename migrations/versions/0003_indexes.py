@@ -0,0 +1,30 @@
+"""Indexes for history and status queries, one token account per user
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 03:05:12.118503
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("tokens") as batch_op:
+        batch_op.create_unique_constraint("uq_tokens_user_id", ["user_id"])
+
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.create_index("ix_usage_history_user_id_timestamp", ["user_id", "timestamp"])
+        batch_op.create_index("ix_usage_history_status", ["status"])
+
+
+def downgrade():
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.drop_index("ix_usage_history_status")
+        batch_op.drop_index("ix_usage_history_user_id_timestamp")
+
+    with op.batch_alter_table("tokens") as batch_op:
+        batch_op.drop_constraint("uq_tokens_user_id", type_="unique")
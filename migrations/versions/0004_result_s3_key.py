@@ -0,0 +1,23 @@
+"""Persist the S3 key of the result, presigned URLs are generated on demand
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 03:20:41.530977
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.add_column(sa.Column("result_s3_key", sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.drop_column("result_s3_key")
@@ -0,0 +1,23 @@
+"""Record the audio duration probed at submission
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 04:02:17.204581
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.add_column(sa.Column("audio_duration_s", sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("usage_history") as batch_op:
+        batch_op.drop_column("audio_duration_s")
@@ -0,0 +1,171 @@
+"""
+Header-only validation of submitted audio, done by the API before billing and queueing a task.
+
+Only the bytes libsndfile needs to read the header are touched, so probing an object in S3 through `s3.open_object`
+costs a few ranged reads instead of a download. MP4/M4A files, which libsndfile does not read and the workers decode
+through torchaudio, are measured from the media header box of their audio track, wherever the `moov` box lies in
+the file. Raw AAC and WebM, recognised by their signature, carry no duration in a header and are rejected as
+unsupported.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import soundfile as sf
+
+from src import config
+
+# Boxes walked at each level of an MP4 file, real files have a handful
+MAX_MP4_BOXES = 256
+
+
+class InvalidAudioError(ValueError):
+    pass
+
+
+class UnsupportedAudioError(InvalidAudioError):
+    """Audio in a container whose duration can not be read from its header"""
+
+
+@dataclass
+class AudioInfo:
+    format: str
+    sample_rate: int
+    channels: int
+    duration_s: float
+
+
+def sniff_container(header: bytes) -> Optional[str]:
+    """Format of a container libsndfile cannot read, recognised by its first bytes"""
+    if header[4:8] == b"ftyp":
+        return "MP4"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "WEBM"
+    # ADTS frame sync of raw AAC, MPEG layer bits set to zero unlike MP3
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xF6 == 0xF0:
+        return "AAC"
+    return None
+
+
+def probe_audio(file) -> AudioInfo:
+    """
+    Read the header of an audio file and check it can be processed
+
+    Args:
+        file: Seekable binary file object, its position is restored afterwards
+
+    Returns:
+        info: Container format, sample rate, channels and duration
+
+    Raises:
+        InvalidAudioError: If the file is not decodable audio, is empty or is longer than MAX_AUDIO_DURATION_S
+        UnsupportedAudioError: If the file is in a container whose duration can not be read (raw AAC, WebM)
+    """
+    position = file.tell()
+    try:
+        info = _probe_soundfile(file)
+        if info is None:
+            file.seek(position)
+            container = sniff_container(file.read(8))
+            if container == "MP4":
+                info = probe_mp4(file, position)
+            elif container is not None:
+                raise UnsupportedAudioError(f"{container} audio is not supported, convert it to WAV, FLAC or M4A")
+            else:
+                raise InvalidAudioError("Unsupported or corrupted audio file")
+    finally:
+        file.seek(position)
+
+    if info.duration_s <= 0 or info.sample_rate <= 0:
+        raise InvalidAudioError("Audio file is empty")
+    if info.duration_s > config.MAX_AUDIO_DURATION_S:
+        raise InvalidAudioError(f"Audio is limited to {config.MAX_AUDIO_DURATION_S:g} seconds")
+    return info
+
+
+def _probe_soundfile(file) -> Optional[AudioInfo]:
+    try:
+        info = sf.info(file)
+    except sf.SoundFileError:
+        return None
+    duration_s = info.frames / info.samplerate if info.samplerate > 0 else 0.0
+    return AudioInfo(format=info.format, sample_rate=info.samplerate, channels=info.channels, duration_s=duration_s)
+
+
+def probe_mp4(file, start: int = 0) -> AudioInfo:
+    """
+    Read the sample rate, channels and duration of the first audio track of an MP4 file
+
+    The duration and sample rate come from the media header (`mdhd`) of the track, its channels from the first entry
+    of the sample description (`stsd`). Only box headers are read, the media data is skipped over.
+    """
+    moov = _find_box(file, (b"", start, file.seek(0, 2)), b"moov")
+    for trak in _boxes(file, moov):
+        if trak[0] != b"trak":
+            continue
+        mdia = _find_box(file, trak, b"mdia")
+        hdlr = _read_box(file, _find_box(file, mdia, b"hdlr"), 12)
+        if hdlr[8:12] != b"soun":
+            continue
+
+        mdhd = _find_box(file, mdia, b"mdhd")
+        if _read_box(file, mdhd, 1)[0] == 1:
+            timescale, duration = struct.unpack(">IQ", _read_box(file, mdhd, 32)[20:32])
+        else:
+            timescale, duration = struct.unpack(">II", _read_box(file, mdhd, 20)[12:20])
+        if timescale == 0:
+            raise InvalidAudioError("Corrupted MP4 file")
+        # Fragmented files leave the duration of the track empty
+        if duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+            raise UnsupportedAudioError("Fragmented MP4 audio is not supported")
+
+        stbl = _find_box(file, _find_box(file, mdia, b"minf"), b"stbl")
+        stsd = _read_box(file, _find_box(file, stbl, b"stsd"), 34)
+        # Version and entry count, then the header of the first audio sample entry
+        (channels,) = struct.unpack(">H", stsd[32:34])
+        return AudioInfo(format="MP4", sample_rate=timescale, channels=channels, duration_s=duration / timescale)
+    raise InvalidAudioError("MP4 file has no audio track")
+
+
+def _boxes(file, parent: tuple[bytes, int, int]) -> Iterator[tuple[bytes, int, int]]:
+    """(type, payload start, payload end) of the boxes in the payload of a parent box of an MP4 file"""
+    _, offset, end = parent
+    for _ in range(MAX_MP4_BOXES):
+        if offset + 8 > end:
+            return
+        file.seek(offset)
+        size, box_type = struct.unpack(">I4s", _read_exactly(file, 8))
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", _read_exactly(file, 8))
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise InvalidAudioError("Corrupted MP4 file")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+    raise InvalidAudioError("Corrupted MP4 file")
+
+
+def _find_box(file, parent: tuple[bytes, int, int], box_type: bytes) -> tuple[bytes, int, int]:
+    for box in _boxes(file, parent):
+        if box[0] == box_type:
+            return box
+    raise InvalidAudioError(f"MP4 file has no {box_type.decode()} box")
+
+
+def _read_box(file, box: tuple[bytes, int, int], size: int) -> bytes:
+    _, start, end = box
+    if end - start < size:
+        raise InvalidAudioError("Corrupted MP4 file")
+    file.seek(start)
+    return _read_exactly(file, size)
+
+
+def _read_exactly(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise InvalidAudioError("Corrupted MP4 file")
+    return data
@@ -4,13 +4,24 @@ import dotenv
 
 dotenv.load_dotenv()
 
+
+def _parse_mapping(value: str) -> dict[str, float]:
+    """Parse "key=value,key=value" settings into a dict"""
+    return {key: float(item) for key, item in (pair.split("=") for pair in value.split(","))}
+
+
 # App Settings
 APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
 APP_PORT = int(os.getenv("APP_PORT", "8000"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # bearer token of Prometheus scrapes, GET /metrics is off without it
 LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
 
 # Database Settings
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+DATABASE_CREATE_TABLES = os.getenv("DATABASE_CREATE_TABLES", "true").lower() == "true"  # false when using migrations
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
 # Redis Settings
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
@@ -25,8 +36,76 @@ S3_SECRET_KEY = os.getenv("S3_SECRET_KEY", "minioadmin")
 S3_REGION = os.getenv("S3_REGION", "us-east-1")
 S3_UPLOADS_BUCKET = os.getenv("S3_UPLOADS_BUCKET", "audio-uploads")
 S3_RESULTS_BUCKET = os.getenv("S3_RESULTS_BUCKET", "audio-results")
+PRESIGNED_URL_EXPIRATION_S = int(os.getenv("PRESIGNED_URL_EXPIRATION_S", "3600"))
+PRESIGNED_URL_REFRESH_S = int(os.getenv("PRESIGNED_URL_REFRESH_S", "900"))  # minimal validity left on a cached URL
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv("PRESIGNED_URL_CACHE_SIZE", "10000"))
 
 # Model Settings
 DEFAULT_MODEL_DEVICE = os.getenv("DEFAULT_MODEL_DEVICE", "cuda")  # or cpu
 MODEL_CHUNK_DURATION = float(os.getenv("MODEL_CHUNK_DURATION", "30.0"))
 MODEL_CHUNK_OVERLAP = float(os.getenv("MODEL_CHUNK_OVERLAP", "1.0"))
+MODEL_DIR = os.getenv("MODEL_DIR", "./model_cache")  # weights converted by `python -m src.models.weights`
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "torch")  # onnx (ONNX Runtime on CPU) or identity (for benchmarks)
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 lets ONNX Runtime decide
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS", "0"))
+DEFAULT_OUTPUT_FORMAT = os.getenv("DEFAULT_OUTPUT_FORMAT", "flac")  # wav (16-bit PCM), flac, opus or mp3
+
+# Cache Settings
+TASK_CACHE_TTL_S = int(os.getenv("TASK_CACHE_TTL_S", str(24 * 60 * 60)))
+BALANCE_CACHE_TTL_S = int(os.getenv("BALANCE_CACHE_TTL_S", "300"))
+AUTH_CACHE_TTL_S = int(os.getenv("AUTH_CACHE_TTL_S", "60"))  # 0 disables in-process auth caching
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+# Worker Settings
+WORKER_QUEUES = os.getenv("WORKER_QUEUES", "enhance,denoise").split(",")
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "8001"))  # 0 disables the metrics exporter
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))  # forked processes sharing the model weights on CPU
+STATUS_FLUSH_INTERVAL_S = float(os.getenv("STATUS_FLUSH_INTERVAL_S", "2"))
+WORKER_PREFETCH_JOBS = int(os.getenv("WORKER_PREFETCH_JOBS", "1"))  # inputs loaded ahead of inference, 0 disables
+WORKER_UPLOAD_DEPTH = int(os.getenv("WORKER_UPLOAD_DEPTH", "1"))  # results uploaded in background, 0 uploads inline
+
+# Profiling Settings
+PROFILE_MODE = os.getenv("PROFILE_MODE", "off")  # off, cprofile or torch
+PROFILE_RTF_THRESHOLD = float(os.getenv("PROFILE_RTF_THRESHOLD", "1.0"))  # keep profiles of slower jobs, 0 disables
+PROFILE_TIERS = os.getenv("PROFILE_TIERS", "paid").split(",")  # tiers allowed to request and download profiles
+
+# Scheduling Settings
+QUEUE_PRIORITY_WEIGHTS = _parse_mapping(os.getenv("QUEUE_PRIORITY_WEIGHTS", "priority=6,short=3,long=1"))
+QUEUE_LONG_FILE_SIZE_MB = float(os.getenv("QUEUE_LONG_FILE_SIZE_MB", "10.0"))  # used when the duration is unknown
+QUEUE_LONG_DURATION_S = float(os.getenv("QUEUE_LONG_DURATION_S", "600"))
+PRIORITY_TIERS = os.getenv("PRIORITY_TIERS", "paid").split(",")
+
+# Fan-out Settings
+FANOUT_MIN_DURATION_S = float(os.getenv("FANOUT_MIN_DURATION_S", "1800"))  # split longer audio into jobs, 0 disables
+FANOUT_CHUNKS_PER_JOB = int(os.getenv("FANOUT_CHUNKS_PER_JOB", "4"))
+
+# Direct Upload Settings
+PRESIGNED_UPLOAD_EXPIRATION_S = int(os.getenv("PRESIGNED_UPLOAD_EXPIRATION_S", "3600"))
+MAX_UPLOAD_SIZE_MB = float(os.getenv("MAX_UPLOAD_SIZE_MB", "2048"))
+MULTIPART_PART_SIZE_MB = int(os.getenv("MULTIPART_PART_SIZE_MB", "64"))
+
+# Retention Settings
+RETENTION_INTERVAL_S = int(os.getenv("RETENTION_INTERVAL_S", "3600"))  # 0 disables the periodic retention job
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "10000"))  # objects deleted per step of a run
+RESULT_RETENTION_S = int(os.getenv("RESULT_RETENTION_S", str(7 * 24 * 60 * 60)))  # 0 keeps results forever
+UPLOAD_RETENTION_DAYS = int(os.getenv("UPLOAD_RETENTION_DAYS", "7"))  # lifecycle expiry of unprocessed uploads
+ORPHAN_GRACE_S = int(os.getenv("ORPHAN_GRACE_S", str(24 * 60 * 60)))  # minimal age of an orphaned result object
+ORPHAN_SCAN_PAGES = int(os.getenv("ORPHAN_SCAN_PAGES", "10"))  # pages of 1000 result objects checked per run
+
+# Input Validation Settings
+MAX_AUDIO_DURATION_S = float(os.getenv("MAX_AUDIO_DURATION_S", str(4 * 60 * 60)))
+DURATION_PRICING = os.getenv("DURATION_PRICING", "false").lower() == "true"  # charge the price per started minute
+
+# Idempotency Settings
+IDEMPOTENCY_TTL_S = int(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 60 * 60)))  # window for retries of a submission
+
+# Batch Settings
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "100"))
+BATCH_TTL_S = int(os.getenv("BATCH_TTL_S", str(7 * 24 * 60 * 60)))
+
+# Rate Limit Settings (per user tier, unknown tiers use "free")
+RATE_LIMIT_PER_MINUTE = _parse_mapping(os.getenv("RATE_LIMIT_PER_MINUTE", "free=30,paid=300"))
+RATE_LIMIT_BURST = _parse_mapping(os.getenv("RATE_LIMIT_BURST", "free=10,paid=50"))
+MAX_INFLIGHT_JOBS = _parse_mapping(os.getenv("MAX_INFLIGHT_JOBS", "free=4,paid=32"))
+INFLIGHT_JOB_TTL_S = int(os.getenv("INFLIGHT_JOB_TTL_S", str(6 * 60 * 60)))
+INFLIGHT_RETRY_AFTER_S = int(os.getenv("INFLIGHT_RETRY_AFTER_S", "10"))
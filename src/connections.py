@@ -1,18 +1,63 @@
 from contextlib import contextmanager
+from functools import lru_cache
 
 import redis
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from src import config
 from src.database.orm import Base
+from src.metrics import dependency_call, instrument_sqlalchemy
+
+instrument_sqlalchemy()
+
+
+class _InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        with dependency_call("redis", str(args[0]).upper()):
+            return super().execute_command(*args, **options)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers work alongside the single writer, busy_timeout makes writers wait for the lock instead of failing
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+@lru_cache
+def _database_engine(database_url: str) -> Engine:
+    if database_url.startswith("sqlite"):
+        # Opening an SQLite connection is cheap, and pooled connections would outlive a replaced database file
+        engine = create_engine(database_url, poolclass=NullPool)
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    else:
+        engine = create_engine(
+            database_url,
+            pool_size=config.DATABASE_POOL_SIZE,
+            max_overflow=config.DATABASE_MAX_OVERFLOW,
+            pool_pre_ping=True,
+        )
+
+    # Server databases are managed with Alembic migrations instead
+    if config.DATABASE_CREATE_TABLES:
+        Base.metadata.create_all(engine)
+    return engine
+
+
+@lru_cache
+def _session_factory(database_url: str) -> sessionmaker:
+    engine = _database_engine(database_url)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
 
 @contextmanager
 def _database_session():
-    engine = create_engine(config.DATABASE_URL)
-    Base.metadata.create_all(engine)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+    SessionLocal = _session_factory(config.DATABASE_URL)
     db = SessionLocal()
     try:
         yield db
@@ -20,6 +65,12 @@ def _database_session():
         db.close()
 
 
+@lru_cache(maxsize=1)
+def _redis_connection_pool():
+    # Shared by all clients of the process, so a request does not pay for a new connection
+    return redis.ConnectionPool(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB)
+
+
 def _redis_connection():
-    redis_conn = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB)
+    redis_conn = _InstrumentedRedis(connection_pool=_redis_connection_pool())
     return redis_conn
@@ -1,13 +1,33 @@
+import math
 from typing import Optional
 
+import redis
 from sqlalchemy.orm import Session
 
+from src import config
+from src.database.cache import cache_balance, cache_tasks, forget_tasks, task_snapshot
 from src.database.orm import Model, Token, UsageHistory
 
 
+def usage_price(price: float, audio_duration_s: Optional[float] = None) -> float:
+    """Tokens charged for one model use: the model price, per started minute of audio with DURATION_PRICING"""
+    if not config.DURATION_PRICING or audio_duration_s is None:
+        return price
+    return price * max(1, math.ceil(audio_duration_s / 60))
+
+
 class Billing:
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, redis_conn: Optional[redis.Redis] = None):
         self.db = db_session
+        self.redis_conn = redis_conn
+
+    def _cache(self, token: Token, usages: list[UsageHistory] = (), overwrite: bool = True):
+        """Mirror the committed balance and new usage entries to Redis, if a connection was given"""
+        if self.redis_conn is None:
+            return
+        cache_balance(self.redis_conn, token.user_id, token.amount, overwrite)
+        if usages:
+            cache_tasks(self.redis_conn, {usage.id: task_snapshot(usage) for usage in usages})
 
     def add_tokens(self, user_id: int, amount: float) -> bool:
         try:
@@ -18,38 +38,104 @@ class Billing:
             else:
                 token.amount += amount
             self.db.commit()
+            self._cache(token)
             return True
         except Exception as e:
             self.db.rollback()
             print(f"Error adding tokens: {e}")
             return False
 
-    def spend_tokens(self, user_id: int, model_name: str) -> bool:
+    def spend_tokens(
+        self, user_id: int, model_name: str, audio_duration_s: Optional[float] = None
+    ) -> Optional[UsageHistory]:
+        """Charge for one model use, returns the created usage entry"""
         try:
             token = self.db.query(Token).filter(Token.user_id == user_id).first()
             if not token:
-                return False
+                return None
 
             model = self.db.query(Model).filter(Model.name == model_name).first()
             if not model:
-                return False
+                return None
 
-            if token.amount < model.price:
-                return False
+            price = usage_price(model.price, audio_duration_s)
+            if token.amount < price:
+                return None
 
-            token.amount -= model.price
+            token.amount -= price
 
-            usage = UsageHistory(user_id=user_id, model_id=model.id, tokens_spent=model.price)
+            usage = UsageHistory(
+                user_id=user_id, model_id=model.id, tokens_spent=price, audio_duration_s=audio_duration_s
+            )
             self.db.add(usage)
             self.db.commit()
-            return True
+            self._cache(token, [usage])
+            return usage
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error spending tokens: {e}")
+            return None
+
+    def spend_tokens_batch(
+        self, user_id: int, model_name: str, count: int, audio_durations_s: Optional[list[Optional[float]]] = None
+    ) -> Optional[list[UsageHistory]]:
+        """Charge for `count` model uses in a single transaction, returns the created usage entries"""
+        try:
+            token = self.db.query(Token).filter(Token.user_id == user_id).first()
+            if not token:
+                return None
+
+            model = self.db.query(Model).filter(Model.name == model_name).first()
+            if not model:
+                return None
+
+            audio_durations_s = audio_durations_s or [None] * count
+            usages = [
+                UsageHistory(
+                    user_id=user_id,
+                    model_id=model.id,
+                    tokens_spent=usage_price(model.price, audio_duration_s),
+                    audio_duration_s=audio_duration_s,
+                )
+                for audio_duration_s in audio_durations_s
+            ]
+            total_price = sum(usage.tokens_spent for usage in usages)
+            if token.amount < total_price:
+                return None
+
+            token.amount -= total_price
+
+            self.db.add_all(usages)
+            self.db.commit()
+            self._cache(token, usages)
+            return usages
         except Exception as e:
             self.db.rollback()
             print(f"Error spending tokens: {e}")
+            return None
+
+    def refund_usages(self, usages: list[UsageHistory]) -> bool:
+        """Void the usage entries of submissions that failed after being charged, giving their tokens back"""
+        try:
+            token = self.db.query(Token).filter(Token.user_id == usages[0].user_id).first()
+            token.amount += sum(usage.tokens_spent for usage in usages)
+            task_ids = [usage.id for usage in usages]
+            for usage in usages:
+                self.db.delete(usage)
+            self.db.commit()
+            self._cache(token)
+            if self.redis_conn is not None:
+                forget_tasks(self.redis_conn, task_ids)
+            return True
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error refunding tokens: {e}")
             return False
 
     def get_token_balance(self, user_id: int) -> Optional[float]:
         token = self.db.query(Token).filter(Token.user_id == user_id).first()
+        if token:
+            self._cache(token, overwrite=False)
         return token.amount if token else None
 
     def get_usage_history(self, user_id: int) -> list:
@@ -0,0 +1,188 @@
+"""
+Redis copy of the most polled database state: task status and result URL, user token balance.
+
+Writers update the cache after every committed transition, readers serve from it and fall back to SQL on a miss.
+Cache errors are logged and never fail the caller, SQL stays the source of truth.
+
+Task status transitions made by workers are the exception: Redis holds them first, in the cache and in the
+`PENDING_STATUSES_KEY` hash, until the status flusher writes them to SQL in batches.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+import redis
+
+from src import config
+from src.database.orm import UsageHistory
+
+logger = logging.getLogger(__name__)
+
+TASK_FIELDS = ("user_id", "status", "tokens_spent", "timestamp")
+PENDING_STATUSES_KEY = "task_statuses:pending"
+FLUSHING_STATUSES_KEY = "task_statuses:flushing"
+
+
+def task_key(task_id: int) -> str:
+    return f"task:{task_id}"
+
+
+def profile_key(task_id: int) -> str:
+    """S3 key of the profile the worker uploaded for a task"""
+    return f"task:{task_id}:profile_s3_key"
+
+
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def task_snapshot(task: UsageHistory) -> dict:
+    """Fields of a usage entry kept in the cache"""
+    snapshot = {
+        "user_id": task.user_id,
+        "status": task.status,
+        "tokens_spent": task.tokens_spent,
+        # Naive UTC, as the timestamp reads back from the database
+        "timestamp": task.timestamp.replace(tzinfo=None).isoformat(),
+    }
+    if task.result_s3_key:
+        snapshot["result_s3_key"] = task.result_s3_key
+    return snapshot
+
+
+def cache_tasks(redis_conn: redis.Redis, snapshots: dict[int, dict], overwrite: bool = True):
+    """
+    Store task snapshots
+
+    Args:
+        redis_conn: Redis connection
+        snapshots: Task fields by task id, as produced by `task_snapshot`
+        overwrite: False when filling a miss from SQL, so a status written meanwhile by the worker is kept
+    """
+    try:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for task_id, snapshot in snapshots.items():
+                if overwrite:
+                    pipe.hset(task_key(task_id), mapping=snapshot)
+                else:
+                    for field, value in snapshot.items():
+                        pipe.hsetnx(task_key(task_id), field, value)
+                pipe.expire(task_key(task_id), config.TASK_CACHE_TTL_S)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache tasks: {e}")
+
+
+def forget_tasks(redis_conn: redis.Redis, task_ids: list[int]):
+    """Drop the snapshots of tasks removed from the database"""
+    try:
+        redis_conn.delete(*(task_key(task_id) for task_id in task_ids))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to forget cached tasks: {e}")
+
+
+def update_task_status(redis_conn: redis.Redis, task_id: int, status: str, result_s3_key: Optional[str] = None):
+    """
+    Record a status transition of a task, with the S3 key of its result once completed
+
+    The update is cached and queued for the SQL flush atomically. Unlike cache writes, errors are raised:
+    Redis is the only place the transition is kept until it is flushed.
+    """
+    fields = {"status": status}
+    if result_s3_key:
+        fields["result_s3_key"] = result_s3_key
+    with redis_conn.pipeline() as pipe:
+        pipe.hset(task_key(task_id), mapping=fields)
+        pipe.expire(task_key(task_id), config.TASK_CACHE_TTL_S)
+        pipe.hset(PENDING_STATUSES_KEY, task_id, json.dumps(fields))
+        pipe.execute()
+
+
+def decode_update(value: bytes) -> dict:
+    """Task update queued by `update_task_status`: status and, once completed, result_s3_key"""
+    if not value.startswith(b"{"):
+        # Queued as a bare status before result keys were flushed along with it
+        return {"status": value.decode()}
+    return json.loads(value)
+
+
+def get_unflushed_update(redis_conn: redis.Redis, task_id: int) -> Optional[dict]:
+    """Latest update of a task recorded by a worker but not yet written to SQL"""
+    with redis_conn.pipeline(transaction=False) as pipe:
+        pipe.hget(PENDING_STATUSES_KEY, task_id)
+        pipe.hget(FLUSHING_STATUSES_KEY, task_id)
+        pending, flushing = pipe.execute()
+    value = pending or flushing
+    return decode_update(value) if value else None
+
+
+def get_cached_updates(redis_conn: redis.Redis, task_ids: list[int]) -> dict[int, dict]:
+    """Cached status and result_s3_key of the tasks that have them"""
+    try:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hmget(task_key(task_id), "status", "result_s3_key")
+            cached = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached task statuses: {e}")
+        return {}
+    return {
+        task_id: {"status": status.decode(), "result_s3_key": result_s3_key.decode() if result_s3_key else None}
+        for task_id, (status, result_s3_key) in zip(task_ids, cached)
+        if status is not None
+    }
+
+
+def get_cached_task(redis_conn: redis.Redis, task_id: int) -> Optional[dict]:
+    """
+    Cached task fields, None on a miss or if only a partial status update is cached
+
+    Returns:
+        task: user_id, status, tokens_spent, timestamp and result_s3_key (None if not ready)
+    """
+    try:
+        cached = redis_conn.hgetall(task_key(task_id))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached task {task_id}: {e}")
+        return None
+
+    cached = {key.decode(): value.decode() for key, value in cached.items()}
+    if not all(field in cached for field in TASK_FIELDS):
+        return None
+    return {
+        "user_id": int(cached["user_id"]),
+        "status": cached["status"],
+        "tokens_spent": float(cached["tokens_spent"]),
+        "timestamp": datetime.fromisoformat(cached["timestamp"]),
+        "result_s3_key": cached.get("result_s3_key"),
+    }
+
+
+def cache_balance(redis_conn: redis.Redis, user_id: int, balance: float, overwrite: bool = True):
+    """
+    Store the committed token balance of a user
+
+    Concurrent writers may land out of order, the TTL bounds how long a stale balance can be served.
+    Pass `overwrite=False` when filling a miss from SQL, so a balance written meanwhile by a transaction is kept.
+    """
+    try:
+        with redis_conn.pipeline(transaction=False) as pipe:
+            if overwrite:
+                pipe.hset(user_key(user_id), "balance", balance)
+            else:
+                pipe.hsetnx(user_key(user_id), "balance", balance)
+            pipe.expire(user_key(user_id), config.BALANCE_CACHE_TTL_S)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache balance of user {user_id}: {e}")
+
+
+def get_cached_balance(redis_conn: redis.Redis, user_id: int) -> Optional[float]:
+    try:
+        balance = redis_conn.hget(user_key(user_id), "balance")
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read cached balance of user {user_id}: {e}")
+        return None
+    return float(balance) if balance is not None else None
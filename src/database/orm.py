@@ -1,6 +1,6 @@
 from datetime import UTC, datetime
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -13,12 +13,14 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     username = Column(String(50), unique=True, nullable=False)
     password = Column(String(100), nullable=False)
+    tier = Column(String(50), nullable=False, default="free", server_default="free")
     tokens = relationship("Token", back_populates="user")
     usage_history = relationship("UsageHistory", back_populates="user")
 
 
 class Token(Base):
     __tablename__ = "tokens"
+    __table_args__ = (UniqueConstraint("user_id", name="uq_tokens_user_id"),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -37,6 +39,11 @@ class Model(Base):
 
 class UsageHistory(Base):
     __tablename__ = "usage_history"
+    __table_args__ = (
+        # User history is listed newest first
+        Index("ix_usage_history_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_usage_history_status", "status"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -44,6 +51,8 @@ class UsageHistory(Base):
     tokens_spent = Column(Float, nullable=False)
     timestamp = Column(DateTime, default=lambda: datetime.now(UTC))
     status = Column(String(50), nullable=False, default="pending")
+    result_s3_key = Column(String(255), nullable=True)
+    audio_duration_s = Column(Float, nullable=True)
 
     user = relationship("User", back_populates="usage_history")
     model = relationship("Model", back_populates="usage_history")
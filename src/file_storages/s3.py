@@ -1,16 +1,23 @@
 import io
 import logging
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from functools import lru_cache
 
 import boto3
 from botocore.exceptions import ClientError
 
 from src import config
+from src.metrics import INFLIGHT_UPLOADS, instrument_boto3_client
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=1)
 def get_s3_client():
+    # boto3 clients are thread safe, one per process saves the connection setup and the health check per call
     s3_client = boto3.client(
         "s3",
         endpoint_url=f"http://{config.S3_HOST}:{config.S3_PORT}",
@@ -19,11 +26,31 @@ def get_s3_client():
         region_name=config.S3_REGION,
         config=boto3.session.Config(signature_version="s3v4"),
     )
+    instrument_boto3_client(s3_client)
     assert s3_client.list_buckets()
     return s3_client
 
 
-def upload_fileobj(file_data, original_filename=None, content_type=None, bucket=None):
+def generate_object_name(original_filename=None):
+    """
+    Generate a unique object name keeping the extension of the original file
+
+    Args:
+        original_filename: Original filename (optional)
+
+    Returns:
+        object_name: Unique name for the object in S3
+    """
+    ext = ""
+    if original_filename:
+        ext = original_filename.split(".")[-1] if "." in original_filename else ""
+        ext = f".{ext}" if ext else ""
+
+    return f"{uuid.uuid4()}{ext}"
+
+
+@INFLIGHT_UPLOADS.track_inprogress()
+def upload_fileobj(file_data, original_filename=None, content_type=None, bucket=None, object_name=None):
     """
     Upload a file-like object to S3
 
@@ -32,6 +59,7 @@ def upload_fileobj(file_data, original_filename=None, content_type=None, bucket=
         original_filename: Original filename (optional)
         content_type: MIME type of the file (optional)
         bucket: S3 bucket name, defaults to uploads bucket
+        object_name: Name of the object in S3, a unique one keeping the original extension is generated by default
 
     Returns:
         object_name: The name of the object in S3
@@ -39,13 +67,8 @@ def upload_fileobj(file_data, original_filename=None, content_type=None, bucket=
     if bucket is None:
         bucket = config.S3_UPLOADS_BUCKET
 
-    # Generate a unique filename
-    ext = ""
-    if original_filename:
-        ext = original_filename.split(".")[-1] if "." in original_filename else ""
-        ext = f".{ext}" if ext else ""
-
-    object_name = f"{uuid.uuid4()}{ext}"
+    if object_name is None:
+        object_name = generate_object_name(original_filename)
 
     s3_client = get_s3_client()
 
@@ -62,13 +85,14 @@ def upload_fileobj(file_data, original_filename=None, content_type=None, bucket=
         raise
 
 
-def upload_file(file_path, bucket=None):
+def upload_file(file_path, bucket=None, object_name=None):
     """
     Upload a file from disk to S3
 
     Args:
         file_path: Path to the file to upload
         bucket: S3 bucket name, defaults to uploads bucket
+        object_name: Name of the object in S3, a unique one is generated by default
 
     Returns:
         object_name: The name of the object in S3
@@ -76,12 +100,13 @@ def upload_file(file_path, bucket=None):
     if bucket is None:
         bucket = config.S3_UPLOADS_BUCKET
 
-    # Generate a unique filename
-    filename = file_path.split("/")[-1]
-    ext = filename.split(".")[-1] if "." in filename else ""
-    ext = f".{ext}" if ext else ""
+    if object_name is None:
+        # Generate a unique filename
+        filename = file_path.split("/")[-1]
+        ext = filename.split(".")[-1] if "." in filename else ""
+        ext = f".{ext}" if ext else ""
 
-    object_name = f"{uuid.uuid4()}{ext}"
+        object_name = f"{uuid.uuid4()}{ext}"
 
     s3_client = get_s3_client()
 
@@ -142,6 +167,192 @@ def download_file(object_name, file_path, bucket=None):
         raise
 
 
+def get_object_metadata(object_name, bucket=None):
+    """
+    Fetch object metadata with a HEAD request
+
+    Args:
+        object_name: Name of the object in S3
+        bucket: S3 bucket name, defaults to uploads bucket
+
+    Returns:
+        metadata: HEAD response (ContentLength, ContentType, ...), None if the object does not exist
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=object_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        logger.error(f"Error fetching object metadata from S3: {e}")
+        raise
+
+
+def delete_objects(object_names, bucket=None):
+    """
+    Delete objects with batched DeleteObjects requests, missing objects are ignored
+
+    Args:
+        object_names: Names of the objects in S3
+        bucket: S3 bucket name, defaults to uploads bucket
+
+    Returns:
+        deleted: Number of deleted objects
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+    object_names = list(object_names)
+    deleted = 0
+
+    try:
+        # DeleteObjects accepts at most 1000 keys per request
+        for offset in range(0, len(object_names), 1000):
+            response = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": name} for name in object_names[offset : offset + 1000]], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                logger.error(f"Error deleting {bucket}/{error['Key']} from S3: {error['Message']}")
+            deleted += min(1000, len(object_names) - offset) - len(response.get("Errors", []))
+        return deleted
+    except ClientError as e:
+        logger.error(f"Error deleting objects from S3: {e}")
+        raise
+
+
+def list_objects(bucket=None, prefix="", start_after=""):
+    """
+    List the objects of a bucket page by page, in key order
+
+    Args:
+        bucket: S3 bucket name, defaults to uploads bucket
+        prefix: Key prefix of the listed objects
+        start_after: Only objects with a key after this one are listed
+
+    Returns:
+        pages: Iterator over lists of up to 1000 objects (Key, LastModified, Size, ...)
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    try:
+        for page in s3_client.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix, StartAfter=start_after
+        ):
+            yield page.get("Contents", [])
+    except ClientError as e:
+        logger.error(f"Error listing objects in S3: {e}")
+        raise
+
+
+def get_lifecycle_rules(bucket=None):
+    """
+    Read the lifecycle configuration of a bucket
+
+    Args:
+        bucket: S3 bucket name, defaults to uploads bucket
+
+    Returns:
+        rules: Lifecycle rules of the bucket, empty if it has no lifecycle configuration
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    try:
+        return s3_client.get_bucket_lifecycle_configuration(Bucket=bucket)["Rules"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchLifecycleConfiguration":
+            return []
+        logger.error(f"Error reading lifecycle rules in S3: {e}")
+        raise
+
+
+def put_lifecycle_rules(rules, bucket=None):
+    """
+    Replace the lifecycle configuration of a bucket
+
+    Args:
+        rules: Lifecycle rules, as accepted by PutBucketLifecycleConfiguration
+        bucket: S3 bucket name, defaults to uploads bucket
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    try:
+        s3_client.put_bucket_lifecycle_configuration(Bucket=bucket, LifecycleConfiguration={"Rules": rules})
+        logger.info(f"Lifecycle rules applied to {bucket}")
+    except ClientError as e:
+        logger.error(f"Error applying lifecycle rules in S3: {e}")
+        raise
+
+
+class S3ObjectReader(io.RawIOBase):
+    """Seekable read-only view of an S3 object, every read is a ranged GET of the requested bytes"""
+
+    def __init__(self, object_name, size, bucket):
+        self.object_name = object_name
+        self.size = size
+        self.bucket = bucket
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        response = get_s3_client().get_object(
+            Bucket=self.bucket, Key=self.object_name, Range=f"bytes={self.position}-{end - 1}"
+        )
+        data = response["Body"].read()
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_object(object_name, size, bucket=None, buffer_size=64 * 1024):
+    """
+    Open an S3 object for random access reads without downloading it
+
+    Args:
+        object_name: Name of the object in S3
+        size: Size of the object in bytes, as returned by `get_object_metadata`
+        bucket: S3 bucket name, defaults to uploads bucket
+        buffer_size: Minimal size of a ranged read
+
+    Returns:
+        file: Seekable binary file object
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    return io.BufferedReader(S3ObjectReader(object_name, size, bucket), buffer_size=buffer_size)
+
+
 def generate_presigned_url(object_name, bucket=None, expiration=3600):
     """
     Generate a presigned URL for an object
@@ -167,3 +378,137 @@ def generate_presigned_url(object_name, bucket=None, expiration=3600):
     except ClientError as e:
         logger.error(f"Error generating presigned URL: {e}")
         raise
+
+
+_presigned_urls: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+_presigned_urls_lock = threading.Lock()
+
+
+def get_presigned_url(object_name, bucket=None):
+    """
+    Presigned URL for an object, reused from an in-process cache while it stays valid long enough
+
+    Signing is a local operation, the cache only spares repeated work for polled results.
+    A URL is reused until less than `PRESIGNED_URL_REFRESH_S` of its lifetime is left.
+
+    Args:
+        object_name: Name of the object in S3
+        bucket: S3 bucket name, defaults to results bucket
+
+    Returns:
+        presigned_url: The presigned URL
+    """
+    key = (bucket, object_name)
+    now = time.monotonic()
+    with _presigned_urls_lock:
+        cached = _presigned_urls.get(key)
+        if cached and cached[1] - now > config.PRESIGNED_URL_REFRESH_S:
+            _presigned_urls.move_to_end(key)
+            return cached[0]
+
+    presigned_url = generate_presigned_url(object_name, bucket=bucket, expiration=config.PRESIGNED_URL_EXPIRATION_S)
+
+    with _presigned_urls_lock:
+        _presigned_urls[key] = (presigned_url, now + config.PRESIGNED_URL_EXPIRATION_S)
+        _presigned_urls.move_to_end(key)
+        while len(_presigned_urls) > config.PRESIGNED_URL_CACHE_SIZE:
+            _presigned_urls.popitem(last=False)
+    return presigned_url
+
+
+def generate_presigned_upload_url(object_name, content_type=None, bucket=None, expiration=3600):
+    """
+    Generate a presigned URL for a direct PUT upload of an object
+
+    Args:
+        object_name: Name of the object in S3
+        content_type: MIME type the client must send with the upload (optional)
+        bucket: S3 bucket name, defaults to uploads bucket
+        expiration: Time in seconds for the URL to remain valid
+
+    Returns:
+        presigned_url: The presigned URL
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    params = {"Bucket": bucket, "Key": object_name}
+    if content_type:
+        params["ContentType"] = content_type
+
+    try:
+        return s3_client.generate_presigned_url("put_object", Params=params, ExpiresIn=expiration)
+    except ClientError as e:
+        logger.error(f"Error generating presigned upload URL: {e}")
+        raise
+
+
+def create_presigned_multipart_upload(object_name, part_count, content_type=None, bucket=None, expiration=3600):
+    """
+    Start a multipart upload and presign a PUT URL for every part
+
+    Args:
+        object_name: Name of the object in S3
+        part_count: Number of parts the client will upload
+        content_type: MIME type of the object (optional)
+        bucket: S3 bucket name, defaults to uploads bucket
+        expiration: Time in seconds for the URLs to remain valid
+
+    Returns:
+        upload_id: ID of the multipart upload
+        part_urls: Presigned URLs for parts 1..part_count
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    extra_args = {}
+    if content_type:
+        extra_args["ContentType"] = content_type
+
+    try:
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=object_name, **extra_args)["UploadId"]
+        part_urls = [
+            s3_client.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": bucket, "Key": object_name, "UploadId": upload_id, "PartNumber": part_number},
+                ExpiresIn=expiration,
+            )
+            for part_number in range(1, part_count + 1)
+        ]
+        return upload_id, part_urls
+    except ClientError as e:
+        logger.error(f"Error creating multipart upload: {e}")
+        raise
+
+
+def complete_multipart_upload(object_name, upload_id, part_etags, bucket=None):
+    """
+    Complete a multipart upload
+
+    Args:
+        object_name: Name of the object in S3
+        upload_id: ID of the multipart upload
+        part_etags: ETags returned for parts 1..N, in part order
+        bucket: S3 bucket name, defaults to uploads bucket
+    """
+    if bucket is None:
+        bucket = config.S3_UPLOADS_BUCKET
+
+    s3_client = get_s3_client()
+
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [{"PartNumber": number, "ETag": etag} for number, etag in enumerate(part_etags, start=1)]
+            },
+        )
+    except ClientError as e:
+        logger.error(f"Error completing multipart upload: {e}")
+        raise
@@ -0,0 +1,68 @@
+"""
+Idempotent submissions keyed by the client-supplied `Idempotency-Key` header.
+
+The first request with a key claims it with SET NX and a short-lived pending placeholder, then stores its response
+for `IDEMPOTENCY_TTL_S`. Retries of the same request get the stored response back without uploading, charging or
+queueing anything again. A retry arriving while the first request is still running sees the placeholder. A failed
+request releases its key so the client can retry it.
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+import redis
+
+from src import config
+
+# Covers the upload of the largest accepted file, a crashed API process frees the key after it
+PENDING_TTL_S = 15 * 60
+MAX_KEY_LENGTH = 255
+
+
+def _key(user_id: int, idempotency_key: str) -> str:
+    return f"user:{user_id}:idempotency:{idempotency_key}"
+
+
+def request_fingerprint(contents: bytes, **params) -> str:
+    """Digest of the uploaded file and the request parameters, a key reused for another request is rejected"""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(hashlib.sha256(contents).digest())
+    return digest.hexdigest()
+
+
+def claim_request(redis_conn: redis.Redis, user_id: int, idempotency_key: str, fingerprint: str) -> Optional[dict]:
+    """
+    Claim an idempotency key for a new request
+
+    Args:
+        redis_conn: Redis connection
+        user_id: ID of the user, keys are scoped per user
+        idempotency_key: Key sent by the client
+        fingerprint: Fingerprint of the request, as produced by `request_fingerprint`
+
+    Returns:
+        record: None if the key was claimed, otherwise the record of the request holding it: its `fingerprint`,
+            `status` ("pending" or "completed") and, once completed, its `response`
+    """
+    key = _key(user_id, idempotency_key)
+    placeholder = json.dumps({"status": "pending", "fingerprint": fingerprint})
+    # A record expiring between SET NX and GET leaves the key free, claiming it is retried once
+    for _ in range(2):
+        if redis_conn.set(key, placeholder, nx=True, ex=PENDING_TTL_S):
+            return None
+        record = redis_conn.get(key)
+        if record is not None:
+            return json.loads(record)
+    return None
+
+
+def complete_request(redis_conn: redis.Redis, user_id: int, idempotency_key: str, fingerprint: str, response: dict):
+    """Store the response of a claimed request, returned to its retries for `IDEMPOTENCY_TTL_S`"""
+    record = {"status": "completed", "fingerprint": fingerprint, "response": response}
+    redis_conn.set(_key(user_id, idempotency_key), json.dumps(record), ex=config.IDEMPOTENCY_TTL_S)
+
+
+def release_request(redis_conn: redis.Redis, user_id: int, idempotency_key: str):
+    """Free the key of a failed request"""
+    redis_conn.delete(_key(user_id, idempotency_key))
@@ -0,0 +1,133 @@
+import logging
+import math
+
+import redis
+from rq.job import Job
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] - bucket hash; ARGV - refill rate (tokens/s), burst, cost
+# Returns {allowed, retry_after_s}
+_TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate)
+
+if tokens < cost then
+    return {0, tostring((cost - tokens) / rate)}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - cost), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {1, '0'}
+"""
+
+# KEYS[1] - sorted set of in-flight job ids scored by lease expiry; ARGV - limit, lease ttl, job ids...
+# Returns 1 if all job ids were admitted, 0 otherwise
+_ACQUIRE_INFLIGHT_SCRIPT = """
+redis.replicate_commands()
+local limit = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) + #ARGV - 2 > limit then
+    return 0
+end
+
+for i = 3, #ARGV do
+    redis.call('ZADD', KEYS[1], now + ttl, ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+
+def _tier_limit(limits: dict[str, float], tier: str) -> float:
+    return limits.get(tier, limits["free"])
+
+
+def _inflight_key(user_id: int) -> str:
+    return f"user:{user_id}:inflight_jobs"
+
+
+def check_rate_limit(redis_conn: redis.Redis, user_id: int, tier: str, cost: int = 1) -> tuple[bool, int]:
+    """
+    Take `cost` tokens from the user's submission bucket
+
+    Args:
+        redis_conn: Redis connection
+        user_id: ID of the user
+        tier: Tier of the user
+        cost: Number of submissions to account for
+
+    Returns:
+        allowed: Whether the submission is allowed
+        retry_after: Seconds until enough tokens are refilled
+    """
+    rate = _tier_limit(config.RATE_LIMIT_PER_MINUTE, tier) / 60
+    burst = _tier_limit(config.RATE_LIMIT_BURST, tier)
+    if cost > burst:
+        return False, math.ceil(cost / rate)
+
+    script = redis_conn.register_script(_TOKEN_BUCKET_SCRIPT)
+    allowed, retry_after = script(keys=[f"user:{user_id}:rate_limit"], args=[rate, burst, cost])
+    return bool(allowed), math.ceil(float(retry_after))
+
+
+def max_batch_size(tier: str) -> int:
+    """Largest batch the tier can ever submit: every file takes a rate limit token and an in-flight slot"""
+    limit = min(_tier_limit(config.RATE_LIMIT_BURST, tier), _tier_limit(config.MAX_INFLIGHT_JOBS, tier))
+    return int(min(config.MAX_BATCH_SIZE, limit))
+
+
+def acquire_inflight_slots(redis_conn: redis.Redis, user_id: int, tier: str, job_ids: list[str]) -> bool:
+    """
+    Atomically reserve one in-flight slot per job for the user
+
+    Slots are leases that expire after INFLIGHT_JOB_TTL_S so a crashed worker cannot leak them.
+
+    Args:
+        redis_conn: Redis connection
+        user_id: ID of the user
+        tier: Tier of the user
+        job_ids: IDs of the jobs to be enqueued
+
+    Returns:
+        acquired: Whether the slots were reserved
+    """
+    script = redis_conn.register_script(_ACQUIRE_INFLIGHT_SCRIPT)
+    limit = _tier_limit(config.MAX_INFLIGHT_JOBS, tier)
+    return bool(script(keys=[_inflight_key(user_id)], args=[limit, config.INFLIGHT_JOB_TTL_S, *job_ids]))
+
+
+def release_inflight_slots(redis_conn: redis.Redis, user_id: int, job_ids: list[str]):
+    redis_conn.zrem(_inflight_key(user_id), *job_ids)
+
+
+def release_job_slot(job: Job, connection: redis.Redis, *args, **kwargs):
+    """
+    RQ success/failure/stopped callback freeing the job's in-flight slot
+
+    The slot is reserved under the ID of the job queued by the API, jobs continuing its task (the fan-out reducer)
+    name it in `job.meta["inflight_slot"]`.
+    """
+    user_id = job.meta.get("user_id")
+    if user_id is None:
+        return
+    slot_id = job.meta.get("inflight_slot", job.id)
+    try:
+        release_inflight_slots(connection, user_id, [slot_id])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release in-flight slot of job {slot_id}: {e}")
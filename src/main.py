@@ -1,6 +1,15 @@
+import asyncio
 import hashlib
 import io
+import mimetypes
+import secrets
+import threading
+import time
+import uuid
+import zipfile
+from collections import Counter, OrderedDict
 from contextlib import asynccontextmanager
+from typing import Optional
 
 import redis
 from fastapi import (
@@ -8,21 +17,51 @@ from fastapi import (
     FastAPI,
     File,
     Form,
+    Header,
     HTTPException,
+    Request,
+    Response,
     UploadFile,
     status,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from rq import Queue
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rq import Callback, Queue
 from sqlalchemy.exc import IntegrityError
 
 from src import config
+from src.audio_probe import AudioInfo, InvalidAudioError, UnsupportedAudioError, probe_audio
 from src.connections import _database_session, _redis_connection
 from src.database.billing import Billing
+from src.database.cache import (
+    cache_tasks,
+    get_cached_balance,
+    get_cached_task,
+    get_cached_updates,
+    get_unflushed_update,
+    profile_key,
+    task_snapshot,
+)
 from src.database.orm import Model, Token, UsageHistory, User
 from src.file_storages import s3
-from src.workers.models_info import MODELS_INFO
+from src.idempotency import MAX_KEY_LENGTH, claim_request, complete_request, release_request, request_fingerprint
+from src.limits import acquire_inflight_slots, check_rate_limit, max_batch_size, release_inflight_slots
+from src.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS, record_capacity
+from src.tracing import inject_context, span
+from src.workers.models_info import FANOUT_PLANNER, MODELS_INFO
+from src.workers.output_formats import parse_output_options
+from src.workers.retention import apply_lifecycle_rules, finish_job
+from src.workers.scheduling import (
+    add_backlog,
+    get_capacity,
+    get_queue_stats,
+    listen_queue_names,
+    queue_name,
+    select_priority_class,
+    should_fan_out,
+)
 
 
 @asynccontextmanager
@@ -39,11 +78,31 @@ async def lifespan(app: FastAPI):
     # if config.S3_RESULTS_BUCKET not in s3_client.list_buckets():
     #     s3_client.create_bucket(Bucket=config.S3_RESULTS_BUCKET)
 
+    await run_in_threadpool(apply_lifecycle_rules)
+
     yield
 
 
 app = FastAPI(title="Audio Enhancement API with Billing", lifespan=lifespan)
 security = HTTPBasic()
+metrics_security = HTTPBearer(auto_error=False)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        with span(f"{request.method} {request.url.path}", method=request.method):
+            response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template rather than raw path to keep label cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS.labels(method=request.method, route=route_path, status=status_code).inc()
+        HTTP_REQUEST_DURATION.labels(method=request.method, route=route_path).observe(time.perf_counter() - start)
 
 
 # Helper function to hash passwords
@@ -51,8 +110,232 @@ def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 
+def enforce_rate_limit(redis_conn: redis.Redis, user: User, cost: int = 1):
+    allowed, retry_after = check_rate_limit(redis_conn, user.id, user.tier, cost)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+def reserve_inflight_slots(redis_conn: redis.Redis, user: User, job_ids: list[str]):
+    if not acquire_inflight_slots(redis_conn, user.id, user.tier, job_ids):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many jobs in progress",
+            headers={"Retry-After": str(config.INFLIGHT_RETRY_AFTER_S)},
+        )
+
+
+def claim_idempotency_key(redis_conn: redis.Redis, user: User, idempotency_key: str, fingerprint: str):
+    """Claim the key of a new submission, returns the response of the original request for a retry"""
+    if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long",
+        )
+
+    record = claim_request(redis_conn, user.id, idempotency_key, fingerprint)
+    if record is None:
+        return None
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    if record["status"] != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is in progress",
+            headers={"Retry-After": str(config.INFLIGHT_RETRY_AFTER_S)},
+        )
+    return record["response"]
+
+
+def validate_audio(file) -> AudioInfo:
+    """Probe the header of submitted audio, rejecting files workers could not process"""
+    try:
+        return probe_audio(file)
+    except UnsupportedAudioError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except InvalidAudioError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def output_options(
+    output_format: Optional[str], output_sample_rate: Optional[int], preserve_channels: bool = False
+) -> dict:
+    try:
+        return {**parse_output_options(output_format, output_sample_rate), "preserve_channels": preserve_channels}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def job_options(
+    user: User,
+    profile: bool = False,
+    output: Optional[dict] = None,
+    fan_out: bool = False,
+    audio_duration_s: Optional[float] = None,
+    input_s3_key: Optional[str] = None,
+) -> dict:
+    """
+    Options shared by every enqueued model job: owner, trace context, output format, audio duration and the
+    callbacks releasing the in-flight slot and the input. A successful fan-out planner keeps both, its reducer job
+    releases them.
+    """
+    options = {
+        "meta": {
+            "user_id": user.id,
+            "trace_context": inject_context(),
+            "profile": profile,
+            "audio_duration_s": audio_duration_s,
+            "input_s3_key": input_s3_key,
+            **(output or {}),
+        },
+        "on_failure": Callback(finish_job),
+        "on_stopped": Callback(finish_job),
+    }
+    if not fan_out:
+        options["on_success"] = Callback(finish_job)
+    return options
+
+
+def model_job(
+    model_name: str,
+    s3_object_key: str,
+    task_id: int,
+    audio_duration_s: Optional[float] = None,
+    output: Optional[dict] = None,
+) -> tuple[str, tuple, bool]:
+    """
+    Job function and arguments of a task and whether it fans out: long audio goes to the planner that splits it over
+    workers, except channel-preserving tasks as the planner works on the mono mixture
+    """
+    if should_fan_out(audio_duration_s) and not (output or {}).get("preserve_channels"):
+        return FANOUT_PLANNER, (model_name, s3_object_key, task_id), True
+    return MODELS_INFO[model_name].worker, (s3_object_key, task_id), False
+
+
+def enqueue_model_job(
+    redis_conn: redis.Redis,
+    user: User,
+    model_name: str,
+    s3_object_key: str,
+    task_id: int,
+    file_size: int,
+    job_id: str,
+    profile: bool = False,
+    output: Optional[dict] = None,
+    audio_duration_s: Optional[float] = None,
+):
+    """Route a task by model and priority class and queue it, returns the job and its queue name"""
+    priority_class = select_priority_class(file_size, user.tier, audio_duration_s)
+    target_queue = queue_name(MODELS_INFO[model_name].queue, priority_class)
+
+    func, args, fan_out = model_job(model_name, s3_object_key, task_id, audio_duration_s, output)
+    with redis_conn.pipeline() as pipe:
+        job = Queue(target_queue, connection=redis_conn).enqueue(
+            func,
+            args=args,
+            job_id=job_id,
+            pipeline=pipe,
+            **job_options(
+                user,
+                profile,
+                output,
+                fan_out=fan_out,
+                audio_duration_s=audio_duration_s,
+                input_s3_key=s3_object_key,
+            ),
+        )
+        add_backlog(pipe, target_queue, audio_duration_s)
+        pipe.execute()
+    return job, target_queue
+
+
+def _uploads_key(user_id: int) -> str:
+    return f"user:{user_id}:uploads"
+
+
+def claim_uploaded_objects(redis_conn: redis.Redis, user: User, object_keys: list[str]):
+    """
+    Take objects uploaded by the user through /uploads/presign and not submitted yet, each can be submitted once
+
+    Objects of other users, or already queued for another task, are rejected: their inputs are deleted once their
+    task finishes.
+    """
+    if not object_keys:
+        return
+    with redis_conn.pipeline() as pipe:
+        for object_key in object_keys:
+            pipe.srem(_uploads_key(user.id), object_key)
+        claimed = pipe.execute()
+    if not all(claimed):
+        release_uploaded_objects(
+            redis_conn, user, [object_key for object_key, removed in zip(object_keys, claimed) if removed]
+        )
+        raise HTTPException(status_code=404, detail="S3 object not found")
+
+
+def release_uploaded_objects(redis_conn: redis.Redis, user: User, object_keys: list[str]):
+    """Return objects of a failed submission, so they can be submitted again"""
+    if object_keys:
+        redis_conn.sadd(_uploads_key(user.id), *object_keys)
+
+
+def get_upload_reservation(redis_conn: redis.Redis, user: User, upload_id: str) -> dict:
+    """Reservation of a direct upload made by the user, 404 if it does not exist"""
+    reservation = {key.decode(): value.decode() for key, value in redis_conn.hgetall(f"upload:{upload_id}").items()}
+    if not reservation or int(reservation["user_id"]) != user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return reservation
+
+
+def unpack_upload(filename: Optional[str], content_type: Optional[str], contents: bytes) -> list[tuple]:
+    """Expand a zip archive into its audio members, other uploads are passed through as is"""
+    is_zip = content_type in ("application/zip", "application/x-zip-compressed")
+    if not is_zip and not (filename or "").lower().endswith(".zip"):
+        return [(filename, content_type, contents)]
+
+    try:
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            members = [
+                info for info in archive.infolist() if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            ]
+            # Limits are checked against the central directory, nothing is decompressed before they pass
+            if len(members) > config.MAX_BATCH_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Batch is limited to {config.MAX_BATCH_SIZE} files",
+                )
+            max_size = config.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+            if any(info.file_size > max_size for info in members) or sum(info.file_size for info in members) > max_size:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid upload size")
+            return [(info.filename, mimetypes.guess_type(info.filename)[0], archive.read(info)) for info in members]
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid zip archive")
+
+
 # Authentication function
+_auth_cache: OrderedDict[str, tuple[float, str, User]] = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
+
 def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
+    # Polling endpoints authenticate on every call, so verified users are kept in process for a short while
+    with _auth_cache_lock:
+        cached = _auth_cache.get(credentials.username)
+        if cached and cached[0] <= time.monotonic():
+            del _auth_cache[credentials.username]
+            cached = None
+        elif cached:
+            _auth_cache.move_to_end(credentials.username)
+    if cached and cached[1] == hash_password(credentials.password):
+        return cached[2]
+
     with _database_session() as db:
         user = db.query(User).filter(User.username == credentials.username).first()
         if not user or user.password != hash_password(credentials.password):
@@ -61,6 +344,13 @@ def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
                 detail="Invalid credentials",
                 headers={"WWW-Authenticate": "Basic"},
             )
+        if config.AUTH_CACHE_TTL_S > 0:
+            with _auth_cache_lock:
+                _auth_cache[user.username] = (time.monotonic() + config.AUTH_CACHE_TTL_S, user.password, user)
+                _auth_cache.move_to_end(user.username)
+                # Least recently used users are dropped first, expired ones when they authenticate again
+                while len(_auth_cache) > config.AUTH_CACHE_SIZE:
+                    _auth_cache.popitem(last=False)
         return user
 
 
@@ -88,9 +378,13 @@ def create_user(username: str = Form(...), password: str = Form(...)):
 
 
 @app.post("/tokens/add/")
-def add_tokens(amount: float = Form(...), user: User = Depends(authenticate_user)):
+def add_tokens(
+    amount: float = Form(...),
+    user: User = Depends(authenticate_user),
+    redis_conn: redis.Redis = Depends(_redis_connection),
+):
     with _database_session() as db:
-        billing = Billing(db)
+        billing = Billing(db, redis_conn)
         if billing.add_tokens(user.id, amount):
             return {"message": f"Added {amount} tokens to account"}
         else:
@@ -101,9 +395,13 @@ def add_tokens(amount: float = Form(...), user: User = Depends(authenticate_user
 
 
 @app.get("/tokens/balance/")
-def get_balance(user: User = Depends(authenticate_user)):
+def get_balance(user: User = Depends(authenticate_user), redis_conn: redis.Redis = Depends(_redis_connection)):
+    balance = get_cached_balance(redis_conn, user.id)
+    if balance is not None:
+        return {"balance": balance}
+
     with _database_session() as db:
-        billing = Billing(db)
+        billing = Billing(db, redis_conn)
         balance = billing.get_token_balance(user.id)
         if balance is not None:
             return {"balance": balance}
@@ -112,10 +410,7 @@ def get_balance(user: User = Depends(authenticate_user)):
 
 
 @app.get("/usage/history/")
-def get_usage_history(
-    user: User = Depends(authenticate_user),
-    redis_conn: redis.Redis = Depends(_redis_connection),
-):
+def get_usage_history(user: User = Depends(authenticate_user)):
     """Get usage history for the user"""
     with _database_session() as db:
         billing = Billing(db)
@@ -123,14 +418,14 @@ def get_usage_history(
         result = []
         for entry in history:
             model_name = db.query(Model.name).filter(Model.id == entry.model_id).scalar()
-            # Get presigned URL from Redis if available
-            result_url = redis_conn.get(f"task:{entry.id}:result_url")
-            result_url = result_url.decode() if result_url else None
+            # Presign the result on demand, URLs are cached in process while valid
+            result_url = s3.get_presigned_url(entry.result_s3_key) if entry.result_s3_key else None
 
             result.append(
                 {
                     "model": model_name,
                     "tokens_spent": entry.tokens_spent,
+                    "audio_duration_s": entry.audio_duration_s,
                     "timestamp": entry.timestamp,
                     "result_url": result_url,
                 }
@@ -148,104 +443,545 @@ def list_models():
 
 @app.post("/models/use/")
 async def use_model(
+    response: Response,
     model_name: str = Form(...),
     audio_file: UploadFile = File(...),
+    profile: bool = Form(False),
+    output_format: Optional[str] = Form(None),
+    output_sample_rate: Optional[int] = Form(None),
+    preserve_channels: bool = Form(False),
+    idempotency_key: Optional[str] = Header(None),
     user: User = Depends(authenticate_user),
     redis_conn: redis.Redis = Depends(_redis_connection),
 ):
-    """Use a model to enhance audio, spending tokens"""
+    """
+    Use a model to enhance audio, spending tokens. `output_format` and `output_sample_rate` select the encoding of
+    the result, `preserve_channels` enhances every channel instead of the mono mixture, `profile` captures a profile
+    of the job. Retries sent with the same `Idempotency-Key` header return the original task.
+    """
+    output = output_options(output_format, output_sample_rate, preserve_channels)
+    if profile and user.tier not in config.PROFILE_TIERS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail=f"Profiling is not available for the {user.tier} tier"
+        )
+
     with _database_session() as db:
-        billing = Billing(db)
+        billing = Billing(db, redis_conn)
 
         # Check if model exists
         model = db.query(Model).filter(Model.name == model_name).first()
         if not model:
             raise HTTPException(status_code=404, detail="Model not found")
 
-        # Try to spend tokens
-        if not billing.spend_tokens(user.id, model_name):
-            raise HTTPException(
-                status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                detail="Insufficient tokens or model not found",
-            )
-
-        # Upload file to S3
         contents = await audio_file.read()
-        file_data = io.BytesIO(contents)
-        s3_object_key = s3.upload_fileobj(
-            file_data,
-            original_filename=audio_file.filename,
-            content_type=audio_file.content_type,
-        )
 
-        # Get the latest usage history entry for this transaction
-        history_entry = (
-            db.query(UsageHistory)
-            .filter(UsageHistory.user_id == user.id)
-            .order_by(UsageHistory.timestamp.desc())
-            .first()
-        )
+        # A retry returns the original task before being rate limited, charged, uploaded or queued again
+        if idempotency_key is not None:
+            fingerprint = request_fingerprint(contents, model_name=model_name, profile=profile, **output)
+            original = claim_idempotency_key(redis_conn, user, idempotency_key, fingerprint)
+            if original is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+                return original
+
+        try:
+            # Enforce per-user submission rate and in-flight job limits
+            enforce_rate_limit(redis_conn, user)
+
+            # Reject undecodable audio before charging and queueing
+            audio_info = validate_audio(io.BytesIO(contents))
+
+            job_id = uuid.uuid4().hex
+            reserve_inflight_slots(redis_conn, user, [job_id])
+
+            history_entry = None
+            try:
+                # Try to spend tokens
+                history_entry = billing.spend_tokens(user.id, model_name, audio_info.duration_s)
+                if not history_entry:
+                    raise HTTPException(
+                        status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                        detail="Insufficient tokens or model not found",
+                    )
+
+                # Upload file to S3
+                file_data = io.BytesIO(contents)
+                s3_object_key = s3.upload_fileobj(
+                    file_data,
+                    original_filename=audio_file.filename,
+                    content_type=audio_file.content_type,
+                )
+
+                # Queue the task
+                job, target_queue = enqueue_model_job(
+                    redis_conn,
+                    user,
+                    model_name,
+                    s3_object_key,
+                    history_entry.id,
+                    len(contents),
+                    job_id,
+                    profile,
+                    output,
+                    audio_info.duration_s,
+                )
+            except Exception:
+                release_inflight_slots(redis_conn, user.id, [job_id])
+                # The charge is committed, a failed upload or enqueue must not cost the client a retry
+                if history_entry:
+                    billing.refund_usages([history_entry])
+                raise
+
+            db.commit()
+        except Exception:
+            # The client may retry a failed request with the same key
+            if idempotency_key is not None:
+                release_request(redis_conn, user.id, idempotency_key)
+            raise
+
+    result = {
+        "message": "Model task queued successfully",
+        "job_id": job.id,
+        "task_id": history_entry.id,
+        "queue": target_queue,
+    }
+    if idempotency_key is not None:
+        complete_request(redis_conn, user.id, idempotency_key, fingerprint, result)
+    return result
+
+
+@app.post("/uploads/presign")
+def create_direct_upload(
+    model_name: str = Form(...),
+    filename: str = Form(...),
+    content_type: str = Form(...),
+    size: int = Form(...),
+    output_format: Optional[str] = Form(None),
+    output_sample_rate: Optional[int] = Form(None),
+    preserve_channels: bool = Form(False),
+    user: User = Depends(authenticate_user),
+    redis_conn: redis.Redis = Depends(_redis_connection),
+):
+    """Reserve a task and issue presigned URLs for uploading audio directly to S3"""
+    output = output_options(output_format, output_sample_rate, preserve_channels)
+    if model_name not in MODELS_INFO:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if not content_type.startswith("audio/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only audio uploads are accepted")
+    if not 0 < size <= config.MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid upload size")
+
+    enforce_rate_limit(redis_conn, user)
+
+    upload_id = uuid.uuid4().hex
+    s3_object_key = s3.generate_object_name(filename)
+    part_size = config.MULTIPART_PART_SIZE_MB * 1024 * 1024
+    reservation = {
+        "user_id": user.id,
+        "model_name": model_name,
+        "s3_object_key": s3_object_key,
+        "content_type": content_type,
+        # Redis hashes have no null or boolean values, an unset sample rate is left out
+        **{key: value for key, value in output.items() if value is not None and key != "preserve_channels"},
+        "preserve_channels": int(preserve_channels),
+    }
 
-        # Queue the task
-        job = Queue(connection=redis_conn).enqueue(
-            MODELS_INFO[model_name].worker,
-            args=(s3_object_key, history_entry.id),
+    if size <= part_size:
+        response = {
+            "url": s3.generate_presigned_upload_url(
+                s3_object_key, content_type=content_type, expiration=config.PRESIGNED_UPLOAD_EXPIRATION_S
+            )
+        }
+    else:
+        multipart_upload_id, part_urls = s3.create_presigned_multipart_upload(
+            s3_object_key,
+            part_count=-(-size // part_size),
+            content_type=content_type,
+            expiration=config.PRESIGNED_UPLOAD_EXPIRATION_S,
         )
+        reservation["multipart_upload_id"] = multipart_upload_id
+        response = {"part_size": part_size, "part_urls": part_urls}
+
+    with redis_conn.pipeline() as pipe:
+        pipe.hset(f"upload:{upload_id}", mapping=reservation)
+        pipe.expire(f"upload:{upload_id}", config.PRESIGNED_UPLOAD_EXPIRATION_S)
+        # The object may be submitted by its confirmation or in a batch, whichever comes first
+        pipe.sadd(_uploads_key(user.id), s3_object_key)
+        if config.UPLOAD_RETENTION_DAYS:
+            pipe.expire(_uploads_key(user.id), config.UPLOAD_RETENTION_DAYS * 24 * 60 * 60)
+        pipe.execute()
 
-        db.commit()
+    return {"upload_id": upload_id, "s3_object_key": s3_object_key, "content_type": content_type, **response}
+
+
+@app.post("/uploads/{upload_id}/confirm")
+def confirm_direct_upload(
+    upload_id: str,
+    part_etags: Optional[list[str]] = Form(None),
+    user: User = Depends(authenticate_user),
+    redis_conn: redis.Redis = Depends(_redis_connection),
+):
+    """Validate a direct upload and queue its task, spending tokens"""
+    get_upload_reservation(redis_conn, user, upload_id)
+    # Lock the reservation so concurrent confirmations queue the task only once
+    if not redis_conn.set(f"upload:{upload_id}:lock", 1, nx=True, ex=60):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is being confirmed")
+
+    try:
+        # Read again under the lock, a confirmation finishing in between has already deleted the reservation
+        reservation = get_upload_reservation(redis_conn, user, upload_id)
+        model_name = reservation["model_name"]
+        s3_object_key = reservation["s3_object_key"]
+        # The object can be submitted once, by this confirmation or in a batch
+        claim_uploaded_objects(redis_conn, user, [s3_object_key])
+        try:
+            output_sample_rate = reservation.get("output_sample_rate")
+            output = output_options(
+                reservation.get("output_format"),
+                int(output_sample_rate) if output_sample_rate else None,
+                reservation.get("preserve_channels") == "1",
+            )
+
+            # Validate the uploaded object without downloading it
+            metadata = s3.get_object_metadata(s3_object_key)
+            if metadata is None and "multipart_upload_id" in reservation:
+                if not part_etags:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Part ETags are required")
+                s3.complete_multipart_upload(s3_object_key, reservation["multipart_upload_id"], part_etags)
+                metadata = s3.get_object_metadata(s3_object_key)
+
+            if metadata is None:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File was not uploaded")
+            if metadata["ContentType"] != reservation["content_type"]:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unexpected content type")
+            if not 0 < metadata["ContentLength"] <= config.MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid upload size")
+            # Only the header is read, with ranged requests
+            audio_info = validate_audio(s3.open_object(s3_object_key, metadata["ContentLength"]))
+
+            with _database_session() as db:
+                billing = Billing(db, redis_conn)
+
+                job_id = uuid.uuid4().hex
+                reserve_inflight_slots(redis_conn, user, [job_id])
+
+                history_entry = None
+                try:
+                    # Try to spend tokens
+                    history_entry = billing.spend_tokens(user.id, model_name, audio_info.duration_s)
+                    if not history_entry:
+                        raise HTTPException(
+                            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                            detail="Insufficient tokens or model not found",
+                        )
+
+                    # Queue the task
+                    job, target_queue = enqueue_model_job(
+                        redis_conn,
+                        user,
+                        model_name,
+                        s3_object_key,
+                        history_entry.id,
+                        metadata["ContentLength"],
+                        job_id,
+                        output=output,
+                        audio_duration_s=audio_info.duration_s,
+                    )
+                except Exception:
+                    release_inflight_slots(redis_conn, user.id, [job_id])
+                    if history_entry:
+                        billing.refund_usages([history_entry])
+                    raise
+        except Exception:
+            release_uploaded_objects(redis_conn, user, [s3_object_key])
+            raise
+
+        redis_conn.delete(f"upload:{upload_id}")
+    finally:
+        redis_conn.delete(f"upload:{upload_id}:lock")
 
     return {
         "message": "Model task queued successfully",
         "job_id": job.id,
         "task_id": history_entry.id,
+        "queue": target_queue,
     }
 
 
-@app.get("/tasks/{task_id}")
-def get_task_status(
-    task_id: int,
+@app.post("/models/use/batch")
+async def use_model_batch(
+    model_name: str = Form(...),
+    audio_files: Optional[list[UploadFile]] = File(None),
+    s3_object_keys: Optional[list[str]] = Form(None),
+    output_format: Optional[str] = Form(None),
+    output_sample_rate: Optional[int] = Form(None),
+    preserve_channels: bool = Form(False),
     user: User = Depends(authenticate_user),
     redis_conn: redis.Redis = Depends(_redis_connection),
 ):
+    """Use a model on many audio files (or a zip archive, or already uploaded S3 objects) at once"""
+    output = output_options(output_format, output_sample_rate, preserve_channels)
+    audio_files = audio_files or []
+    s3_object_keys = s3_object_keys or []
+
     with _database_session() as db:
-        task = db.query(UsageHistory).filter(UsageHistory.id == task_id, UsageHistory.user_id == user.id).first()
+        billing = Billing(db, redis_conn)
 
-        if not task:
-            raise HTTPException(status_code=404, detail="Task not found")
+        # Check if model exists
+        model = db.query(Model).filter(Model.name == model_name).first()
+        if not model:
+            raise HTTPException(status_code=404, detail="Model not found")
+
+        # Collect inputs: uploaded files with zip archives unpacked, and existing objects in the uploads bucket
+        uploads = []
+        for audio_file in audio_files:
+            uploads.extend(unpack_upload(audio_file.filename, audio_file.content_type, await audio_file.read()))
+
+        count = len(uploads) + len(s3_object_keys)
+        if count == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No audio files provided")
+        # A larger batch would never fit the rate limit bucket or the in-flight slots, retrying it is pointless
+        if count > max_batch_size(user.tier):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Batch is limited to {max_batch_size(user.tier)} files for the {user.tier} tier",
+            )
+
+        # Every file counts as a submission
+        enforce_rate_limit(redis_conn, user, cost=count)
 
-        # Get the result URL from Redis
-        result_url = redis_conn.get(f"task:{task_id}:result_url")
-        result_url = result_url.decode() if result_url else None
+        if len(set(s3_object_keys)) != len(s3_object_keys):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate S3 object keys")
+        # Only objects uploaded by the user and not submitted yet, their inputs are deleted once their task finishes
+        claim_uploaded_objects(redis_conn, user, s3_object_keys)
+
+        try:
+            existing_objects = await asyncio.gather(
+                *(run_in_threadpool(s3.get_object_metadata, object_key) for object_key in s3_object_keys)
+            )
+            if any(metadata is None for metadata in existing_objects):
+                raise HTTPException(status_code=404, detail="S3 object not found")
+
+            # Reject undecodable audio before charging, existing objects are probed with ranged reads of their headers
+            audio_infos = [validate_audio(io.BytesIO(contents)) for _, _, contents in uploads]
+            audio_infos += await asyncio.gather(
+                *(
+                    run_in_threadpool(validate_audio, s3.open_object(object_key, metadata["ContentLength"]))
+                    for object_key, metadata in zip(s3_object_keys, existing_objects)
+                )
+            )
+            durations_s = [audio_info.duration_s for audio_info in audio_infos]
+
+            job_ids = [uuid.uuid4().hex for _ in range(count)]
+            reserve_inflight_slots(redis_conn, user, job_ids)
+
+            history_entries = None
+            try:
+                # Charge for the whole batch in one transaction
+                history_entries = billing.spend_tokens_batch(user.id, model_name, count, durations_s)
+                if not history_entries:
+                    raise HTTPException(
+                        status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                        detail="Insufficient tokens or model not found",
+                    )
+
+                # Upload files to S3 concurrently
+                uploaded_keys = await asyncio.gather(
+                    *(
+                        run_in_threadpool(
+                            s3.upload_fileobj,
+                            io.BytesIO(contents),
+                            original_filename=filename,
+                            content_type=content_type,
+                        )
+                        for filename, content_type, contents in uploads
+                    )
+                )
+                object_keys = [*uploaded_keys, *s3_object_keys]
+                sizes = [len(contents) for _, _, contents in uploads]
+                sizes += [metadata["ContentLength"] for metadata in existing_objects]
+
+                # Route every task by priority class and enqueue all jobs in one Redis pipeline
+                job_datas = {}
+                backlog_audio_s = {}
+                for job_id, object_key, size, duration_s, history_entry in zip(
+                    job_ids, object_keys, sizes, durations_s, history_entries
+                ):
+                    priority_class = select_priority_class(size, user.tier, duration_s)
+                    target_queue = queue_name(MODELS_INFO[model_name].queue, priority_class)
+                    func, args, fan_out = model_job(model_name, object_key, history_entry.id, duration_s, output)
+                    job_datas.setdefault(target_queue, []).append(
+                        Queue.prepare_data(
+                            func,
+                            args=args,
+                            job_id=job_id,
+                            **job_options(
+                                user,
+                                output=output,
+                                fan_out=fan_out,
+                                audio_duration_s=duration_s,
+                                input_s3_key=object_key,
+                            ),
+                        )
+                    )
+                    backlog_audio_s[target_queue] = backlog_audio_s.get(target_queue, 0.0) + duration_s
+
+                batch_id = uuid.uuid4().hex
+                task_ids = [history_entry.id for history_entry in history_entries]
+                with redis_conn.pipeline() as pipe:
+                    for target_queue, queue_job_datas in job_datas.items():
+                        Queue(target_queue, connection=redis_conn).enqueue_many(queue_job_datas, pipeline=pipe)
+                        add_backlog(pipe, target_queue, backlog_audio_s[target_queue])
+                    pipe.hset(
+                        f"batch:{batch_id}",
+                        mapping={"user_id": user.id, "task_ids": ",".join(map(str, task_ids))},
+                    )
+                    pipe.expire(f"batch:{batch_id}", config.BATCH_TTL_S)
+                    pipe.execute()
+            except Exception:
+                release_inflight_slots(redis_conn, user.id, job_ids)
+                if history_entries:
+                    billing.refund_usages(history_entries)
+                raise
+        except Exception:
+            release_uploaded_objects(redis_conn, user, s3_object_keys)
+            raise
 
     return {
-        "id": task.id,
-        "result_url": result_url,
-        "tokens_spent": task.tokens_spent,
-        "timestamp": task.timestamp,
-        "status": task.status,
+        "message": "Batch queued successfully",
+        "batch_id": batch_id,
+        "task_ids": task_ids,
+        "job_ids": job_ids,
     }
 
 
-@app.get("/results/{task_id}")
-def get_result(
-    task_id: int,
+@app.get("/batches/{batch_id}")
+def get_batch_status(
+    batch_id: str,
     user: User = Depends(authenticate_user),
     redis_conn: redis.Redis = Depends(_redis_connection),
 ):
+    batch = redis_conn.hgetall(f"batch:{batch_id}")
+    if not batch or int(batch[b"user_id"]) != user.id:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    task_ids = [int(task_id) for task_id in batch[b"task_ids"].decode().split(",")]
     with _database_session() as db:
-        task = db.query(UsageHistory).filter(UsageHistory.id == task_id, UsageHistory.user_id == user.id).first()
+        tasks = db.query(UsageHistory).filter(UsageHistory.id.in_(task_ids)).all()
+
+    # Workers record statuses in Redis first, the database catches up on the next status flush
+    updates = {task.id: {"status": task.status, "result_s3_key": task.result_s3_key} for task in tasks}
+    updates.update(get_cached_updates(redis_conn, list(updates)))
+
+    return {
+        "batch_id": batch_id,
+        "total": len(task_ids),
+        "statuses": dict(Counter(task_update["status"] for task_update in updates.values())),
+        "tasks": [
+            {
+                "id": task_id,
+                "status": task_update["status"],
+                "result_url": s3.get_presigned_url(task_update["result_s3_key"])
+                if task_update["result_s3_key"]
+                else None,
+            }
+            for task_id, task_update in updates.items()
+        ],
+    }
 
-        if not task:
+
+@app.get("/queues/")
+def list_queues(user: User = Depends(authenticate_user), redis_conn: redis.Redis = Depends(_redis_connection)):
+    """Queue depth and wait time statistics per queue"""
+    base_queues = sorted({model_info.queue for model_info in MODELS_INFO.values()})
+    return get_queue_stats(redis_conn, listen_queue_names(base_queues))
+
+
+@app.get("/system/capacity")
+def get_system_capacity(user: User = Depends(authenticate_user), redis_conn: redis.Redis = Depends(_redis_connection)):
+    """Backlog in audio seconds, active workers and estimated drain time per model queue, for autoscaling"""
+    return get_capacity(redis_conn, sorted({model_info.queue for model_info in MODELS_INFO.values()}))
+
+
+def authorize_scraper(credentials: Optional[HTTPAuthorizationCredentials] = Depends(metrics_security)):
+    """Scrapers present `METRICS_TOKEN` as a bearer token, the endpoint is disabled while no token is configured"""
+    if not config.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, config.METRICS_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(authorize_scraper)])
+def metrics(redis_conn: redis.Redis = Depends(_redis_connection)):
+    """Prometheus metrics of the API process, with the capacity estimates of the model queues"""
+    try:
+        record_capacity(get_capacity(redis_conn, sorted({model_info.queue for model_info in MODELS_INFO.values()})))
+    except redis.RedisError:
+        pass
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def load_task(redis_conn: redis.Redis, user: User, task_id: int) -> dict:
+    """Task status and result URL of the user, from the Redis cache or from SQL on a miss"""
+    task = get_cached_task(redis_conn, task_id)
+    if task is None:
+        with _database_session() as db:
+            entry = db.query(UsageHistory).filter(UsageHistory.id == task_id).first()
+        if not entry:
             raise HTTPException(status_code=404, detail="Task not found")
 
-        # Get the result URL from Redis
-        result_url = redis_conn.get(f"task:{task_id}:result_url")
+        task = {**task_snapshot(entry), **(get_unflushed_update(redis_conn, task_id) or {})}
+        cache_tasks(redis_conn, {task_id: task}, overwrite=False)
+        task["timestamp"] = entry.timestamp
+
+    if task["user_id"] != user.id:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    result_s3_key = task.get("result_s3_key")
+    task["result_url"] = s3.get_presigned_url(result_s3_key) if result_s3_key else None
+    return task
+
+
+@app.get("/tasks/{task_id}")
+def get_task_status(
+    task_id: int,
+    user: User = Depends(authenticate_user),
+    redis_conn: redis.Redis = Depends(_redis_connection),
+):
+    task = load_task(redis_conn, user, task_id)
+
+    # Profiles show the internals of the worker, only tiers allowed to request them get a link
+    profile_url = None
+    if user.tier in config.PROFILE_TIERS:
+        profile_s3_key = redis_conn.get(profile_key(task_id))
+        profile_url = s3.get_presigned_url(profile_s3_key.decode()) if profile_s3_key else None
+
+    return {
+        "id": task_id,
+        "result_url": task["result_url"],
+        "profile_url": profile_url,
+        "tokens_spent": task["tokens_spent"],
+        "timestamp": task["timestamp"],
+        "status": task["status"],
+    }
+
+
+@app.get("/results/{task_id}")
+def get_result(
+    task_id: int,
+    user: User = Depends(authenticate_user),
+    redis_conn: redis.Redis = Depends(_redis_connection),
+):
+    task = load_task(redis_conn, user, task_id)
 
-        if not result_url:
-            raise HTTPException(status_code=404, detail="Result not found")
+    if not task["result_url"]:
+        raise HTTPException(status_code=404, detail="Result not found")
 
-        # Redirect to the presigned URL
-    return RedirectResponse(url=result_url.decode())
+    # Redirect to the presigned URL
+    return RedirectResponse(url=task["result_url"])
 
 
 if __name__ == "__main__":
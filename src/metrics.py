@@ -0,0 +1,130 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.tracing import span
+
+# API
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+DEPENDENCY_CALL_DURATION = Histogram(
+    "dependency_call_duration_seconds", "Latency of DB, Redis and S3 calls", ["dependency", "operation"]
+)
+INFLIGHT_UPLOADS = Gauge("inflight_uploads", "Uploads to S3 in progress in the API process")
+QUEUE_BACKLOG_AUDIO = Gauge("queue_backlog_audio_seconds", "Seconds of audio waiting in a model queue", ["queue"])
+QUEUE_ACTIVE_WORKERS = Gauge("queue_active_workers", "Workers registered on a model queue", ["queue"])
+QUEUE_DRAIN_TIME = Gauge(
+    "queue_drain_time_seconds", "Estimated time for the workers of a model queue to process its backlog", ["queue"]
+)
+
+# Worker
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds",
+    "Time between enqueueing and start of a job",
+    ["queue"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+JOB_STAGE_DURATION = Histogram(
+    "job_stage_duration_seconds",
+    "Duration of job processing stages",
+    ["model", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+AUDIO_SECONDS_PROCESSED = Counter("audio_seconds_processed_total", "Seconds of input audio processed", ["model"])
+JOB_PROCESSING_SECONDS = Counter("job_processing_seconds_total", "Wall time spent processing jobs", ["model"])
+JOB_SPEED = Gauge("job_speed_ratio", "Audio seconds processed per wall second in the last job", ["model"])
+MODEL_LOAD_DURATION = Histogram("model_load_seconds", "Time to load a model", ["model"])
+PEAK_RSS = Gauge("process_peak_resident_memory_bytes", "Peak resident memory of the process")
+UNIQUE_MEMORY = Gauge(
+    "process_unique_memory_bytes", "Memory private to the process (USS), excluding pages shared with other processes"
+)
+WORKER_READY_DURATION = Gauge("worker_ready_seconds", "Time from the start of the worker process to serving jobs")
+
+
+@contextmanager
+def stage(model: str, name: str, **attributes):
+    """Time a job processing stage and trace it as a span"""
+    with span(name, model=model, **attributes), JOB_STAGE_DURATION.labels(model=model, stage=name).time():
+        yield
+
+
+@contextmanager
+def dependency_call(dependency: str, operation: str):
+    with DEPENDENCY_CALL_DURATION.labels(dependency=dependency, operation=operation).time():
+        yield
+
+
+def record_job_throughput(model: str, audio_s: float, wall_s: float):
+    AUDIO_SECONDS_PROCESSED.labels(model=model).inc(audio_s)
+    JOB_PROCESSING_SECONDS.labels(model=model).inc(wall_s)
+    JOB_SPEED.labels(model=model).set(audio_s / wall_s if wall_s else 0.0)
+    record_memory()
+
+
+def record_capacity(capacity: list[dict]):
+    """Export the capacity estimates of `get_capacity`, an unknown drain time as NaN"""
+    for queue in capacity:
+        QUEUE_BACKLOG_AUDIO.labels(queue=queue["queue"]).set(queue["backlog_audio_s"])
+        QUEUE_ACTIVE_WORKERS.labels(queue=queue["queue"]).set(queue["active_workers"])
+        drain_time_s = queue["drain_time_s"]
+        QUEUE_DRAIN_TIME.labels(queue=queue["queue"]).set(float("nan") if drain_time_s is None else drain_time_s)
+
+
+def record_memory():
+    # ru_maxrss is reported in kilobytes on Linux
+    PEAK_RSS.set(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    UNIQUE_MEMORY.set(unique_memory())
+
+
+def unique_memory() -> int:
+    """Unique set size of the current process: resident pages not shared with any other process"""
+    with open("/proc/self/smaps_rollup") as f:
+        return sum(int(line.split()[1]) * 1024 for line in f if line.startswith(("Private_Clean:", "Private_Dirty:")))
+
+
+def process_uptime(pid: Optional[int] = None) -> float:
+    """Seconds since the start of a process, the current one by default, imports included"""
+    with open(f"/proc/{pid or 'self'}/stat") as f:
+        # starttime, the 22nd field, counts clock ticks since boot
+        start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+    return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    operation = statement.lstrip().split(" ", 1)[0].upper()
+    DEPENDENCY_CALL_DURATION.labels(dependency="db", operation=operation).observe(elapsed)
+
+
+def instrument_sqlalchemy():
+    """Observe the duration of every SQL statement executed by any engine"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_s3_call(model, context, **kwargs):
+    context["metrics_start_time"] = time.perf_counter()
+
+
+def _after_s3_call(model, context, **kwargs):
+    if "metrics_start_time" in context:
+        elapsed = time.perf_counter() - context["metrics_start_time"]
+        DEPENDENCY_CALL_DURATION.labels(dependency="s3", operation=model.name).observe(elapsed)
+
+
+def instrument_boto3_client(client):
+    """Observe the duration of every API call made by a boto3 client"""
+    client.meta.events.register("before-call.s3.*", _before_s3_call)
+    client.meta.events.register("after-call.s3.*", _after_s3_call)
+    return client
@@ -1,11 +1,14 @@
+import copy
 from typing import Optional, Tuple
 
 import torch
-from resemble_enhance.enhancer.inference import load_enhancer
 from torch.nn.functional import pad
 from torchaudio.functional import resample
 from torchaudio.transforms import MelSpectrogram
 
+from src.models.onnx_backend import use_onnx_runtime
+from src.models.weights import load_enhancer
+
 
 class EnhancerModel:
     def __init__(
@@ -17,11 +20,12 @@ class EnhancerModel:
         tau: float = 0.5,
         chunk_duration_s: float = 30.0,
         chunk_overlap_s: float = 1.0,
+        backend: str = "torch",
     ) -> None:
         self._device = device
-        self._model = load_enhancer(None, device)
-        self._model.configurate_(nfe=nfe, solver=solver, lambd=lambd, tau=tau)
-        self._model.eval()
+        self._model = self._load_model(device, nfe=nfe, solver=solver, lambd=lambd, tau=tau)
+        if backend == "onnx":
+            self._model = use_onnx_runtime(self._model)
 
         self._sample_rate = 44100
 
@@ -35,15 +39,23 @@ class EnhancerModel:
     def sample_rate(self):
         return self._sample_rate
 
-    def enhance_audio(self, audio: torch.Tensor, sample_rate: int) -> Tuple[torch.Tensor, int]:
+    def _load_model(self, device: str, nfe: int, solver: str, lambd: float, tau: float) -> torch.nn.Module:
+        model = load_enhancer(device)
+        model.configurate_(nfe=nfe, solver=solver, lambd=lambd, tau=tau)
+        model.eval()
+        return model
+
+    def enhance_audio(
+        self, audio: torch.Tensor, sample_rate: int, preserve_channels: bool = False
+    ) -> Tuple[torch.Tensor, int]:
+        if preserve_channels and audio.shape[0] > 1:
+            return self._enhance_channels(audio, sample_rate)
+
         batched_chunks, audio_length = self._preprocess_audio(audio, sample_rate)
 
         assert batched_chunks.ndim == 2
 
-        batched_chunks = batched_chunks.to(self._device)
-        with torch.inference_mode() and torch.no_grad():
-            batched_result = self._model(batched_chunks)
-            batched_result = batched_result.to("cpu")
+        batched_result = self._forward(batched_chunks)
 
         enhanced_audio = self._postprocess_audio(batched_result, audio_length)
 
@@ -51,7 +63,44 @@ class EnhancerModel:
         assert enhanced_audio.shape[0] == 1
         return enhanced_audio, self._sample_rate
 
+    def _enhance_channels(self, audio: torch.Tensor, sample_rate: int) -> Tuple[torch.Tensor, int]:
+        """
+        Enhance every channel of (C, T) audio separately, the chunks of all channels going through the same batched
+        forward passes. Channels share the offset alignment, so they stay in sync, and keep their relative levels.
+        """
+        channels = self._to_model_rate(audio, sample_rate)
+        audio_length = channels.shape[1]
+
+        chunks = torch.stack([self._chunk(channel) for channel in channels])  # (C, N, chunk_length)
+        peaks = chunks.abs().amax(dim=2, keepdim=True)
+        peaks[peaks == 0] = 10e-7
+
+        batched_result = self._forward((chunks / peaks).flatten(0, 1)).unflatten(0, chunks.shape[:2])
+        # The network outputs peak-normalized chunks, scale them back relative to the loudest channel
+        batched_result = batched_result * (peaks / peaks.amax(dim=0, keepdim=True))
+
+        offsets = self._compute_offsets(batched_result.mean(dim=0))
+        enhanced_audio = torch.cat(
+            [self._overlap_add(channel_chunks, offsets, audio_length) for channel_chunks in batched_result]
+        )
+
+        assert enhanced_audio.shape[0] == audio.shape[0]
+        return enhanced_audio, self._sample_rate
+
+    def _forward(self, batched_chunks: torch.Tensor) -> torch.Tensor:
+        batched_chunks = batched_chunks.to(self._device)
+        with torch.inference_mode() and torch.no_grad():
+            batched_result = self._model(batched_chunks)
+            batched_result = batched_result.to("cpu")
+        return batched_result
+
     def _preprocess_audio(self, audio: torch.Tensor, sample_rate: int) -> Tuple[torch.Tensor, int]:
+        audio = self._resample(audio, sample_rate)
+        chunks = self._split_chunks(audio)
+        return chunks, audio.shape[0]
+
+    def _resample(self, audio: torch.Tensor, sample_rate: int) -> torch.Tensor:
+        """Downmix (C, T) audio to mono and resample it to the model sample rate"""
         assert audio.ndim == 2
 
         audio = audio.mean(dim=0, keepdim=False)
@@ -59,7 +108,11 @@ class EnhancerModel:
         assert audio.ndim == 1
         assert audio.shape[0] > 1
 
-        audio = resample(
+        return self._to_model_rate(audio, sample_rate)
+
+    def _to_model_rate(self, audio: torch.Tensor, sample_rate: int) -> torch.Tensor:
+        """Resample (..., T) audio to the model sample rate"""
+        return resample(
             audio,
             orig_freq=sample_rate,
             new_freq=self._sample_rate,
@@ -69,10 +122,9 @@ class EnhancerModel:
             beta=14.769656459379492,
         )
 
-        audio_length = audio.shape[0]
-
-        chunks = [audio[i : i + self._chunk_length] for i in range(0, audio_length, self._hop_length)]
-        chunks = torch.stack([pad(chunk, (0, self._chunk_length - len(chunk))) for chunk in chunks], dim=0)
+    def _split_chunks(self, audio: torch.Tensor) -> torch.Tensor:
+        """Split (T,) audio into overlapping peak-normalized chunks (N, chunk_length)"""
+        chunks = self._chunk(audio)
 
         abs_max = chunks.abs().max(dim=1, keepdim=True).values
         abs_max[abs_max == 0] = 10e-7
@@ -80,9 +132,31 @@ class EnhancerModel:
 
         assert chunks.ndim == 2
 
-        return chunks, audio_length
+        return chunks
+
+    def _chunk(self, audio: torch.Tensor) -> torch.Tensor:
+        """Split (T,) audio into overlapping zero-padded chunks (N, chunk_length)"""
+        chunks = [audio[i : i + self._chunk_length] for i in range(0, audio.shape[0], self._hop_length)]
+        return torch.stack([pad(chunk, (0, self._chunk_length - len(chunk))) for chunk in chunks], dim=0)
 
     def _postprocess_audio(self, audio_chunks: torch.Tensor, length: Optional[int] = None):
+        offsets = self._compute_offsets(audio_chunks)
+        return self._overlap_add(audio_chunks, offsets, length)
+
+    def _compute_offsets(self, audio_chunks: torch.Tensor) -> list[int]:
+        """Alignment offset of every chunk against the previous one, 0 for the first chunk"""
+        offsets = [0]
+        for i in range(1, len(audio_chunks)):
+            chunk = audio_chunks[i]
+            if len(chunk) < self._chunk_length:
+                chunk = pad(chunk, (0, self._chunk_length - len(chunk)))
+
+            pre_region = audio_chunks[i - 1][-self._overlap_length :]
+            cur_region = chunk[: self._overlap_length]
+            offsets.append(self._compute_offset(pre_region, cur_region, sr=self._sample_rate))
+        return offsets
+
+    def _overlap_add(self, audio_chunks: torch.Tensor, offsets: list[int], length: Optional[int] = None):
         signal_length = (len(audio_chunks) - 1) * self._hop_length + self._chunk_length
         signal = torch.zeros(signal_length, device=audio_chunks[0].device)
 
@@ -91,20 +165,13 @@ class EnhancerModel:
         fadeout = torch.linspace(1, 0, self._overlap_length, device=audio_chunks[0].device)
         fadeout = torch.cat([torch.ones(self._hop_length, device=audio_chunks[0].device), fadeout])
 
-        for i, chunk in enumerate(audio_chunks):
-            start = i * self._hop_length
+        for i, (chunk, offset) in enumerate(zip(audio_chunks, offsets)):
+            start = i * self._hop_length - offset
             end = start + self._chunk_length
 
             if len(chunk) < self._chunk_length:
                 chunk = pad(chunk, (0, self._chunk_length - len(chunk)))
 
-            if i > 0:
-                pre_region = audio_chunks[i - 1][-self._overlap_length :]
-                cur_region = chunk[: self._overlap_length]
-                offset = self._compute_offset(pre_region, cur_region, sr=self._sample_rate)
-                start -= offset
-                end -= offset
-
             if i == 0:
                 chunk = chunk * fadeout
             elif i == len(audio_chunks) - 1:
@@ -157,3 +224,50 @@ class EnhancerModel:
 
     def _compute_corr(self, x, y):
         return torch.fft.ifft(torch.fft.fft(x) * torch.fft.fft(y).conj()).abs()
+
+
+class DenoiserModel(EnhancerModel):
+    """
+    Runs only the denoiser stage of resemble-enhance, skipping latent CFM generation and vocoding.
+
+    Chunking, resampling and overlap-add are shared with EnhancerModel.
+    """
+
+    def __init__(
+        self,
+        device: str = "cuda",
+        chunk_duration_s: float = 30.0,
+        chunk_overlap_s: float = 1.0,
+        backend: str = "torch",
+    ) -> None:
+        super().__init__(
+            device=device, chunk_duration_s=chunk_duration_s, chunk_overlap_s=chunk_overlap_s, backend=backend
+        )
+
+    def _load_model(self, device: str, **kwargs) -> torch.nn.Module:
+        # The denoiser weights ship inside the enhancer checkpoint. Keep the full enhancer on CPU
+        # and move only a copy of the denoiser to the target device.
+        model = load_enhancer("cpu").denoiser
+        if device != "cpu":
+            model = copy.deepcopy(model).to(device)
+        model.eval()
+        return model
+
+
+class IdentityModel(EnhancerModel):
+    """
+    Pass-through network with the full EnhancerModel pre/post-processing.
+
+    Used for benchmarking the service and the processing pipeline without downloading weights.
+    """
+
+    def __init__(
+        self,
+        device: str = "cuda",
+        chunk_duration_s: float = 30.0,
+        chunk_overlap_s: float = 1.0,
+    ) -> None:
+        super().__init__(device=device, chunk_duration_s=chunk_duration_s, chunk_overlap_s=chunk_overlap_s)
+
+    def _load_model(self, device: str, **kwargs) -> torch.nn.Module:
+        return torch.nn.Identity()
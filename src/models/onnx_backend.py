@@ -0,0 +1,111 @@
+"""
+ONNX Runtime execution of the resemble-enhance denoiser on CPU workers.
+
+The denoiser U-Net, the bulk of the compute of `DenoiserModel` and of the denoising stage of `EnhancerModel`, is
+exported to ONNX once per weights into `MODEL_DIR/onnx` and run with ONNX Runtime; the STFT and ISTFT around it stay
+in PyTorch. The CFM velocity field and the vocoder of `EnhancerModel` keep running in PyTorch: the former uses dilated
+convolutions with "same" padding that ONNX Runtime does not support, the latter samples its noise inside the graph.
+
+Requires the `onnx` extra: `pip install .[onnx]`.
+"""
+
+import copy
+import hashlib
+import itertools
+import logging
+from pathlib import Path
+
+import torch
+from resemble_enhance.denoiser.denoiser import Denoiser
+
+from src import config
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+
+
+class OnnxModule(torch.nn.Module):
+    """Drop-in replacement of an exported single input module, running its graph with ONNX Runtime"""
+
+    def __init__(self, path: Path, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        super().__init__()
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime pick the number of threads
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self._session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = self._session.run(None, {self._input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output).to(x.device)
+
+
+def use_onnx_runtime(network: torch.nn.Module, model_dir: str | None = None) -> torch.nn.Module:
+    """
+    Copy of a resemble-enhance network with its denoiser U-Nets replaced by ONNX Runtime sessions
+
+    The network itself is left untouched, it is cached by `load_enhancer` and shared with the torch backend. The copy
+    shares its parameters and buffers, only the module tree is duplicated.
+
+    Args:
+        network: Enhancer or Denoiser network on CPU
+        model_dir: Directory of the exported graphs, `MODEL_DIR` by default
+
+    Returns:
+        network: Copy of the network running its denoisers with ONNX Runtime
+    """
+    if onnxruntime is None:
+        raise RuntimeError("MODEL_BACKEND=onnx requires onnxruntime, install the `onnx` extra")
+
+    shared = {id(tensor): tensor for tensor in itertools.chain(network.parameters(), network.buffers())}
+    network = copy.deepcopy(network, memo=shared)
+    replaced = 0
+    for denoiser in network.modules():
+        if not isinstance(denoiser, Denoiser) or isinstance(denoiser.net, OnnxModule):
+            continue
+        # (batch, magnitude/cos/sin, frequency, frames)
+        example = torch.zeros(1, 3, denoiser.n_fft // 2 + 1, 64)
+        path = export_onnx(denoiser.net, example, Path(model_dir or config.MODEL_DIR) / "onnx")
+        denoiser.net = OnnxModule(path, config.ONNX_INTRA_OP_THREADS, config.ONNX_INTER_OP_THREADS)
+        replaced += 1
+    logger.info(f"Running {replaced} denoiser networks with ONNX Runtime")
+    return network
+
+
+def export_onnx(module: torch.nn.Module, example: torch.Tensor, onnx_dir: Path) -> Path:
+    """Export a module with dynamic batch and time axes, reusing a previous export of the same weights"""
+    path = onnx_dir / f"{type(module).__name__.lower()}-{_fingerprint(module)}.onnx"
+    if path.exists():
+        return path
+
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".tmp")
+    dynamic_axes = {0: "batch", example.ndim - 1: "time"}
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            (example,),
+            str(temp_path),
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": dynamic_axes, "output": dynamic_axes},
+            opset_version=ONNX_OPSET,
+        )
+    temp_path.replace(path)
+    logger.info(f"Exported {type(module).__name__} to {path}")
+    return path
+
+
+def _fingerprint(module: torch.nn.Module) -> str:
+    digest = hashlib.sha1()
+    for name, tensor in module.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,133 @@
+"""
+Local cache of the resemble-enhance weights, loaded memory-mapped.
+
+`load_enhancer` of resemble-enhance pulls the model repository with git on every process start and deserializes the
+DeepSpeed checkpoint into fresh memory. The warm-up command converts the checkpoint once into a flat state dict in
+`MODEL_DIR`, which workers map with `torch.load(mmap=True)` and assign to the model without copying, offline.
+
+Example:
+    MODEL_DIR=/opt/models python -m src.models.weights --remove-download
+"""
+
+import logging
+import shutil
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import click
+import torch
+from resemble_enhance.enhancer.download import REPO_DIR, download
+from resemble_enhance.enhancer.enhancer import Enhancer
+from resemble_enhance.enhancer.hparams import HParams
+from resemble_enhance.enhancer.inference import load_enhancer as download_enhancer
+from torch.overrides import TorchFunctionMode
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = Path("ds") / "G" / "default" / "mp_rank_00_model_states.pt"
+WEIGHTS_FILE = "enhancer.pt"
+# `torch.nn.init` functions and the in-place tensor methods they fill parameters with
+RANDOM_INITS = frozenset(
+    (
+        "uniform_",
+        "normal_",
+        "trunc_normal_",
+        "kaiming_uniform_",
+        "kaiming_normal_",
+        "xavier_uniform_",
+        "xavier_normal_",
+        "orthogonal_",
+    )
+)
+
+
+def cached_run_dir(model_dir: str) -> Path:
+    return Path(model_dir) / "enhancer_stage2"
+
+
+def export_weights(model_dir: str, run_dir: Path | None = None) -> Path:
+    """
+    Convert the downloaded resemble-enhance checkpoint into the memory-mappable cache
+
+    Args:
+        model_dir: Cache directory, `MODEL_DIR` of the workers
+        run_dir: Downloaded run directory, downloaded now if not given
+
+    Returns:
+        weights_path: Path of the cached state dict
+    """
+    run_dir = run_dir or download()
+    target_dir = cached_run_dir(model_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(run_dir / "hparams.yaml", target_dir / "hparams.yaml")
+
+    state_dict = torch.load(run_dir / CHECKPOINT_PATH, map_location="cpu")["module"]
+    # Contiguous tensors in the zip format are stored as-is, so each maps straight into a parameter
+    state_dict = {name: tensor.contiguous() for name, tensor in state_dict.items()}
+    weights_path = target_dir / WEIGHTS_FILE
+    temp_path = weights_path.with_suffix(".tmp")
+    torch.save(state_dict, temp_path)
+    temp_path.replace(weights_path)
+    return weights_path
+
+
+@lru_cache(maxsize=None)
+def load_enhancer(device: str) -> Enhancer:
+    """
+    Enhancer with pretrained weights, memory-mapped from `MODEL_DIR` when cached there
+
+    Falls back to downloading the model repository when the cache is missing, which needs network access.
+    """
+    run_dir = cached_run_dir(config.MODEL_DIR)
+    weights_path = run_dir / WEIGHTS_FILE
+    if not weights_path.exists():
+        logger.warning(f"No cached weights in {run_dir}, downloading them. Run `python -m src.models.weights` first")
+        return download_enhancer(None, device)
+
+    with _SkipRandomInit():
+        enhancer = Enhancer(HParams.load(run_dir))
+    # Pages are read on first access and shared with other processes mapping the same file
+    state_dict = torch.load(str(weights_path), map_location="cpu", mmap=True)
+    # Strict loading replaces every parameter, none is left uninitialized
+    enhancer.load_state_dict(state_dict, assign=True)
+    enhancer.eval()
+    return enhancer.to(device)
+
+
+class _SkipRandomInit(TorchFunctionMode):
+    """
+    Skip the random initialization of parameters that are overwritten by pretrained weights right after
+
+    Torch function modes are thread-local, models built meanwhile by other threads are initialized as usual. The
+    parameters are still allocated: building the model on the meta device fails in torchaudio, whose mel filterbanks
+    are computed at construction.
+    """
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if getattr(func, "__name__", None) in RANDOM_INITS:
+            # `torch.nn.init` functions pass the tensor by keyword, tensor methods as `self`
+            return args[0] if args else kwargs["tensor"]
+        return func(*args, **kwargs)
+
+
+@click.command()
+@click.option("--model-dir", envvar="MODEL_DIR", default=config.MODEL_DIR, show_default=True)
+@click.option("--remove-download", is_flag=True, help="Delete the downloaded model repository after converting it")
+def main(model_dir, remove_download):
+    """Download and convert the weights into MODEL_DIR, then time loading them"""
+    weights_path = export_weights(model_dir)
+    if remove_download:
+        shutil.rmtree(REPO_DIR, ignore_errors=True)
+
+    config.MODEL_DIR = model_dir
+    start = time.perf_counter()
+    load_enhancer("cpu")
+    click.echo(f"Cached {weights_path}, loaded in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
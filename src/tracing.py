@@ -0,0 +1,42 @@
+"""
+Optional OpenTelemetry tracing.
+
+Spans are no-ops unless `opentelemetry-api` is installed, and are only exported when an SDK is configured,
+e.g. by running the app and workers under `opentelemetry-instrument`.
+"""
+
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:
+    propagate = trace = None
+
+
+def inject_context() -> dict:
+    """Serialize the current trace context, e.g. to pass it to an RQ job in `job.meta`"""
+    carrier = {}
+    if propagate is not None:
+        propagate.inject(carrier)
+    return carrier
+
+
+@contextmanager
+def span(name: str, carrier: Optional[dict] = None, **attributes):
+    """
+    Start a span, as a child of the current span or of the context serialized in `carrier`
+
+    Args:
+        name: Span name
+        carrier: Trace context produced by `inject_context` (optional)
+        **attributes: Span attributes
+    """
+    if trace is None:
+        yield None
+        return
+
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    context = propagate.extract(carrier) if carrier else None
+    with trace.get_tracer(__name__).start_as_current_span(name, context=context, attributes=attributes) as current:
+        yield current
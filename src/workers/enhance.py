@@ -1,17 +1,52 @@
+import contextlib
+import functools
+import logging
 import os
+import sys
 import tempfile
+import time
 
+import redis
 import torch
 import torchaudio
-from rq import Queue, SimpleWorker
+from prometheus_client import start_http_server
+from rq import Queue, get_current_job
 
-from src.config import S3_RESULTS_BUCKET
-from src.connections import _database_session, _redis_connection
-from src.database.orm import UsageHistory
+from src.config import (
+    DEFAULT_OUTPUT_FORMAT,
+    MODEL_BACKEND,
+    MODEL_CHUNK_DURATION,
+    MODEL_CHUNK_OVERLAP,
+    S3_RESULTS_BUCKET,
+    WORKER_METRICS_PORT,
+    WORKER_PROCESSES,
+    WORKER_QUEUES,
+)
+from src.connections import _redis_connection
+from src.database.cache import profile_key, update_task_status
 from src.file_storages import s3
-from src.models.enhancer import EnhancerModel
+from src.metrics import (
+    MODEL_LOAD_DURATION,
+    WORKER_READY_DURATION,
+    process_uptime,
+    record_job_throughput,
+    record_memory,
+    stage,
+)
+from src.models.enhancer import DenoiserModel, EnhancerModel, IdentityModel
+from src.tracing import span
+from src.workers.models_info import MODELS_INFO
+from src.workers.output_formats import OUTPUT_FORMATS, encode_audio
+from src.workers.pipeline import PipelinedWorker, get_job_pipeline
+from src.workers.prefork import fork_workers
+from src.workers.profiling import create_profiler, profile_object_name, should_keep_profile
+from src.workers.scheduling import listen_queue_names, record_real_time_factor
+from src.workers.status_flusher import StatusFlusher
 
-LISTEN_KEYS = ["default"]
+logger = logging.getLogger(__name__)
+
+LISTEN_KEYS = WORKER_QUEUES
+MODEL_CLASSES = {"audio_enhancer": EnhancerModel, "audio_denoiser": DenoiserModel}
 
 
 def process_audio_enhancement(s3_object_key, task_id=None):
@@ -25,47 +60,211 @@ def process_audio_enhancement(s3_object_key, task_id=None):
     Returns:
         result_s3_key: S3 object key of the processed audio file
     """
-    ENHANCER_MODEL = EnhancerModel(device="cuda" if torch.cuda.is_available() else "cpu")
-    with _database_session() as db:
-        try:
-            redis_conn = _redis_connection()
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_input_path = os.path.join(temp_dir, f"input{os.path.splitext(s3_object_key)[1]}")
-                s3.download_file(s3_object_key, temp_input_path)
+    ENHANCER_MODEL = create_model(EnhancerModel)
+    return _process_audio(ENHANCER_MODEL, "audio_enhancer", s3_object_key, task_id)
+
+
+def process_audio_denoising(s3_object_key, task_id=None):
+    """
+    Process audio file with the denoiser stage of the enhancer model only
+
+    Args:
+        s3_object_key: S3 object key of the uploaded audio file
+        task_id: ID of the task in history
 
-                db.query(UsageHistory).filter(UsageHistory.id == task_id).update({"status": "processing"})
-                db.commit()
+    Returns:
+        result_s3_key: S3 object key of the processed audio file
+    """
+    DENOISER_MODEL = create_model(DenoiserModel)
+    return _process_audio(DENOISER_MODEL, "audio_denoiser", s3_object_key, task_id)
 
-                audio, sample_rate = torchaudio.load(temp_input_path)
 
-                enhanced_audio, new_sample_rate = ENHANCER_MODEL.enhance_audio(audio, sample_rate)
+@functools.lru_cache(maxsize=None)
+def create_model(model_class: type[EnhancerModel]) -> EnhancerModel:
+    """Model of the worker process, loaded by its first job or at startup and reused by the following ones"""
+    options = {"chunk_duration_s": MODEL_CHUNK_DURATION, "chunk_overlap_s": MODEL_CHUNK_OVERLAP}
+    if MODEL_BACKEND == "identity":
+        model_class = IdentityModel
+    elif MODEL_BACKEND == "onnx":
+        options["backend"] = "onnx"
+    with MODEL_LOAD_DURATION.labels(model=model_class.__name__).time():
+        return model_class(device=model_device(), **options)
 
-                temp_output_path = os.path.join(temp_dir, f"output{os.path.splitext(s3_object_key)[1]}")
-                torchaudio.save(temp_output_path, enhanced_audio, new_sample_rate)
 
-                result_s3_key = s3.upload_file(temp_output_path, bucket=S3_RESULTS_BUCKET)
+def model_device() -> str:
+    # The ONNX Runtime backend runs on CPU
+    return "cuda" if torch.cuda.is_available() and MODEL_BACKEND != "onnx" else "cpu"
 
-                result_url = s3.generate_presigned_url(result_s3_key, bucket=S3_RESULTS_BUCKET)
 
+def _process_audio(model: EnhancerModel, model_name: str, s3_object_key, task_id=None):
+    job = get_current_job()
+    trace_context = job.meta.get("trace_context") if job else None
+    profile_requested = job.meta.get("profile", False) if job else False
+    profiler = create_profiler(profile_requested)
+    output_format = job.meta.get("output_format", DEFAULT_OUTPUT_FORMAT) if job else DEFAULT_OUTPUT_FORMAT
+    output_sample_rate = job.meta.get("output_sample_rate") if job else None
+    preserve_channels = job.meta.get("preserve_channels", False) if job else False
+
+    pipeline = get_job_pipeline()
+    redis_conn = _redis_connection()
+    # Named upfront, so the job can finish while its result is still being uploaded
+    result_s3_key = s3.generate_object_name(f"result.{OUTPUT_FORMATS[output_format].extension}")
+
+    # Status transitions go to Redis, the status flusher writes them to the database in batches
+    with span("process_audio", trace_context, model=model_name, task_id=task_id):
+        try:
+            start = time.perf_counter()
+            with profiler or contextlib.nullcontext():
                 if task_id:
-                    redis_conn.set(f"task:{task_id}:result_s3_key", result_s3_key)
-                    redis_conn.set(f"task:{task_id}:result_url", result_url)
-                    redis_conn.expire(f"task:{task_id}:result_s3_key", 24 * 60 * 60)
-                    redis_conn.expire(f"task:{task_id}:result_url", 24 * 60 * 60)
+                    update_task_status(redis_conn, task_id, "processing")
+
+                # Downloaded and decoded by the prefetch thread while the previous job ran, if it was queued then
+                audio, sample_rate = pipeline.take_input(model_name, s3_object_key)
+
+                with stage(model_name, "inference"):
+                    enhanced_audio, new_sample_rate = model.enhance_audio(
+                        audio, sample_rate, preserve_channels=preserve_channels
+                    )
 
-                db.query(UsageHistory).filter(UsageHistory.id == task_id).update({"status": "completed"})
-                db.commit()
+                audio_s = audio.shape[1] / sample_rate
+                store = functools.partial(
+                    store_result,
+                    model_name,
+                    task_id,
+                    enhanced_audio.cpu(),
+                    new_sample_rate,
+                    output_format,
+                    output_sample_rate,
+                    result_s3_key,
+                    audio_s,
+                    start,
+                )
+                # Profiled jobs store their result in the job thread, so encoding and upload show in the profile.
+                # Otherwise the job returns while its result uploads, the output thread then finishes it.
+                if profiler or not pipeline.submit_output(store, job):
+                    store()
 
-            return {"result_s3_key": result_s3_key, "result_url": result_url}
+            # Upload the profile next to the result if it was requested or the job turned out slow
+            profile_s3_key = None
+            if profiler and should_keep_profile(profile_requested, audio_s, time.perf_counter() - start):
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    profile_s3_key = s3.upload_file(
+                        profiler.dump(os.path.join(temp_dir, "profile")),
+                        bucket=S3_RESULTS_BUCKET,
+                        object_name=profile_object_name(result_s3_key, profiler),
+                    )
+                if task_id:
+                    redis_conn.set(profile_key(task_id), profile_s3_key, ex=24 * 60 * 60)
+
+            return {"result_s3_key": result_s3_key, "profile_s3_key": profile_s3_key}
         except Exception as e:
-            db.query(UsageHistory).filter(UsageHistory.id == task_id).update({"status": "failed"})
-            db.commit()
+            if task_id:
+                update_task_status(redis_conn, task_id, "failed")
             raise e
 
 
-if __name__ == "__main__":
+def store_result(
+    model_name: str,
+    task_id,
+    audio: torch.Tensor,
+    sample_rate: int,
+    output_format: str,
+    output_sample_rate,
+    result_s3_key: str,
+    audio_s: float,
+    start: float,
+    report_speed: bool = True,
+):
+    """
+    Encode and upload the result of a job and mark it completed, in the job thread or the output thread
+
+    `report_speed` shares the real-time factor of the job with the capacity estimates of the API, for jobs processed
+    by this worker alone.
+    """
+    redis_conn = _redis_connection()
+    try:
+        output = OUTPUT_FORMATS[output_format]
+        with stage(model_name, "encode"):
+            target_sample_rate = output.resolve_sample_rate(output_sample_rate or sample_rate)
+            if target_sample_rate != sample_rate:
+                audio = torchaudio.functional.resample(audio, sample_rate, target_sample_rate)
+            # Encoded in memory and uploaded from the buffer, without a round trip through the disk
+            encoded = encode_audio(audio.numpy(), target_sample_rate, output_format)
+
+        with stage(model_name, "upload"):
+            s3.upload_fileobj(
+                encoded,
+                content_type=output.content_type,
+                bucket=S3_RESULTS_BUCKET,
+                object_name=result_s3_key,
+            )
+
+        if task_id:
+            # Only the key is stored, URLs are presigned on demand by the API
+            update_task_status(redis_conn, task_id, "completed", result_s3_key)
+    except Exception:
+        if task_id:
+            update_task_status(redis_conn, task_id, "failed")
+        raise
+
+    wall_s = time.perf_counter() - start
+    record_job_throughput(model_name, audio_s, wall_s)
+    if report_speed:
+        report_real_time_factor(redis_conn, model_name, audio_s, wall_s)
+
+
+def report_real_time_factor(redis_conn, model_name: str, audio_s: float, wall_s: float):
+    try:
+        record_real_time_factor(redis_conn, MODELS_INFO[model_name].queue, audio_s, wall_s)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to report the real-time factor of {model_name}: {e}")
+
+
+def load_models():
+    """Load the models of the listened queues, from the weight cache in MODEL_DIR"""
+    for model_name, model_info in MODELS_INFO.items():
+        if model_info.queue in LISTEN_KEYS:
+            create_model(MODEL_CLASSES[model_name])
+
+
+def run_worker(index: int = 0):
+    """
+    Serve the listened queues until the worker is stopped
+
+    Args:
+        index: Index of the process among WORKER_PROCESSES, its metrics are exported on WORKER_METRICS_PORT + index
+    """
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT + index)
+
+    # Loaded before taking jobs, already done by the parent of forked processes on CPU
+    load_models()
+    # Forked processes count from the start of the parent
+    ready_s = process_uptime(os.getppid() if WORKER_PROCESSES > 1 else None)
+    WORKER_READY_DURATION.set(ready_s)
+    record_memory()
+    logger.info(f"Worker ready to serve in {ready_s:.1f}s")
+
     redis_conn = _redis_connection()
 
     with redis_conn.client() as connection:
-        worker = SimpleWorker([Queue(connection=redis_conn)], connection=redis_conn)
-        worker.work()
+        queues = [Queue(name, connection=redis_conn) for name in listen_queue_names(LISTEN_KEYS)]
+        worker = PipelinedWorker(queues, connection=redis_conn)
+
+        status_flusher = StatusFlusher(redis_conn)
+        status_flusher.start()
+        try:
+            worker.work()
+        finally:
+            # Results still uploading are completed before their statuses are flushed a last time
+            get_job_pipeline().drain()
+            status_flusher.stop()
+
+
+if __name__ == "__main__":
+    if WORKER_PROCESSES > 1:
+        if model_device() == "cpu" and MODEL_BACKEND != "onnx":
+            # Loaded once and shared copy-on-write by the forked processes, ONNX Runtime sessions do not survive a fork
+            load_models()
+        sys.exit(fork_workers(WORKER_PROCESSES, run_worker))
+    run_worker()
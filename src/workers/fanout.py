@@ -0,0 +1,257 @@
+"""
+Fan-out of long inputs over many workers.
+
+The planner job decodes the input once, resamples it to the model rate and cuts it into ranges of
+`FANOUT_CHUNKS_PER_JOB` model chunks, each stored in S3 with the overlap its chunks need. Range jobs enhance their
+chunks independently on any worker of the model queue. A reducer job, queued once every range job has finished,
+aligns and overlap-adds all chunks as `EnhancerModel._postprocess_audio` does for a single job and stores the result.
+Intermediate objects live under `fanout/<planner job id>/` in the results bucket and are deleted by the reducer.
+"""
+
+import io
+import logging
+import math
+import time
+
+import numpy as np
+import torch
+from rq import Callback, Queue, get_current_job
+from rq.job import Dependency
+
+from src.config import (
+    DEFAULT_OUTPUT_FORMAT,
+    FANOUT_CHUNKS_PER_JOB,
+    MODEL_CHUNK_DURATION,
+    MODEL_CHUNK_OVERLAP,
+    S3_RESULTS_BUCKET,
+)
+from src.connections import _redis_connection
+from src.database.cache import update_task_status
+from src.file_storages import s3
+from src.metrics import stage
+from src.models.enhancer import IdentityModel
+from src.tracing import span
+from src.workers.enhance import MODEL_CLASSES, create_model, report_real_time_factor, store_result
+from src.workers.output_formats import OUTPUT_FORMATS
+from src.workers.pipeline import load_input
+from src.workers.retention import finish_job
+from src.workers.scheduling import add_backlog
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_geometry() -> IdentityModel:
+    """Pre and post-processing shared by all models, without loading weights"""
+    return IdentityModel(device="cpu", chunk_duration_s=MODEL_CHUNK_DURATION, chunk_overlap_s=MODEL_CHUNK_OVERLAP)
+
+
+def plan_ranges(audio_length: int, chunk_length: int, hop_length: int, chunks_per_job: int) -> list[tuple]:
+    """
+    Split the chunks of a resampled input into ranges processed by separate jobs
+
+    Args:
+        audio_length: Length of the resampled input
+        chunk_length: Length of a model chunk
+        hop_length: Distance between the starts of consecutive chunks
+        chunks_per_job: Chunks in a range
+
+    Returns:
+        ranges: (first_chunk, chunk_count, start, end), [start, end) being the samples the chunks of the range cover
+    """
+    total_chunks = math.ceil(audio_length / hop_length)
+    ranges = []
+    for first_chunk in range(0, total_chunks, chunks_per_job):
+        chunk_count = min(chunks_per_job, total_chunks - first_chunk)
+        start = first_chunk * hop_length
+        end = min((first_chunk + chunk_count - 1) * hop_length + chunk_length, audio_length)
+        ranges.append((first_chunk, chunk_count, start, end))
+    return ranges
+
+
+def plan_chunks(model_name: str, s3_object_key: str, task_id=None):
+    """
+    Planner job: split a long input into chunk range jobs and queue the reducer after them
+
+    Args:
+        model_name: Name of the model of the task
+        s3_object_key: S3 object key of the uploaded audio file
+        task_id: ID of the task in history
+
+    Returns:
+        reducer_job_id: ID of the job that assembles the result
+    """
+    job = get_current_job()
+    redis_conn = _redis_connection()
+    prefix = f"fanout/{job.id}"
+    scratch_keys = []
+
+    with span("plan_chunks", job.meta.get("trace_context"), model=model_name, task_id=task_id):
+        try:
+            planned_at = time.time()
+            if task_id:
+                update_task_status(redis_conn, task_id, "processing")
+
+            audio, sample_rate = load_input(model_name, s3_object_key)
+            geometry = chunk_geometry()
+            with stage(model_name, "split"):
+                resampled = geometry._resample(audio, sample_rate)
+                ranges = plan_ranges(
+                    resampled.shape[0], geometry._chunk_length, geometry._hop_length, FANOUT_CHUNKS_PER_JOB
+                )
+                input_keys = [f"{prefix}/input-{first_chunk:06d}.f32" for first_chunk, _, _, _ in ranges]
+                output_keys = [f"{prefix}/output-{first_chunk:06d}.f32" for first_chunk, _, _, _ in ranges]
+                scratch_keys = input_keys + output_keys
+                for input_key, (_, _, start, end) in zip(input_keys, ranges):
+                    _put_tensor(resampled[start:end], input_key)
+
+            queue = Queue(job.origin, connection=redis_conn)
+            # The planner left the backlog of the queue when it started, its ranges take its place
+            with redis_conn.pipeline() as pipe:
+                range_jobs = queue.enqueue_many(
+                    [
+                        Queue.prepare_data(
+                            process_chunk_range,
+                            args=(model_name, input_key, chunk_count, output_key),
+                            meta={
+                                "trace_context": job.meta.get("trace_context"),
+                                "audio_duration_s": (end - start) / geometry.sample_rate,
+                            },
+                        )
+                        for input_key, output_key, (_, chunk_count, start, end) in zip(input_keys, output_keys, ranges)
+                    ],
+                    pipeline=pipe,
+                )
+                add_backlog(pipe, queue.name, sum(end - start for _, _, start, end in ranges) / geometry.sample_rate)
+                pipe.execute()
+
+            # Runs once every range job has finished, failed ones included, and owns the in-flight slot and the input
+            reducer = queue.enqueue(
+                reduce_chunks,
+                args=(
+                    model_name,
+                    task_id,
+                    output_keys,
+                    [chunk_count for _, chunk_count, _, _ in ranges],
+                    resampled.shape[0],
+                    audio.shape[1] / sample_rate,
+                    planned_at,
+                    scratch_keys,
+                ),
+                depends_on=Dependency(jobs=range_jobs, allow_failure=True, enqueue_at_front=True),
+                meta={**job.meta, "inflight_slot": job.meta.get("inflight_slot", job.id), "audio_duration_s": None},
+                on_success=Callback(finish_job),
+                on_failure=Callback(finish_job),
+                on_stopped=Callback(finish_job),
+            )
+            logger.info(f"Split {s3_object_key} into {len(range_jobs)} chunk range jobs")
+            return reducer.id
+        except Exception as e:
+            if task_id:
+                update_task_status(redis_conn, task_id, "failed")
+            _delete_scratch(scratch_keys)
+            raise e
+
+
+def process_chunk_range(model_name: str, input_key: str, chunk_count: int, output_key: str):
+    """
+    Range job: enhance `chunk_count` model chunks of a resampled input range
+
+    Returns:
+        output_key: S3 object key of the enhanced chunks, (chunk_count, chunk_length) float32
+    """
+    job = get_current_job()
+    with span("process_chunk_range", job.meta.get("trace_context") if job else None, model=model_name):
+        start = time.perf_counter()
+        model = create_model(MODEL_CLASSES[model_name])
+        with stage(model_name, "download"):
+            segment = _get_tensor(input_key)
+
+        with stage(model_name, "inference"):
+            # The range starts on a chunk boundary, its first chunks are exactly those of the whole input
+            chunks = model._split_chunks(segment)[:chunk_count]
+            enhanced_chunks = model._forward(chunks)
+
+        with stage(model_name, "upload"):
+            _put_tensor(enhanced_chunks, output_key)
+
+        report_real_time_factor(
+            _redis_connection(), model_name, segment.shape[0] / model.sample_rate, time.perf_counter() - start
+        )
+        return output_key
+
+
+def reduce_chunks(
+    model_name: str,
+    task_id,
+    output_keys: list[str],
+    chunk_counts: list[int],
+    audio_length: int,
+    audio_s: float,
+    planned_at: float,
+    scratch_keys: list[str],
+):
+    """
+    Reducer job: overlap-add the enhanced chunks of all ranges and store the result of the task
+
+    Returns:
+        result_s3_key: S3 object key of the processed audio file
+    """
+    job = get_current_job()
+    output_format = job.meta.get("output_format", DEFAULT_OUTPUT_FORMAT)
+    redis_conn = _redis_connection()
+
+    with span("reduce_chunks", job.meta.get("trace_context"), model=model_name, task_id=task_id):
+        try:
+            failed = [dependency.id for dependency in job.fetch_dependencies() if not dependency.is_finished]
+            if failed:
+                raise RuntimeError(f"{len(failed)} of {len(output_keys)} chunk range jobs failed")
+
+            with stage(model_name, "download"):
+                chunks = torch.cat(
+                    [_get_tensor(key).reshape(count, -1) for key, count in zip(output_keys, chunk_counts)]
+                )
+
+            geometry = chunk_geometry()
+            with stage(model_name, "overlap_add"):
+                enhanced_audio = geometry._postprocess_audio(chunks, audio_length)
+
+            result_s3_key = s3.generate_object_name(f"result.{OUTPUT_FORMATS[output_format].extension}")
+            store_result(
+                model_name,
+                task_id,
+                enhanced_audio,
+                geometry.sample_rate,
+                output_format,
+                job.meta.get("output_sample_rate"),
+                result_s3_key,
+                audio_s,
+                # Throughput is measured from planning, across all the workers involved
+                time.perf_counter() - (time.time() - planned_at),
+                # Range jobs report the speed of every worker
+                report_speed=False,
+            )
+            return {"result_s3_key": result_s3_key, "profile_s3_key": None}
+        except Exception as e:
+            if task_id:
+                update_task_status(redis_conn, task_id, "failed")
+            raise e
+        finally:
+            _delete_scratch(scratch_keys)
+
+
+def _put_tensor(tensor: torch.Tensor, object_name: str):
+    data = io.BytesIO(tensor.detach().cpu().numpy().astype(np.float32).tobytes())
+    s3.upload_fileobj(data, bucket=S3_RESULTS_BUCKET, object_name=object_name)
+
+
+def _get_tensor(object_name: str) -> torch.Tensor:
+    data = bytearray(s3.download_fileobj(object_name, bucket=S3_RESULTS_BUCKET).getbuffer())
+    return torch.from_numpy(np.frombuffer(data, dtype=np.float32))
+
+
+def _delete_scratch(scratch_keys: list[str]):
+    try:
+        if scratch_keys:
+            s3.delete_objects(scratch_keys, bucket=S3_RESULTS_BUCKET)
+    except Exception as e:
+        logger.warning(f"Failed to delete fan-out intermediate objects: {e}")
@@ -1,7 +1,4 @@
 from dataclasses import dataclass
-from typing import Callable
-
-from src.workers.enhance import process_audio_enhancement
 
 
 @dataclass
@@ -9,11 +6,26 @@ class ModelInfo:
     name: str
     description: str
     price: float
-    worker: Callable
+    worker: str  # dotted path of the job function, imported by workers only so the API never loads torch
+    queue: str
+
 
+# Splits long inputs into chunk range jobs of the task model, see `src.workers.fanout`
+FANOUT_PLANNER = "src.workers.fanout.plan_chunks"
 
 MODELS_INFO = {
     "audio_enhancer": ModelInfo(
-        name="Resemble Enhancer", description="Enhance audio quality", price=10.0, worker=process_audio_enhancement
-    )
+        name="Resemble Enhancer",
+        description="Enhance audio quality",
+        price=10.0,
+        worker="src.workers.enhance.process_audio_enhancement",
+        queue="enhance",
+    ),
+    "audio_denoiser": ModelInfo(
+        name="Resemble Denoiser",
+        description="Remove background noise only",
+        price=1.0,
+        worker="src.workers.enhance.process_audio_denoising",
+        queue="denoise",
+    ),
 }
@@ -0,0 +1,83 @@
+import io
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+from src import config
+
+OUTPUT_SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+
+
+@dataclass
+class OutputFormat:
+    extension: str
+    content_type: str
+    format: str  # libsndfile container
+    subtype: str  # libsndfile encoding
+    sample_rates: tuple[int, ...] = OUTPUT_SAMPLE_RATES
+
+    def resolve_sample_rate(self, sample_rate: int) -> int:
+        """The requested rate if the encoder supports it, else the closest higher supported one"""
+        if sample_rate in self.sample_rates:
+            return sample_rate
+        return min((rate for rate in self.sample_rates if rate > sample_rate), default=max(self.sample_rates))
+
+
+OUTPUT_FORMATS = {
+    "wav": OutputFormat(extension="wav", content_type="audio/wav", format="WAV", subtype="PCM_16"),
+    "flac": OutputFormat(extension="flac", content_type="audio/flac", format="FLAC", subtype="PCM_16"),
+    "opus": OutputFormat(
+        extension="ogg",
+        content_type="audio/ogg",
+        format="OGG",
+        subtype="OPUS",
+        sample_rates=(8000, 16000, 24000, 48000),
+    ),
+    "mp3": OutputFormat(extension="mp3", content_type="audio/mpeg", format="MP3", subtype="MPEG_LAYER_III"),
+}
+
+
+def parse_output_options(output_format: Optional[str], output_sample_rate: Optional[int]) -> dict:
+    """
+    Validate the output options of a request
+
+    Returns:
+        options: output_format and output_sample_rate (None keeps the model rate), as stored in the job meta
+
+    Raises:
+        ValueError: If the format or the sample rate is not supported
+    """
+    output_format = output_format or config.DEFAULT_OUTPUT_FORMAT
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format, choose one of: {', '.join(OUTPUT_FORMATS)}")
+    if output_sample_rate is not None and output_sample_rate not in OUTPUT_SAMPLE_RATES:
+        raise ValueError(f"Unsupported sample rate, choose one of: {', '.join(map(str, OUTPUT_SAMPLE_RATES))}")
+    return {"output_format": output_format, "output_sample_rate": output_sample_rate}
+
+
+def encode_audio(audio: np.ndarray, sample_rate: int, output_format: str) -> io.BytesIO:
+    """
+    Encode audio straight into an in-memory buffer ready for upload
+
+    Args:
+        audio: Float audio of shape (channels, samples), already at a sample rate supported by the format
+        sample_rate: Sample rate of the audio
+        output_format: Key of `OUTPUT_FORMATS`
+
+    Returns:
+        buffer: Encoded audio, rewound to the start
+    """
+    output = OUTPUT_FORMATS[output_format]
+    buffer = io.BytesIO()
+    # Integer encoders wrap around instead of clipping out of range samples
+    sf.write(
+        buffer,
+        np.clip(audio, -1.0, 1.0).T,
+        sample_rate,
+        format=output.format,
+        subtype=output.subtype,
+    )
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,202 @@
+"""
+Overlap of the S3 transfers and encoding of neighbouring jobs with model inference in a worker process.
+
+While a job runs inference, a prefetch thread downloads and decodes the inputs of the next queued jobs and an output
+thread encodes and uploads the result of the previous one. Both are bounded: at most `WORKER_PREFETCH_JOBS` inputs are
+loaded ahead and at most `WORKER_UPLOAD_DEPTH` results wait for upload, a job blocks before handing over another one.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, Optional
+
+import torch
+import torchaudio
+from rq.job import Job, JobStatus
+from rq.results import Result
+
+from src import config
+from src.file_storages import s3
+from src.metrics import stage
+from src.workers.models_info import MODELS_INFO
+from src.workers.retention import OUTPUT_PENDING, release_job
+from src.workers.scheduling import WeightedWorker
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAMES_BY_WORKER = {model_info.worker: model_name for model_name, model_info in MODELS_INFO.items()}
+# Longest wait of a failed output for RQ to record its job as finished, jobs run outside `PipelinedWorker` never are
+JOB_HANDLED_TIMEOUT_S = 60
+
+
+def load_input(model_name: str, s3_object_key: str) -> tuple[torch.Tensor, int]:
+    """Download and decode the input audio of a job"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_input_path = os.path.join(temp_dir, f"input{os.path.splitext(s3_object_key)[1]}")
+        with stage(model_name, "download"):
+            s3.download_file(s3_object_key, temp_input_path)
+
+        with stage(model_name, "decode"):
+            return torchaudio.load(temp_input_path)
+
+
+class JobPipeline:
+    def __init__(self, prefetch_depth: int, upload_depth: int):
+        self.prefetch_depth = prefetch_depth
+        self._prefetched: OrderedDict[str, Future] = OrderedDict()
+        self._lock = threading.Lock()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._output_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output")
+        self._output_slots = threading.BoundedSemaphore(upload_depth) if upload_depth > 0 else None
+        self._handled: dict[str, threading.Event] = {}
+
+    def prefetch(self, current: Optional[tuple[str, str]], upcoming: list[tuple[str, str]]):
+        """
+        Start loading the inputs of the next jobs and drop prefetched inputs of jobs no longer expected
+
+        Args:
+            current: (model_name, s3_object_key) of the job about to run, its input is kept if already prefetched
+            upcoming: (model_name, s3_object_key) of the next queued jobs, the first `prefetch_depth` are loaded
+        """
+        upcoming = upcoming[: self.prefetch_depth]
+        with self._lock:
+            wanted = {s3_object_key for _, s3_object_key in upcoming}
+            if current:
+                wanted.add(current[1])
+            # Jobs taken by another worker in the meantime
+            for s3_object_key in [key for key in self._prefetched if key not in wanted]:
+                self._prefetched.pop(s3_object_key).cancel()
+
+            for model_name, s3_object_key in upcoming:
+                if s3_object_key not in self._prefetched:
+                    self._prefetched[s3_object_key] = self._prefetch_executor.submit(
+                        load_input, model_name, s3_object_key
+                    )
+
+    def take_input(self, model_name: str, s3_object_key: str) -> tuple[torch.Tensor, int]:
+        """Input of the current job, prefetched if it was, loaded now otherwise"""
+        with self._lock:
+            future = self._prefetched.pop(s3_object_key, None)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception as e:
+                logger.warning(f"Prefetching {s3_object_key} failed, loading it again: {e}")
+        return load_input(model_name, s3_object_key)
+
+    def submit_output(self, store: Callable[[], None], job: Optional[Job] = None) -> bool:
+        """
+        Run `store` in the output thread, waiting while `upload_depth` results are already in flight
+
+        Args:
+            store: Encodes and uploads the result
+            job: Job of the result, its in-flight slot and input are released by the output thread once `store`
+                is done, instead of by its RQ callbacks when it returns
+
+        Returns:
+            submitted: False if background uploads are disabled, the caller stores the result itself
+        """
+        if self._output_slots is None:
+            return False
+
+        if job is not None:
+            handled = threading.Event()
+            with self._lock:
+                self._handled[job.id] = handled
+            store = partial(self._store_and_release, store, job, handled)
+            job.meta[OUTPUT_PENDING] = True
+        self._output_slots.acquire()
+        try:
+            future = self._output_executor.submit(store)
+        except Exception:
+            self._output_slots.release()
+            if job is not None:
+                job.meta.pop(OUTPUT_PENDING)
+                self.job_handled(job.id)
+            raise
+        future.add_done_callback(self._output_done)
+        return True
+
+    def job_handled(self, job_id: str):
+        """Called by the worker once RQ has recorded the outcome of a job, a failed output can then overturn it"""
+        with self._lock:
+            handled = self._handled.pop(job_id, None)
+        if handled is not None:
+            handled.set()
+
+    def _store_and_release(self, store: Callable[[], None], job: Job, handled: threading.Event):
+        try:
+            store()
+        except Exception:
+            # RQ records the job as finished after it returns, the failure must land after that
+            handled.wait(JOB_HANDLED_TIMEOUT_S)
+            self.job_handled(job.id)
+            fail_finished_job(job, traceback.format_exc())
+            raise
+        finally:
+            release_job(job, job.connection)
+
+    def _output_done(self, future: Future):
+        self._output_slots.release()
+        if future.exception() is not None:
+            logger.error(f"Error storing a job result: {future.exception()}")
+
+    def drain(self):
+        """Wait for the results in flight and stop prefetching, before the worker exits"""
+        self._output_executor.shutdown(wait=True)
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fail_finished_job(job: Job, exc_string: str):
+    """Move a job RQ recorded as finished to the failed registry, its result could not be stored"""
+    with job.connection.pipeline() as pipe:
+        job.finished_job_registry.remove(job, pipeline=pipe)
+        job.set_status(JobStatus.FAILED, pipeline=pipe)
+        Result.create_failure(job, job.failure_ttl, exc_string, pipeline=pipe)
+        job.failed_job_registry.add(job, ttl=job.failure_ttl, exc_string=exc_string, pipeline=pipe)
+        pipe.execute()
+
+
+@lru_cache(maxsize=1)
+def get_job_pipeline() -> JobPipeline:
+    """Pipeline shared by the worker loop and the jobs it runs"""
+    return JobPipeline(config.WORKER_PREFETCH_JOBS, config.WORKER_UPLOAD_DEPTH)
+
+
+class PipelinedWorker(WeightedWorker):
+    """Weighted worker that starts loading the inputs of the next queued jobs before running the current one"""
+
+    def execute_job(self, job: Job, queue):
+        pipeline = get_job_pipeline()
+        if pipeline.prefetch_depth > 0:
+            try:
+                upcoming = [_job_input(upcoming_job) for upcoming_job in self._upcoming_jobs(pipeline.prefetch_depth)]
+                pipeline.prefetch(_job_input(job), [job_input for job_input in upcoming if job_input])
+            except Exception as e:
+                logger.warning(f"Failed to prefetch upcoming jobs: {e}")
+        try:
+            super().execute_job(job, queue)
+        finally:
+            pipeline.job_handled(job.id)
+
+    def _upcoming_jobs(self, limit: int) -> list[Job]:
+        # Peek at the queues in the order they are served, the jobs may still be taken by another worker
+        job_ids = []
+        for queue in self._ordered_queues:
+            job_ids += queue.get_job_ids(0, limit - len(job_ids))
+            if len(job_ids) >= limit:
+                break
+        return [job for job in Job.fetch_many(job_ids, connection=self.connection) if job]
+
+
+def _job_input(job: Job) -> Optional[tuple[str, str]]:
+    """(model_name, s3_object_key) of a model job, None for other jobs"""
+    model_name = MODEL_NAMES_BY_WORKER.get(job.func_name)
+    return (model_name, job.args[0]) if model_name and job.args else None
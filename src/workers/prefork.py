@@ -0,0 +1,69 @@
+"""
+Several worker processes sharing the model weights loaded once by their parent.
+
+The parent loads the models, freezes its objects out of the garbage collector and forks `WORKER_PROCESSES` children.
+Weight storages are never written during inference, so their pages stay shared copy-on-write with the parent (and
+with the page cache for weights memory-mapped from `MODEL_DIR`); only Python object headers touched by reference
+counting get copied. Sharing needs the models on CPU: CUDA cannot be used in a forked child once initialized in the
+parent, so on GPU every child loads its own copy after the fork.
+"""
+
+import gc
+import logging
+import os
+import signal
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def fork_workers(count: int, run_worker: Callable[[int], None]) -> int:
+    """
+    Fork `count` children running `run_worker(index)` and wait for all of them
+
+    SIGTERM and SIGINT received by the parent are forwarded to the children, which shut down as a single worker does.
+
+    Returns:
+        exit_code: 0 if every child exited cleanly, 1 otherwise
+    """
+    # Collections in a child would write to the headers of every object inherited from the parent
+    gc.freeze()
+
+    children = {}
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                run_worker(index)
+                exit_code = 0
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                logger.exception(f"Worker process {index} failed")
+            finally:
+                os._exit(exit_code)
+        children[pid] = index
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    handlers = {signum: signal.signal(signum, forward) for signum in (signal.SIGTERM, signal.SIGINT)}
+    exit_code = 0
+    try:
+        while children:
+            pid, status = os.wait()
+            index = children.pop(pid, None)
+            if index is not None and os.waitstatus_to_exitcode(status) != 0:
+                logger.error(f"Worker process {index} exited with status {os.waitstatus_to_exitcode(status)}")
+                exit_code = 1
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return exit_code
@@ -0,0 +1,96 @@
+import cProfile
+import logging
+import os
+from typing import Optional
+
+import torch
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("off", "cprofile", "torch")
+
+
+class JobProfiler:
+    """Profiles a block of job processing with cProfile or torch.profiler and dumps the trace to a file"""
+
+    def __init__(self, mode: str):
+        if mode not in PROFILE_MODES[1:]:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self._profiler = None
+
+    @property
+    def extension(self) -> str:
+        return ".prof" if self.mode == "cprofile" else ".trace.json"
+
+    def __enter__(self):
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities, with_stack=True)
+            self._profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == "cprofile":
+            self._profiler.disable()
+        else:
+            self._profiler.__exit__(*exc_info)
+
+    def dump(self, path: str) -> str:
+        """
+        Write the collected profile, pstats format for cProfile and Chrome trace for torch
+
+        Args:
+            path: Output path without extension
+
+        Returns:
+            path: Path of the written file
+        """
+        path = f"{path}{self.extension}"
+        if self.mode == "cprofile":
+            self._profiler.dump_stats(path)
+        else:
+            self._profiler.export_chrome_trace(path)
+        return path
+
+
+def create_profiler(requested: bool = False) -> Optional[JobProfiler]:
+    """
+    Profiler for a job, or None when profiling is disabled and was not requested for this job
+
+    Args:
+        requested: Profiling was requested at submission, uses cProfile if `PROFILE_MODE` is off
+
+    Returns:
+        profiler: Profiler to wrap the job in
+    """
+    if config.PROFILE_MODE != "off":
+        return JobProfiler(config.PROFILE_MODE)
+    if requested:
+        return JobProfiler("cprofile")
+    return None
+
+
+def should_keep_profile(requested: bool, audio_s: float, wall_s: float) -> bool:
+    """Keep requested profiles and profiles of jobs slower than `PROFILE_RTF_THRESHOLD` times real time"""
+    if requested:
+        return True
+    if config.PROFILE_RTF_THRESHOLD <= 0 or audio_s <= 0:
+        return False
+    real_time_factor = wall_s / audio_s
+    if real_time_factor > config.PROFILE_RTF_THRESHOLD:
+        logger.warning(f"Slow job: real-time factor {real_time_factor:.2f}, keeping its profile")
+        return True
+    return False
+
+
+def profile_object_name(result_s3_key: str, profiler: JobProfiler) -> str:
+    """S3 key of the profile, next to the result it belongs to"""
+    return f"{os.path.splitext(result_s3_key)[0]}{profiler.extension}"
@@ -0,0 +1,247 @@
+"""
+Retention of the uploads and results buckets.
+
+Inputs are queued for deletion in Redis by the success, failure and stopped callbacks of their task. A periodic
+retention job, enqueued at most once per `RETENTION_INTERVAL_S` from the maintenance loop of the workers, deletes
+them with batched DeleteObjects requests, deletes results older than `RESULT_RETENTION_S` and forgets their keys in
+the usage history, and deletes result objects that no usage history entry references anymore (profiles of expired
+results, results of tasks that failed after uploading, abandoned fan-out intermediates).
+
+Bucket lifecycle rules applied by the API at startup are the backstop of the job: uploads never processed expire
+after `UPLOAD_RETENTION_DAYS`, results a day after `RESULT_RETENTION_S`, incomplete multipart uploads after a day.
+"""
+
+import logging
+import math
+from datetime import UTC, datetime, timedelta
+from typing import Iterable, Optional
+
+import redis
+from botocore.exceptions import BotoCoreError, ClientError
+from rq import Queue
+from rq.job import Job
+from sqlalchemy import update
+
+from src import config
+from src.connections import _database_session, _redis_connection
+from src.database.cache import task_key
+from src.database.orm import UsageHistory
+from src.file_storages import s3
+from src.limits import release_job_slot
+from src.workers.output_formats import OUTPUT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_INPUTS_KEY = "retention:expired_inputs"
+SCHEDULE_KEY = "retention:scheduled"
+ORPHAN_CURSOR_KEY = "retention:orphan_cursor"
+FANOUT_PREFIX = "fanout/"
+# Lifecycle rules owned by the service, other rules of the buckets are left as operators set them
+LIFECYCLE_RULE_IDS = {"abort-incomplete-uploads", "expire-uploads", "expire-fanout-intermediates", "expire-results"}
+# Set in `job.meta` of jobs whose result is stored by the output thread of the worker, see `JobPipeline.submit_output`
+OUTPUT_PENDING = "output_pending"
+
+
+def finish_job(job: Job, connection: redis.Redis, *args, **kwargs):
+    """
+    RQ success/failure/stopped callback of a task: frees its in-flight slot and queues its input for deletion
+
+    The input is named in `job.meta["input_s3_key"]`, the fan-out reducer inherits it from the planner. Jobs still
+    uploading their result are finished by the output thread once the upload is done.
+    """
+    if job.meta.get(OUTPUT_PENDING):
+        return
+    release_job(job, connection)
+
+
+def release_job(job: Job, connection: redis.Redis):
+    """Free the in-flight slot of a task and queue its input for deletion"""
+    release_job_slot(job, connection)
+    input_s3_key = job.meta.get("input_s3_key")
+    if input_s3_key is None:
+        return
+    try:
+        connection.sadd(EXPIRED_INPUTS_KEY, input_s3_key)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to queue input {input_s3_key} for deletion: {e}")
+
+
+def schedule_retention(redis_conn: redis.Redis, queue: Queue) -> Optional[Job]:
+    """Enqueue the retention job unless it was already enqueued by any worker in the last `RETENTION_INTERVAL_S`"""
+    if not config.RETENTION_INTERVAL_S:
+        return None
+    if not redis_conn.set(SCHEDULE_KEY, 1, nx=True, ex=config.RETENTION_INTERVAL_S):
+        return None
+    return queue.enqueue(run_retention)
+
+
+def run_retention() -> dict:
+    """
+    Retention job: delete processed inputs, expired results and orphaned result objects
+
+    Every step deletes at most `RETENTION_BATCH_SIZE` objects, the rest is left to the next run.
+
+    Returns:
+        deleted: Number of deleted objects per step
+    """
+    redis_conn = _redis_connection()
+    deleted = {
+        "inputs": delete_expired_inputs(redis_conn),
+        "results": expire_results(redis_conn),
+        "orphans": delete_orphaned_results(redis_conn),
+    }
+    logger.info(f"Retention deleted {deleted}")
+    return deleted
+
+
+def delete_expired_inputs(redis_conn: redis.Redis) -> int:
+    """Delete inputs of finished tasks, put back in the set if the deletion fails"""
+    input_s3_keys = [key.decode() for key in redis_conn.spop(EXPIRED_INPUTS_KEY, config.RETENTION_BATCH_SIZE)]
+    if not input_s3_keys:
+        return 0
+    try:
+        return s3.delete_objects(input_s3_keys, bucket=config.S3_UPLOADS_BUCKET)
+    except Exception:
+        redis_conn.sadd(EXPIRED_INPUTS_KEY, *input_s3_keys)
+        raise
+
+
+def expire_results(redis_conn: redis.Redis) -> int:
+    """Delete results older than `RESULT_RETENTION_S` and clear their keys in the usage history and the task cache"""
+    if not config.RESULT_RETENTION_S:
+        return 0
+
+    # Naive UTC, as timestamps read back from the database
+    cutoff = datetime.now(UTC).replace(tzinfo=None) - timedelta(seconds=config.RESULT_RETENTION_S)
+    with _database_session() as db:
+        expired = (
+            db.query(UsageHistory.id, UsageHistory.result_s3_key)
+            .filter(UsageHistory.result_s3_key.isnot(None), UsageHistory.timestamp < cutoff)
+            .order_by(UsageHistory.timestamp)
+            .limit(config.RETENTION_BATCH_SIZE)
+            .all()
+        )
+        if not expired:
+            return 0
+
+        deleted = s3.delete_objects([key for _, key in expired], bucket=config.S3_RESULTS_BUCKET)
+        task_ids = [task_id for task_id, _ in expired]
+        db.execute(update(UsageHistory).where(UsageHistory.id.in_(task_ids)).values(result_s3_key=None))
+        db.commit()
+
+    try:
+        redis_conn.delete(*(task_key(task_id) for task_id in task_ids))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate cached tasks of expired results: {e}")
+    return deleted
+
+
+def delete_orphaned_results(redis_conn: redis.Redis) -> int:
+    """
+    Delete result bucket objects older than `ORPHAN_GRACE_S` that no usage history entry references
+
+    A run checks at most `ORPHAN_SCAN_PAGES` pages of the bucket listing, starting after the key where the previous
+    run stopped, so its cost does not grow with the bucket. The scan starts over once it reaches the end.
+    """
+    cutoff = datetime.now(UTC) - timedelta(seconds=config.ORPHAN_GRACE_S)
+    start_after = (redis_conn.get(ORPHAN_CURSOR_KEY) or b"").decode()
+    # Starts over unless the run stops before the end of the listing
+    cursor = None
+    orphans = []
+    pages = s3.list_objects(bucket=config.S3_RESULTS_BUCKET, start_after=start_after)
+    for page_number, objects in enumerate(pages, 1):
+        # Results written after the cutoff may not have reached the usage history yet
+        keys = [obj["Key"] for obj in objects if obj["LastModified"] < cutoff]
+        if keys:
+            orphans += unreferenced_keys(keys, referenced_results(keys))
+        if len(orphans) >= config.RETENTION_BATCH_SIZE:
+            # The next run resumes after the last orphan deleted by this one
+            orphans = orphans[: config.RETENTION_BATCH_SIZE]
+            cursor = orphans[-1]
+            break
+        if page_number >= config.ORPHAN_SCAN_PAGES and objects:
+            cursor = objects[-1]["Key"]
+            break
+
+    deleted = s3.delete_objects(orphans, bucket=config.S3_RESULTS_BUCKET) if orphans else 0
+    if cursor:
+        redis_conn.set(ORPHAN_CURSOR_KEY, cursor)
+    else:
+        redis_conn.delete(ORPHAN_CURSOR_KEY)
+    return deleted
+
+
+def referenced_results(keys: Iterable[str]) -> set[str]:
+    """Result keys of the usage history among every result a listed object may belong to"""
+    candidates = {f"{_stem(key)}.{output.extension}" for key in keys for output in OUTPUT_FORMATS.values()}
+    with _database_session() as db:
+        rows = db.query(UsageHistory.result_s3_key).filter(UsageHistory.result_s3_key.in_(candidates)).all()
+    return {result_s3_key for (result_s3_key,) in rows}
+
+
+def unreferenced_keys(keys: Iterable[str], referenced: set[str]) -> list[str]:
+    """
+    Keys of objects belonging to no referenced result
+
+    A result and its profile share the stem of their key, fan-out intermediates belong to no result.
+    """
+    referenced_stems = {_stem(key) for key in referenced}
+    return [key for key in keys if key.startswith(FANOUT_PREFIX) or _stem(key) not in referenced_stems]
+
+
+def _stem(key: str) -> str:
+    # Generated keys are UUIDs, everything after the first dot is the extension
+    return key.split(".", 1)[0]
+
+
+def apply_lifecycle_rules():
+    """
+    Backstop expiration rules of the uploads and results buckets
+
+    The rules of the service replace their previous version by ID and are merged with the other rules of the bucket.
+    Storages without lifecycle support or out of reach are skipped, the API starts regardless.
+    """
+    upload_rules = [
+        {
+            "ID": "abort-incomplete-uploads",
+            "Filter": {"Prefix": ""},
+            "Status": "Enabled",
+            "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1},
+        }
+    ]
+    if config.UPLOAD_RETENTION_DAYS:
+        upload_rules.append(
+            {
+                "ID": "expire-uploads",
+                "Filter": {"Prefix": ""},
+                "Status": "Enabled",
+                "Expiration": {"Days": config.UPLOAD_RETENTION_DAYS},
+            }
+        )
+
+    result_rules = [
+        {
+            "ID": "expire-fanout-intermediates",
+            "Filter": {"Prefix": FANOUT_PREFIX},
+            "Status": "Enabled",
+            "Expiration": {"Days": max(math.ceil(config.ORPHAN_GRACE_S / 86400), 1)},
+        }
+    ]
+    if config.RESULT_RETENTION_S:
+        result_rules.append(
+            {
+                "ID": "expire-results",
+                "Filter": {"Prefix": ""},
+                "Status": "Enabled",
+                # A day later than the retention job, which also clears the keys in the usage history
+                "Expiration": {"Days": math.ceil(config.RESULT_RETENTION_S / 86400) + 1},
+            }
+        )
+
+    for bucket, rules in ((config.S3_UPLOADS_BUCKET, upload_rules), (config.S3_RESULTS_BUCKET, result_rules)):
+        try:
+            existing_rules = s3.get_lifecycle_rules(bucket=bucket)
+            other_rules = [rule for rule in existing_rules if rule.get("ID") not in LIFECYCLE_RULE_IDS]
+            s3.put_lifecycle_rules(other_rules + rules, bucket=bucket)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Lifecycle rules not applied to {bucket}, the retention job still runs: {e}")
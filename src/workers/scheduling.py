@@ -0,0 +1,217 @@
+import logging
+import random
+from datetime import UTC
+from typing import Optional
+
+import redis
+from rq import Queue, SimpleWorker, Worker
+from rq.job import Job
+from rq.utils import now
+
+from src import config
+from src.metrics import JOB_QUEUE_WAIT
+from src.workers.retention import schedule_retention
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = list(config.QUEUE_PRIORITY_WEIGHTS)
+# Classes `select_priority_class` routes to, each needs a weight for its queues to be listened to
+PRIORITY_CLASS, SHORT_CLASS, LONG_CLASS = "priority", "short", "long"
+
+_missing_classes = {PRIORITY_CLASS, SHORT_CLASS, LONG_CLASS} - set(PRIORITY_CLASSES)
+if _missing_classes:
+    raise ValueError(f"QUEUE_PRIORITY_WEIGHTS has no weight for the {', '.join(sorted(_missing_classes))} class")
+
+_WAIT_SAMPLES = 100
+_RTF_SAMPLES = 100
+
+
+def queue_name(base_queue: str, priority_class: str) -> str:
+    return f"{base_queue}:{priority_class}"
+
+
+def listen_queue_names(base_queues: list[str]) -> list[str]:
+    return [queue_name(base_queue, priority_class) for base_queue in base_queues for priority_class in PRIORITY_CLASSES]
+
+
+def select_priority_class(file_size: int, user_tier: str, duration_s: Optional[float] = None) -> str:
+    """
+    Route a job to a priority class at submission time
+
+    Args:
+        file_size: Size of the uploaded audio in bytes
+        user_tier: Tier of the submitting user
+        duration_s: Duration of the audio, the file size is used when unknown
+
+    Returns:
+        priority_class: One of PRIORITY_CLASSES
+    """
+    if user_tier in config.PRIORITY_TIERS:
+        return PRIORITY_CLASS
+    if duration_s is not None:
+        return LONG_CLASS if duration_s > config.QUEUE_LONG_DURATION_S else SHORT_CLASS
+    if file_size > config.QUEUE_LONG_FILE_SIZE_MB * 1024 * 1024:
+        return LONG_CLASS
+    return SHORT_CLASS
+
+
+def should_fan_out(duration_s: Optional[float]) -> bool:
+    """Whether a task is split into chunk range jobs processed by many workers, see `src.workers.fanout`"""
+    return bool(config.FANOUT_MIN_DURATION_S) and duration_s is not None and duration_s > config.FANOUT_MIN_DURATION_S
+
+
+def _queue_weight(name: str) -> float:
+    return config.QUEUE_PRIORITY_WEIGHTS.get(name.rsplit(":", 1)[-1], 1.0)
+
+
+def weighted_order(queues: list[Queue]) -> list[Queue]:
+    # Efraimidis-Spirakis weighted sampling without replacement
+    return sorted(queues, key=lambda queue: random.random() ** (1.0 / _queue_weight(queue.name)), reverse=True)
+
+
+class WeightedWorker(SimpleWorker):
+    """
+    Worker that reorders its queues by weighted random sampling before every dequeue,
+    so each non-empty queue is served first with probability proportional to its weight.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shuffle_queues()
+
+    def reorder_queues(self, reference_queue: Queue):
+        self._shuffle_queues()
+
+    def _shuffle_queues(self):
+        self._ordered_queues = weighted_order(self._ordered_queues)
+
+    def run_maintenance_tasks(self):
+        super().run_maintenance_tasks()
+        try:
+            schedule_retention(self.connection, self.queues[0])
+        except redis.RedisError as e:
+            logger.warning(f"Failed to schedule the retention job: {e}")
+
+    def execute_job(self, job: Job, queue: Queue):
+        try:
+            record_wait_time(self.connection, queue.name, job)
+            add_backlog(self.connection, queue.name, -(job.meta.get("audio_duration_s") or 0.0))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to record queue statistics for {queue.name}: {e}")
+        super().execute_job(job, queue)
+
+
+def record_wait_time(redis_conn: redis.Redis, name: str, job: Job):
+    if job.enqueued_at is None:
+        return
+    enqueued_at = job.enqueued_at if job.enqueued_at.tzinfo else job.enqueued_at.replace(tzinfo=UTC)
+    wait_s = max((now() - enqueued_at).total_seconds(), 0.0)
+    JOB_QUEUE_WAIT.labels(queue=name).observe(wait_s)
+
+    with redis_conn.pipeline() as pipe:
+        pipe.hincrby(f"queue_stats:{name}", "jobs", 1)
+        pipe.hincrbyfloat(f"queue_stats:{name}", "wait_s_total", wait_s)
+        pipe.lpush(f"queue_stats:{name}:wait_s", wait_s)
+        pipe.ltrim(f"queue_stats:{name}:wait_s", 0, _WAIT_SAMPLES - 1)
+        pipe.execute()
+
+
+def add_backlog(redis_conn: redis.Redis, name: str, audio_s: Optional[float]):
+    """
+    Account for audio seconds entering (positive) or leaving (negative) a queue
+
+    Args:
+        redis_conn: Redis connection or pipeline
+        name: Queue name
+        audio_s: Seconds of audio of the queued or dequeued job, unknown durations are not counted
+    """
+    if audio_s:
+        redis_conn.hincrbyfloat(f"queue_stats:{name}", "backlog_audio_s", audio_s)
+
+
+def record_real_time_factor(redis_conn: redis.Redis, base_queue: str, audio_s: float, wall_s: float):
+    """Keep the real-time factor (wall seconds per audio second) of the last jobs processed from a model queue"""
+    if audio_s <= 0:
+        return
+    with redis_conn.pipeline() as pipe:
+        pipe.lpush(f"queue_stats:{base_queue}:rtf", wall_s / audio_s)
+        pipe.ltrim(f"queue_stats:{base_queue}:rtf", 0, _RTF_SAMPLES - 1)
+        pipe.execute()
+
+
+def get_capacity(redis_conn: redis.Redis, base_queues: list[str]) -> list[dict]:
+    """
+    Estimate the work waiting in every model queue and how long its workers take to drain it
+
+    Args:
+        redis_conn: Redis connection
+        base_queues: Model queue names, their priority classes are summed up
+
+    Returns:
+        capacity: Per model queue backlog in jobs and audio seconds, registered workers, median real-time factor of
+            the last jobs and estimated drain time in seconds, None until a job has been processed
+    """
+    capacity = []
+    for base_queue in base_queues:
+        names = listen_queue_names([base_queue])
+        queues = [Queue(name, connection=redis_conn) for name in names]
+        # Every worker listens to all the priority classes of its model queues
+        workers = set().union(*(Worker.all_keys(connection=redis_conn, queue=queue) for queue in queues))
+        # Jobs removed from a queue without being run are never subtracted, the counter can only overestimate
+        backlog_audio_s = sum(
+            max(float(redis_conn.hget(f"queue_stats:{name}", "backlog_audio_s") or 0.0), 0.0) for name in names
+        )
+        recent = sorted(float(v) for v in redis_conn.lrange(f"queue_stats:{base_queue}:rtf", 0, -1))
+        rtf = recent[len(recent) // 2] if recent else None
+
+        if not backlog_audio_s:
+            drain_time_s = 0.0
+        elif rtf is not None and workers:
+            drain_time_s = backlog_audio_s * rtf / len(workers)
+        else:
+            drain_time_s = None
+
+        capacity.append(
+            {
+                "queue": base_queue,
+                "queued_jobs": sum(queue.count for queue in queues),
+                "backlog_audio_s": backlog_audio_s,
+                "active_workers": len(workers),
+                "real_time_factor": rtf,
+                "drain_time_s": drain_time_s,
+            }
+        )
+    return capacity
+
+
+def get_queue_stats(redis_conn: redis.Redis, names: list[str]) -> list[dict]:
+    """
+    Collect depth and wait time statistics for the given queues
+
+    Args:
+        redis_conn: Redis connection
+        names: Queue names
+
+    Returns:
+        stats: Per-queue depth, number of started jobs and wait times in seconds
+    """
+    stats = []
+    for name in names:
+        queue = Queue(name, connection=redis_conn)
+        totals = redis_conn.hgetall(f"queue_stats:{name}")
+        jobs = int(totals.get(b"jobs", 0))
+        wait_s_total = float(totals.get(b"wait_s_total", 0.0))
+        recent = sorted(float(v) for v in redis_conn.lrange(f"queue_stats:{name}:wait_s", 0, -1))
+
+        stats.append(
+            {
+                "queue": name,
+                "depth": queue.count,
+                "started": queue.started_job_registry.count,
+                "jobs_dequeued": jobs,
+                "wait_s_mean": wait_s_total / jobs if jobs else None,
+                "wait_s_p50": recent[len(recent) // 2] if recent else None,
+                "wait_s_p95": recent[min(int(len(recent) * 0.95), len(recent) - 1)] if recent else None,
+            }
+        )
+    return stats
@@ -0,0 +1,96 @@
+import logging
+import threading
+
+import redis
+from sqlalchemy import case, update
+
+from src.config import STATUS_FLUSH_INTERVAL_S
+from src.connections import _database_session
+from src.database.cache import FLUSHING_STATUSES_KEY, PENDING_STATUSES_KEY, decode_update
+from src.database.orm import UsageHistory
+
+logger = logging.getLogger(__name__)
+
+FLUSH_LOCK_KEY = "task_statuses:flush_lock"
+
+
+def _write_updates(updates: dict[int, dict]):
+    """Apply the statuses and result keys with a single bulk UPDATE"""
+    statuses = {task_id: task_update["status"] for task_id, task_update in updates.items()}
+    result_s3_keys = {
+        task_id: task_update["result_s3_key"]
+        for task_id, task_update in updates.items()
+        if "result_s3_key" in task_update
+    }
+
+    values = {"status": case(statuses, value=UsageHistory.id)}
+    if result_s3_keys:
+        values["result_s3_key"] = case(result_s3_keys, value=UsageHistory.id, else_=UsageHistory.result_s3_key)
+
+    with _database_session() as db:
+        db.execute(update(UsageHistory).where(UsageHistory.id.in_(updates)).values(**values))
+        db.commit()
+
+
+def flush_task_statuses(redis_conn: redis.Redis) -> int:
+    """
+    Write task status transitions and result keys recorded by workers in Redis to SQL
+
+    Pending statuses are moved aside with RENAME before writing, so transitions recorded meanwhile wait for the
+    next flush, and are deleted only after the SQL commit. A batch left behind by a crashed flusher is written
+    first on the next call; writing it twice is harmless.
+
+    Args:
+        redis_conn: Redis connection
+
+    Returns:
+        flushed: Number of flushed task statuses, 0 if another flusher holds the lock
+    """
+    lock = redis_conn.lock(FLUSH_LOCK_KEY, timeout=max(60, 10 * STATUS_FLUSH_INTERVAL_S))
+    if not lock.acquire(blocking=False):
+        return 0
+
+    flushed = 0
+    try:
+        while True:
+            if not redis_conn.exists(FLUSHING_STATUSES_KEY):
+                if not redis_conn.exists(PENDING_STATUSES_KEY):
+                    return flushed
+                redis_conn.rename(PENDING_STATUSES_KEY, FLUSHING_STATUSES_KEY)
+
+            pending = redis_conn.hgetall(FLUSHING_STATUSES_KEY)
+            updates = {int(task_id): decode_update(value) for task_id, value in pending.items()}
+            if updates:
+                _write_updates(updates)
+            redis_conn.delete(FLUSHING_STATUSES_KEY)
+            flushed += len(updates)
+    finally:
+        lock.release()
+
+
+class StatusFlusher(threading.Thread):
+    """Background thread flushing task statuses every `interval_s` and once more when stopped"""
+
+    def __init__(self, redis_conn: redis.Redis, interval_s: float = STATUS_FLUSH_INTERVAL_S):
+        super().__init__(name="status-flusher", daemon=True)
+        self.redis_conn = redis_conn
+        self.interval_s = interval_s
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval_s):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        try:
+            flushed = flush_task_statuses(self.redis_conn)
+            if flushed:
+                logger.info(f"Flushed {flushed} task statuses")
+        except Exception as e:
+            # Statuses stay in Redis and are retried on the next flush
+            logger.error(f"Error flushing task statuses: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
@@ -0,0 +1,34 @@
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+import redis
+
+
+def free_port() -> int:
+    """Port not in use on localhost, for servers spawned by the tests"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def redis_conn():
+    """Connection to a throwaway redis-server, tests flush it before use"""
+    if shutil.which("redis-server") is None:
+        pytest.skip("redis-server is not installed")
+    port = free_port()
+    process = subprocess.Popen(["redis-server", "--port", str(port), "--save", ""], stdout=subprocess.DEVNULL)
+    try:
+        redis_conn = redis.Redis(port=port)
+        for _ in range(50):
+            try:
+                redis_conn.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.1)
+        yield redis_conn
+    finally:
+        process.terminate()
@@ -1,10 +1,14 @@
 import base64
+import io
+import json
 import os
 import shutil
 import subprocess
 import time
+import zipfile
 
 import boto3
+import httpx
 import pytest
 import redis
 from fastapi.testclient import TestClient
@@ -13,6 +17,8 @@ from sqlalchemy.orm import sessionmaker
 
 from src.config import (
     DATABASE_URL,
+    MAX_BATCH_SIZE,
+    MAX_INFLIGHT_JOBS,
     REDIS_DB,
     REDIS_HOST,
     REDIS_PORT,
@@ -24,7 +30,7 @@ from src.config import (
     S3_UPLOADS_BUCKET,
 )
 from src.database.orm import Base
-from src.main import app
+from src.main import _auth_cache, app
 
 TEST_AUDIO_FILE = "tests/data/41601__noisecollector__mysterysnippets.wav"
 
@@ -41,7 +47,11 @@ def test_db_session():
         yield db
     finally:
         db.close()
-        os.remove("app.db")
+        engine.dispose()
+        # SQLite runs in WAL mode, its journal files must not outlive the database
+        for path in ("app.db", "app.db-wal", "app.db-shm"):
+            if os.path.exists(path):
+                os.remove(path)
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -97,7 +107,11 @@ def test_s3():
 
 
 @pytest.fixture(scope="function", autouse=True)
-def test_client():
+def test_client(test_db_session, test_redis):
+    # The database is recreated for every test, so state cached by the previous test must go as well. Tables are
+    # created by `test_db_session`, the engine of the app creates them only once per process.
+    test_redis.flushdb()
+    _auth_cache.clear()
     with TestClient(app) as client:
         time.sleep(5)
         yield client
@@ -208,3 +222,326 @@ def test_duplicate_username(test_client):
     response = test_client.post("/users/", data=user_data)
     assert response.status_code == 400  # Bad Request
     assert "Username already exists" in response.json()["detail"]
+
+
+def test_inflight_jobs_limit(test_client):
+    """Test scenario when user exceeds the in-flight jobs limit"""
+    user_data = {"username": "busyuser", "password": "testpass"}
+    response = test_client.post("/users/", data=user_data)
+    assert response.status_code == 201
+
+    auth_header = get_auth_header("busyuser", "testpass")
+    response = test_client.post("/tokens/add/", data={"amount": 1000.0}, headers=auth_header)
+    assert response.status_code == 200
+
+    # No worker is running, so every queued job stays in flight
+    for _ in range(int(MAX_INFLIGHT_JOBS["free"])):
+        with open(TEST_AUDIO_FILE, "rb") as audio_file:
+            files = {"audio_file": (os.path.basename(TEST_AUDIO_FILE), audio_file, "audio/wav")}
+            data = {"model_name": "audio_denoiser"}
+            response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+        assert response.status_code == 200
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        files = {"audio_file": (os.path.basename(TEST_AUDIO_FILE), audio_file, "audio/wav")}
+        data = {"model_name": "audio_denoiser"}
+        response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+
+    assert response.status_code == 429  # Too Many Requests
+    assert "Retry-After" in response.headers
+
+
+def test_task_status_cache(test_client, test_redis):
+    """Test that task status and balance are served from Redis and refilled from the database on a miss"""
+    user_data = {"username": "polluser", "password": "testpass"}
+    response = test_client.post("/users/", data=user_data)
+    assert response.status_code == 201
+    user_id = response.json()["user_id"]
+
+    auth_header = get_auth_header("polluser", "testpass")
+    response = test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+    assert response.status_code == 200
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        files = {"audio_file": (os.path.basename(TEST_AUDIO_FILE), audio_file, "audio/wav")}
+        data = {"model_name": "audio_denoiser"}
+        response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+
+    assert test_redis.hget(f"task:{task_id}", "status") == b"pending"
+    assert float(test_redis.hget(f"user:{user_id}", "balance")) == 9.0
+
+    # Drop the cached task, the endpoint falls back to the database and caches it again
+    test_redis.delete(f"task:{task_id}")
+    response = test_client.get(f"/tasks/{task_id}", headers=auth_header)
+    assert response.status_code == 200
+    assert response.json()["status"] == "pending"
+    assert test_redis.hget(f"task:{task_id}", "status") == b"pending"
+
+    # Other users can not see the task even if it is cached
+    test_client.post("/users/", data={"username": "otheruser", "password": "testpass"})
+    response = test_client.get(f"/tasks/{task_id}", headers=get_auth_header("otheruser", "testpass"))
+    assert response.status_code == 404
+
+
+def test_batch_submission(test_client):
+    """Test batch submission of several files charged in one transaction"""
+    user_data = {"username": "batchuser", "password": "testpass"}
+    response = test_client.post("/users/", data=user_data)
+    assert response.status_code == 201
+
+    auth_header = get_auth_header("batchuser", "testpass")
+    response = test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+    assert response.status_code == 200
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+    files = [("audio_files", (f"{i}.wav", contents, "audio/wav")) for i in range(3)]
+    data = {"model_name": "audio_denoiser"}
+    response = test_client.post("/models/use/batch", data=data, files=files, headers=auth_header)
+
+    assert response.status_code == 200
+    assert len(response.json()["task_ids"]) == 3
+    batch_id = response.json()["batch_id"]
+
+    response = test_client.get("/tokens/balance/", headers=auth_header)
+    assert response.json()["balance"] == 7.0
+
+    response = test_client.get(f"/batches/{batch_id}", headers=auth_header)
+    assert response.status_code == 200
+    assert response.json()["total"] == 3
+    assert len(response.json()["tasks"]) == 3
+
+
+def test_direct_upload(test_client):
+    """Test presigned direct-to-S3 upload followed by confirmation"""
+    user_data = {"username": "directuser", "password": "testpass"}
+    response = test_client.post("/users/", data=user_data)
+    assert response.status_code == 201
+
+    auth_header = get_auth_header("directuser", "testpass")
+    response = test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+    assert response.status_code == 200
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+
+    data = {"model_name": "audio_denoiser", "filename": "input.wav", "content_type": "audio/wav", "size": len(contents)}
+    response = test_client.post("/uploads/presign", data=data, headers=auth_header)
+    assert response.status_code == 200
+    upload_id = response.json()["upload_id"]
+
+    response = httpx.put(response.json()["url"], content=contents, headers={"Content-Type": "audio/wav"})
+    assert response.status_code == 200
+
+    response = test_client.post(f"/uploads/{upload_id}/confirm", headers=auth_header)
+    assert response.status_code == 200
+    assert "task_id" in response.json()
+
+    # The reservation is consumed by the first confirmation
+    response = test_client.post(f"/uploads/{upload_id}/confirm", headers=auth_header)
+    assert response.status_code == 404
+
+
+def test_batch_accepts_only_own_unsubmitted_uploads(test_client):
+    """Test that a batch takes only objects the user uploaded through a presigned URL, each at most once"""
+    for username in ("owner", "stranger"):
+        test_client.post("/users/", data={"username": username, "password": "testpass"})
+        test_client.post("/tokens/add/", data={"amount": 10.0}, headers=get_auth_header(username, "testpass"))
+    auth_header = get_auth_header("owner", "testpass")
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+
+    data = {"model_name": "audio_denoiser", "filename": "input.wav", "content_type": "audio/wav", "size": len(contents)}
+    response = test_client.post("/uploads/presign", data=data, headers=auth_header)
+    upload_id, s3_object_key = response.json()["upload_id"], response.json()["s3_object_key"]
+    httpx.put(response.json()["url"], content=contents, headers={"Content-Type": "audio/wav"})
+
+    data = {"model_name": "audio_denoiser", "s3_object_keys": [s3_object_key]}
+    response = test_client.post("/models/use/batch", data=data, headers=get_auth_header("stranger", "testpass"))
+    assert response.status_code == 404
+
+    data = {"model_name": "audio_denoiser", "s3_object_keys": [s3_object_key, s3_object_key]}
+    response = test_client.post("/models/use/batch", data=data, headers=auth_header)
+    assert response.status_code == 400
+
+    data = {"model_name": "audio_denoiser", "s3_object_keys": [s3_object_key]}
+    response = test_client.post("/models/use/batch", data=data, headers=auth_header)
+    assert response.status_code == 200
+    assert len(response.json()["task_ids"]) == 1
+
+    # The object is already queued, neither another batch nor the confirmation may submit it again
+    response = test_client.post("/models/use/batch", data=data, headers=auth_header)
+    assert response.status_code == 404
+    response = test_client.post(f"/uploads/{upload_id}/confirm", headers=auth_header)
+    assert response.status_code == 404
+
+
+def test_batch_zip_limits(test_client, monkeypatch):
+    """Test that zip archives over the batch or upload size limits are rejected before being decompressed"""
+    test_client.post("/users/", data={"username": "zipuser", "password": "testpass"})
+    auth_header = get_auth_header("zipuser", "testpass")
+    test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+
+    def make_zip(members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for name, data in members:
+                zip_file.writestr(name, data)
+        return archive.getvalue()
+
+    data = {"model_name": "audio_denoiser"}
+    too_many = make_zip((f"{i}.wav", contents) for i in range(MAX_BATCH_SIZE + 1))
+    files = [("audio_files", ("batch.zip", too_many, "application/zip"))]
+    response = test_client.post("/models/use/batch", data=data, files=files, headers=auth_header)
+    assert response.status_code == 400
+
+    # Every member fits the upload size limit, their sum does not
+    monkeypatch.setattr("src.config.MAX_UPLOAD_SIZE_MB", 1.5 * len(contents) / 1024 / 1024)
+    too_large = make_zip([("0.wav", contents), ("1.wav", contents)])
+    files = [("audio_files", ("batch.zip", too_large, "application/zip"))]
+    response = test_client.post("/models/use/batch", data=data, files=files, headers=auth_header)
+    assert response.status_code == 400
+
+    response = test_client.get("/tokens/balance/", headers=auth_header)
+    assert response.json()["balance"] == 10.0
+
+
+def test_auth_cache_is_bounded(test_client, monkeypatch):
+    """Test that the in-process auth cache keeps at most AUTH_CACHE_SIZE users, the most recently seen ones"""
+    monkeypatch.setattr("src.config.AUTH_CACHE_SIZE", 2)
+    for username in ("first", "second", "third"):
+        test_client.post("/users/", data={"username": username, "password": "testpass"})
+        response = test_client.get("/tokens/balance/", headers=get_auth_header(username, "testpass"))
+        assert response.status_code == 200
+
+    assert list(_auth_cache) == ["second", "third"]
+
+
+def test_idempotent_submission(test_client, test_redis):
+    """Test that retries with the same Idempotency-Key return the original task and are charged once"""
+    response = test_client.post("/users/", data={"username": "retryuser", "password": "testpass"})
+    user_id = response.json()["user_id"]
+    auth_header = get_auth_header("retryuser", "testpass")
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+
+    def submit(key, output_format=None):
+        files = {"audio_file": ("input.wav", contents, "audio/wav")}
+        data = {"model_name": "audio_denoiser", **({"output_format": output_format} if output_format else {})}
+        return test_client.post("/models/use/", data=data, files=files, headers={**auth_header, "Idempotency-Key": key})
+
+    # A failed request releases its key, the retry is processed once the user has tokens
+    response = submit("first")
+    assert response.status_code == 402
+    test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+    response = submit("first")
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+    task_id = response.json()["task_id"]
+
+    response = submit("first")
+    assert response.status_code == 200
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert response.json()["task_id"] == task_id
+    assert test_client.get("/tokens/balance/", headers=auth_header).json()["balance"] == 9.0
+
+    # The same key with other parameters
+    response = submit("first", output_format="wav")
+    assert response.status_code == 422
+
+    # A retry arriving while the original request is still running
+    key = f"user:{user_id}:idempotency:first"
+    record = json.loads(test_redis.get(key))
+    test_redis.set(key, json.dumps({"status": "pending", "fingerprint": record["fingerprint"]}))
+    response = submit("first")
+    assert response.status_code == 409
+    assert "Retry-After" in response.headers
+
+
+def test_batch_over_the_tier_limits(test_client):
+    """Test that a batch the tier could never run at once is rejected as such, not with a retryable 429"""
+    test_client.post("/users/", data={"username": "bigbatchuser", "password": "testpass"})
+    auth_header = get_auth_header("bigbatchuser", "testpass")
+    test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+    files = [("audio_files", (f"{i}.wav", contents, "audio/wav")) for i in range(int(MAX_INFLIGHT_JOBS["free"]) + 1)]
+    data = {"model_name": "audio_denoiser"}
+    response = test_client.post("/models/use/batch", data=data, files=files, headers=auth_header)
+
+    assert response.status_code == 400
+    assert "free tier" in response.json()["detail"]
+    assert "Retry-After" not in response.headers
+    assert test_client.get("/tokens/balance/", headers=auth_header).json()["balance"] == 10.0
+
+
+def test_failed_submission_is_refunded(test_client, monkeypatch):
+    """Test that a submission failing after the charge gives the tokens back, so its retry is charged once"""
+    test_client.post("/users/", data={"username": "refunduser", "password": "testpass"})
+    auth_header = {**get_auth_header("refunduser", "testpass"), "Idempotency-Key": "upload"}
+    test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+    files = {"audio_file": ("input.wav", contents, "audio/wav")}
+    data = {"model_name": "audio_denoiser"}
+
+    def unreachable_s3(*args, **kwargs):
+        raise ConnectionError("S3 is unreachable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("src.file_storages.s3.upload_fileobj", unreachable_s3)
+        with pytest.raises(ConnectionError):
+            test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+    assert test_client.get("/tokens/balance/", headers=auth_header).json()["balance"] == 10.0
+
+    response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+    assert response.status_code == 200
+    assert test_client.get("/tokens/balance/", headers=auth_header).json()["balance"] == 9.0
+    response = test_client.get("/usage/history/", headers=auth_header)
+    assert len(response.json()) == 1
+
+
+def test_profiling_is_limited_to_profile_tiers(test_client, test_redis, monkeypatch):
+    """Test that only tiers in PROFILE_TIERS request profiles and get a link to them in the task status"""
+    test_client.post("/users/", data={"username": "profileuser", "password": "testpass"})
+    auth_header = get_auth_header("profileuser", "testpass")
+    test_client.post("/tokens/add/", data={"amount": 10.0}, headers=auth_header)
+
+    with open(TEST_AUDIO_FILE, "rb") as audio_file:
+        contents = audio_file.read()
+    files = {"audio_file": ("input.wav", contents, "audio/wav")}
+    data = {"model_name": "audio_denoiser", "profile": "true"}
+
+    response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+    assert response.status_code == 403
+    assert test_client.get("/tokens/balance/", headers=auth_header).json()["balance"] == 10.0
+
+    monkeypatch.setattr("src.config.PROFILE_TIERS", ["free"])
+    response = test_client.post("/models/use/", data=data, files=files, headers=auth_header)
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+
+    assert test_client.get(f"/tasks/{task_id}", headers=auth_header).json()["profile_url"] is None
+    test_redis.set(f"task:{task_id}:profile_s3_key", "result.prof")
+    assert "result.prof" in test_client.get(f"/tasks/{task_id}", headers=auth_header).json()["profile_url"]
+
+
+def test_queue_statistics_require_authentication(test_client):
+    """Test that queue depths and capacity estimates are served to authenticated users only"""
+    test_client.post("/users/", data={"username": "queueuser", "password": "testpass"})
+    auth_header = get_auth_header("queueuser", "testpass")
+
+    for path in ("/queues/", "/system/capacity"):
+        assert test_client.get(path).status_code == 401
+        response = test_client.get(path, headers=auth_header)
+        assert response.status_code == 200
+        assert response.json()
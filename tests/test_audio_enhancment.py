@@ -1,7 +1,7 @@
 import pytest
 import torch
 
-from src.models.enhancer import EnhancerModel
+from src.models.enhancer import DenoiserModel, EnhancerModel, IdentityModel
 
 
 @pytest.mark.parametrize(
@@ -79,3 +79,47 @@ def test_model_with_different_parameters(chunk_duration_s, chunk_overlap_s, dura
 
     del model
     torch.cuda.empty_cache()
+
+
+@pytest.mark.parametrize(
+    "input_sr, duration, channels",
+    [
+        (44100, 1.0, 1),
+        (16000, 2.0, 2),
+        (8000, 40.0, 1),
+    ],
+)
+def test_denoiser_same_duration_shape_sample_rate(input_sr, duration, channels):
+    if not torch.cuda.is_available():
+        pytest.skip("CUDA not available")
+
+    num_samples = int(input_sr * duration)
+    audio = torch.randn(channels, num_samples)
+    model = DenoiserModel(device="cuda")
+    output, result_sample_rate = model.enhance_audio(audio, input_sr)
+
+    assert output.shape[0] == 1
+    assert output.shape[1] / result_sample_rate == pytest.approx(duration)
+
+    del model
+    torch.cuda.empty_cache()
+
+
+@pytest.mark.parametrize("input_sr, duration, channels", [(44100, 5.0, 2), (16000, 3.0, 4)])
+def test_preserve_channels_batches_all_channels(input_sr, duration, channels):
+    model = IdentityModel(device="cpu", chunk_duration_s=1.0, chunk_overlap_s=0.25)
+    audio = torch.randn(1, int(input_sr * duration)).repeat(channels, 1)
+    audio *= torch.linspace(1.0, 0.25, channels).unsqueeze(1)
+
+    forward = model._forward
+    batch_sizes = []
+    model._forward = lambda chunks: batch_sizes.append(len(chunks)) or forward(chunks)
+    output, result_sample_rate = model.enhance_audio(audio, input_sr, preserve_channels=True)
+
+    assert output.shape[0] == channels
+    assert output.shape[1] / result_sample_rate == pytest.approx(duration)
+    # A single forward pass over the chunks of every channel
+    assert len(batch_sizes) == 1 and batch_sizes[0] == channels * len(model._split_chunks(output[0]))
+    # Channels keep their relative levels, the loudest one comes out as in the mono path
+    assert torch.allclose(output, output[0] * torch.linspace(1.0, 0.25, channels).unsqueeze(1), atol=1e-5)
+    assert torch.allclose(output[:1], model.enhance_audio(audio[:1], input_sr)[0], atol=1e-5)
@@ -0,0 +1,112 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from src import config
+from src.audio_probe import InvalidAudioError, UnsupportedAudioError, probe_audio
+from src.database.billing import usage_price
+from src.file_storages import s3
+
+
+def _encode(duration_s, sample_rate=16000, channels=2, format="WAV"):
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros((int(duration_s * sample_rate), channels), dtype=np.float32), sample_rate, format=format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("format", ["WAV", "FLAC"])
+def test_probe_audio(format):
+    file = io.BytesIO(_encode(3.0, format=format))
+    info = probe_audio(file)
+
+    assert (info.format, info.sample_rate, info.channels) == (format, 16000, 2)
+    assert info.duration_s == pytest.approx(3.0)
+    assert file.tell() == 0
+
+
+@pytest.mark.parametrize("contents", [b"", b"not an audio file" * 100, _encode(0.0)])
+def test_probe_audio_rejects_invalid_files(contents):
+    with pytest.raises(InvalidAudioError):
+        probe_audio(io.BytesIO(contents))
+
+
+def _box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _encode_mp4(duration_s, sample_rate=44100, channels=2, moov_last=True, mdat_size=4096):
+    """Boxes of an M4A file the probe reads: the media header, handler and sample description of the audio track"""
+    mdhd = _box(b"mdhd", struct.pack(">4xIIII4x", 0, 0, sample_rate, int(duration_s * sample_rate)))
+    hdlr = _box(b"hdlr", struct.pack(">4x4x4s12x", b"soun") + b"\x00")
+    mp4a = _box(b"mp4a", struct.pack(">6xH8xHHHHI", 1, channels, 16, 0, 0, sample_rate << 16))
+    stsd = _box(b"stsd", struct.pack(">4xI", 1) + mp4a)
+    minf = _box(b"minf", _box(b"stbl", stsd))
+    moov = _box(b"moov", _box(b"mvhd", bytes(100)) + _box(b"trak", _box(b"mdia", mdhd + hdlr + minf)))
+    ftyp, mdat = _box(b"ftyp", b"M4A \x00\x00\x02\x00isomiso2"), _box(b"mdat", bytes(mdat_size))
+    return ftyp + mdat + moov if moov_last else ftyp + moov + mdat
+
+
+@pytest.mark.parametrize("moov_last", [False, True])
+def test_probe_audio_measures_mp4(moov_last):
+    file = io.BytesIO(_encode_mp4(3.0, moov_last=moov_last))
+    info = probe_audio(file)
+
+    assert (info.format, info.sample_rate, info.channels) == ("MP4", 44100, 2)
+    assert info.duration_s == pytest.approx(3.0)
+    assert file.tell() == 0
+
+
+def test_probe_audio_rejects_long_mp4(monkeypatch):
+    monkeypatch.setattr(config, "MAX_AUDIO_DURATION_S", 2.0)
+    with pytest.raises(InvalidAudioError):
+        probe_audio(io.BytesIO(_encode_mp4(3.0)))
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [_encode_mp4(3.0)[:-200], b"\x00\x00\x00\x20ftypM4A " + bytes(1024), _box(b"ftyp", b"M4A ") + _box(b"moov")],
+)
+def test_probe_audio_rejects_corrupted_mp4(contents):
+    with pytest.raises(InvalidAudioError):
+        probe_audio(io.BytesIO(contents))
+
+
+@pytest.mark.parametrize("header", [b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81", b"\xff\xf1\x50\x80\x02\x1f\xfc\x21"])
+def test_probe_audio_rejects_unmeasurable_containers(header):
+    with pytest.raises(UnsupportedAudioError):
+        probe_audio(io.BytesIO(header + bytes(1024)))
+
+
+def test_probe_audio_rejects_long_audio(monkeypatch):
+    monkeypatch.setattr(config, "MAX_AUDIO_DURATION_S", 2.0)
+    with pytest.raises(InvalidAudioError):
+        probe_audio(io.BytesIO(_encode(3.0)))
+
+
+@pytest.mark.parametrize("contents", [_encode(60.0), _encode_mp4(60.0, mdat_size=2 * 1024 * 1024)])
+def test_probe_reads_only_the_header_of_s3_objects(monkeypatch, contents):
+    requested = []
+
+    class FakeS3Client:
+        def get_object(self, Bucket, Key, Range):
+            start, end = map(int, Range.removeprefix("bytes=").split("-"))
+            requested.append(end - start + 1)
+            return {"Body": io.BytesIO(contents[start : end + 1])}
+
+    monkeypatch.setattr(s3, "get_s3_client", FakeS3Client)
+
+    info = probe_audio(s3.open_object("input.wav", len(contents), buffer_size=4096))
+    assert info.duration_s == pytest.approx(60.0)
+    assert sum(requested) < len(contents) // 100
+
+
+@pytest.mark.parametrize(
+    "duration_pricing, audio_duration_s, expected",
+    [(False, 125.0, 10.0), (True, None, 10.0), (True, 30.0, 10.0), (True, 125.0, 30.0)],
+)
+def test_usage_price(monkeypatch, duration_pricing, audio_duration_s, expected):
+    monkeypatch.setattr(config, "DURATION_PRICING", duration_pricing)
+    assert usage_price(10.0, audio_duration_s) == expected
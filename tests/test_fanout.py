@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from src.models.enhancer import IdentityModel
+from src.workers.fanout import plan_ranges
+
+
+@pytest.fixture
+def model():
+    return IdentityModel(device="cpu", chunk_duration_s=1.0, chunk_overlap_s=0.25)
+
+
+@pytest.mark.parametrize("audio_s, chunks_per_job", [(10.3, 4), (6.0, 3), (0.5, 4)])
+def test_chunk_ranges_match_single_job_chunks(model, audio_s, chunks_per_job):
+    audio = torch.randn(int(audio_s * model.sample_rate))
+    expected = model._split_chunks(audio)
+
+    ranges = plan_ranges(audio.shape[0], model._chunk_length, model._hop_length, chunks_per_job)
+    chunks = torch.cat([model._split_chunks(audio[start:end])[:count] for _, count, start, end in ranges])
+
+    assert [first_chunk for first_chunk, _, _, _ in ranges] == list(range(0, len(expected), chunks_per_job))
+    assert torch.equal(chunks, expected)
+
+
+def test_fan_out_result_matches_single_job(model):
+    audio = torch.randn(1, int(7.5 * model.sample_rate))
+    expected, _ = model.enhance_audio(audio, model.sample_rate)
+
+    resampled = model._resample(audio, model.sample_rate)
+    ranges = plan_ranges(resampled.shape[0], model._chunk_length, model._hop_length, 2)
+    chunks = torch.cat(
+        [model._forward(model._split_chunks(resampled[start:end])[:count]) for _, count, start, end in ranges]
+    )
+
+    assert torch.allclose(model._postprocess_audio(chunks, resampled.shape[0]), expected)
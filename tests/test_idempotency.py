@@ -0,0 +1,24 @@
+from src.idempotency import claim_request, complete_request, release_request, request_fingerprint
+
+
+def test_request_fingerprint_covers_file_and_parameters():
+    fingerprint = request_fingerprint(b"audio", model_name="audio_denoiser", output_format="flac")
+    assert fingerprint == request_fingerprint(b"audio", output_format="flac", model_name="audio_denoiser")
+    assert fingerprint != request_fingerprint(b"other audio", model_name="audio_denoiser", output_format="flac")
+    assert fingerprint != request_fingerprint(b"audio", model_name="audio_enhancer", output_format="flac")
+
+
+def test_retries_see_the_original_request(redis_conn):
+    redis_conn.flushdb()
+    response = {"task_id": 1, "job_id": "job"}
+
+    assert claim_request(redis_conn, 1, "key", "fingerprint") is None
+    assert claim_request(redis_conn, 1, "key", "fingerprint") == {"status": "pending", "fingerprint": "fingerprint"}
+    # Keys are scoped per user
+    assert claim_request(redis_conn, 2, "key", "fingerprint") is None
+
+    complete_request(redis_conn, 1, "key", "fingerprint", response)
+    assert claim_request(redis_conn, 1, "key", "fingerprint")["response"] == response
+
+    release_request(redis_conn, 2, "key")
+    assert claim_request(redis_conn, 2, "key", "fingerprint") is None
@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+WORKER_ONLY_MODULES = ("torch", "torchaudio", "resemble_enhance", "src.models.enhancer", "src.workers.enhance")
+
+
+def test_api_does_not_import_model_dependencies():
+    # A fresh interpreter, modules imported by other tests would leak into sys.modules
+    code = f"import sys, src.main; print(','.join(m for m in {WORKER_ONLY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
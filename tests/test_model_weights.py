@@ -0,0 +1,56 @@
+import threading
+
+import torch
+
+from src.models import weights
+from src.models.weights import _SkipRandomInit, export_weights
+
+
+def test_export_weights_flattens_checkpoint(tmp_path):
+    run_dir = tmp_path / "run"
+    (run_dir / weights.CHECKPOINT_PATH).parent.mkdir(parents=True)
+    (run_dir / "hparams.yaml").write_text("wav_rate: 44100\n")
+    state_dict = {"linear.weight": torch.randn(4, 3).t(), "linear.bias": torch.randn(3)}
+    torch.save({"module": state_dict, "optimizer": None}, run_dir / weights.CHECKPOINT_PATH)
+
+    weights_path = export_weights(str(tmp_path / "cache"), run_dir)
+    assert (weights_path.parent / "hparams.yaml").read_text() == "wav_rate: 44100\n"
+
+    cached = torch.load(str(weights_path), map_location="cpu", mmap=True)
+    assert cached.keys() == state_dict.keys()
+    for name, tensor in cached.items():
+        assert tensor.is_contiguous()
+        assert torch.equal(tensor, state_dict[name])
+
+
+def test_skip_random_init():
+    weight = torch.full((3, 3), 7.0)
+    with _SkipRandomInit():
+        torch.nn.init.kaiming_uniform_(weight)
+        torch.nn.init.xavier_normal_(weight)
+        linear = torch.nn.Linear(3, 3)
+        linear.load_state_dict({"weight": torch.eye(3), "bias": torch.zeros(3)}, assign=True)
+
+    assert torch.equal(weight, torch.full((3, 3), 7.0))
+    assert torch.equal(linear(torch.ones(1, 3)), torch.ones(1, 3))
+
+
+def test_skip_random_init_is_thread_local():
+    skipping, done = threading.Event(), threading.Event()
+
+    def build():
+        with _SkipRandomInit():
+            skipping.set()
+            done.wait(10)
+
+    thread = threading.Thread(target=build)
+    thread.start()
+    skipping.wait(10)
+    try:
+        # Models built by other threads meanwhile are initialized
+        weight = torch.full((3, 3), 7.0)
+        torch.nn.init.uniform_(weight, 0.0, 1.0)
+        assert (weight < 1.0).all()
+    finally:
+        done.set()
+        thread.join()
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+import soundfile as sf
+import torch
+from fastapi.testclient import TestClient
+
+from src import config
+from src.connections import _redis_connection
+from src.main import app, job_options
+from src.tracing import span
+from src.workers import pipeline
+
+trace = pytest.importorskip("opentelemetry.trace")
+
+
+@pytest.fixture
+def client(redis_conn, monkeypatch):
+    monkeypatch.setattr(config, "METRICS_TOKEN", "scraper")
+    app.dependency_overrides[_redis_connection] = lambda: redis_conn
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_metrics_export_request_and_stage_series(client, monkeypatch):
+    def download_file(object_name, file_path, bucket=None):
+        sf.write(file_path, torch.zeros(1600).numpy(), 16000)
+
+    monkeypatch.setattr(pipeline.s3, "download_file", download_file)
+
+    assert client.get("/tokens/balance/").status_code == 401
+    audio, sample_rate = pipeline.load_input("audio_denoiser", "input.wav")
+    assert sample_rate == 16000
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer scraper"})
+    assert response.status_code == 200
+    assert 'http_requests_total{method="GET",route="/tokens/balance/",status="401"}' in response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/tokens/balance/"}' in response.text
+    for stage in ("download", "decode"):
+        assert f'job_stage_duration_seconds_count{{model="audio_denoiser",stage="{stage}"}}' in response.text
+
+
+def test_trace_context_propagates_to_the_job():
+    parent = trace.SpanContext(
+        trace_id=0x0AF7651916CD43DD8448EB211C80319C,
+        span_id=0xB7AD6B7169203331,
+        is_remote=False,
+        trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+    )
+    with trace.use_span(trace.NonRecordingSpan(parent)):
+        meta = job_options(SimpleNamespace(id=1))["meta"]
+
+    assert meta["trace_context"]["traceparent"] == "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    # The worker continues the trace of the request that queued the job
+    with span("job", meta["trace_context"]):
+        assert trace.get_current_span().get_span_context().trace_id == parent.trace_id
+
+
+def test_metrics_require_the_token(client, monkeypatch):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    monkeypatch.setattr(config, "METRICS_TOKEN", "")
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
@@ -0,0 +1,41 @@
+import pytest
+import soundfile as sf
+import torch
+from resemble_enhance.denoiser.denoiser import Denoiser
+from resemble_enhance.denoiser.hparams import HParams
+
+from src.models.onnx_backend import OnnxModule, use_onnx_runtime
+
+pytest.importorskip("onnxruntime")
+
+TEST_AUDIO_FILE = "tests/data/41601__noisecollector__mysterysnippets.wav"
+
+
+def test_onnx_denoiser_matches_torch(tmp_path):
+    torch.manual_seed(0)
+    denoiser = Denoiser(HParams()).eval()
+    audio, _ = sf.read(TEST_AUDIO_FILE, frames=3 * 44100, dtype="float32")
+    # Two chunks of different loudness, as batched by EnhancerModel
+    chunks = torch.stack([torch.from_numpy(audio[:44100]), 0.1 * torch.from_numpy(audio[44100:88200])])
+
+    with torch.inference_mode():
+        expected = denoiser(chunks)
+        onnx_denoiser = use_onnx_runtime(denoiser, str(tmp_path))
+        assert isinstance(onnx_denoiser.net, OnnxModule)
+        assert torch.allclose(onnx_denoiser(chunks), expected, atol=1e-4)
+
+        # The loaded network is shared with the torch backend and keeps its U-Net
+        assert not isinstance(denoiser.net, OnnxModule)
+        assert torch.allclose(denoiser(chunks), expected)
+
+    # The copy shares the remaining weights instead of duplicating them
+    assert onnx_denoiser.mel_fn is not denoiser.mel_fn
+    assert {tensor.data_ptr() for tensor in onnx_denoiser.buffers()} <= {
+        tensor.data_ptr() for tensor in denoiser.buffers()
+    }
+
+    # The exported graph is reused by the next load of the same weights
+    exported = list((tmp_path / "onnx").iterdir())
+    torch.manual_seed(0)
+    assert isinstance(use_onnx_runtime(Denoiser(HParams()).eval(), str(tmp_path)).net, OnnxModule)
+    assert list((tmp_path / "onnx").iterdir()) == exported
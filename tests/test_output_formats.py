@@ -0,0 +1,63 @@
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from src import config
+from src.workers.output_formats import OUTPUT_FORMATS, encode_audio, parse_output_options
+
+SAMPLE_RATE = 48000
+
+
+@pytest.fixture
+def audio():
+    t = np.arange(5 * SAMPLE_RATE) / SAMPLE_RATE
+    tone = 0.5 * np.sin(2 * np.pi * 440 * t) + 0.01 * np.random.default_rng(0).standard_normal(t.shape)
+    return np.stack([tone, tone]).astype(np.float32)
+
+
+@pytest.mark.parametrize("output_format", OUTPUT_FORMATS)
+def test_encode_audio(audio, output_format):
+    encoded = encode_audio(audio, SAMPLE_RATE, output_format)
+    decoded, sample_rate = sf.read(encoded, always_2d=True)
+
+    assert sample_rate == SAMPLE_RATE
+    assert decoded.shape[1] == audio.shape[0]
+    assert abs(decoded.shape[0] - audio.shape[1]) < SAMPLE_RATE // 10
+
+
+def test_compressed_formats_are_smaller(audio):
+    float_wav = io.BytesIO()
+    sf.write(float_wav, audio.T, SAMPLE_RATE, format="WAV", subtype="FLOAT")
+    sizes = {
+        output_format: len(encode_audio(audio, SAMPLE_RATE, output_format).getvalue())
+        for output_format in OUTPUT_FORMATS
+    }
+
+    assert sizes["wav"] * 2 <= len(float_wav.getvalue()) + 100
+    assert sizes["flac"] < sizes["wav"]
+    assert sizes["opus"] * 10 < sizes["wav"]
+    assert sizes["mp3"] * 5 < sizes["wav"]
+
+
+def test_encode_audio_clips_out_of_range_samples():
+    audio = np.full((1, SAMPLE_RATE), 1.5, dtype=np.float32)
+    decoded, _ = sf.read(encode_audio(audio, SAMPLE_RATE, "wav"))
+    assert decoded.min() > 0.99
+
+
+def test_parse_output_options(monkeypatch):
+    monkeypatch.setattr(config, "DEFAULT_OUTPUT_FORMAT", "flac")
+    assert parse_output_options(None, None) == {"output_format": "flac", "output_sample_rate": None}
+    assert parse_output_options("mp3", 16000) == {"output_format": "mp3", "output_sample_rate": 16000}
+    with pytest.raises(ValueError):
+        parse_output_options("aac", None)
+    with pytest.raises(ValueError):
+        parse_output_options("wav", 12345)
+
+
+def test_resolve_sample_rate():
+    assert OUTPUT_FORMATS["flac"].resolve_sample_rate(44100) == 44100
+    assert OUTPUT_FORMATS["opus"].resolve_sample_rate(44100) == 48000
+    assert OUTPUT_FORMATS["opus"].resolve_sample_rate(22050) == 24000
@@ -0,0 +1,130 @@
+import threading
+from types import SimpleNamespace
+
+import torch
+from rq import Queue, get_current_job
+from rq.job import JobStatus
+
+from src import config
+from src.workers import pipeline
+from src.workers.pipeline import JobPipeline, PipelinedWorker
+from src.workers.retention import EXPIRED_INPUTS_KEY, finish_job
+
+
+def _record_loads(monkeypatch):
+    loads = []
+
+    def load_input(model_name, s3_object_key):
+        loads.append((s3_object_key, threading.current_thread().name))
+        return torch.zeros(1, 16000), 16000
+
+    monkeypatch.setattr(pipeline, "load_input", load_input)
+    return loads
+
+
+def test_take_input_uses_prefetched_inputs(monkeypatch):
+    loads = _record_loads(monkeypatch)
+    job_pipeline = JobPipeline(prefetch_depth=2, upload_depth=1)
+
+    job_pipeline.prefetch(("model", "a.wav"), [("model", "b.wav"), ("model", "c.wav"), ("model", "d.wav")])
+    for s3_object_key in ("a.wav", "b.wav", "c.wav"):
+        audio, sample_rate = job_pipeline.take_input("model", s3_object_key)
+        assert sample_rate == 16000
+    job_pipeline.drain()
+
+    # The current job is loaded in the job thread, the next `prefetch_depth` ones ahead of time
+    threads = dict(loads)
+    assert sorted(threads) == ["a.wav", "b.wav", "c.wav"]
+    assert threads["a.wav"] == "MainThread"
+    assert threads["b.wav"].startswith("prefetch") and threads["c.wav"].startswith("prefetch")
+
+
+def test_prefetch_drops_inputs_of_jobs_no_longer_queued(monkeypatch):
+    _record_loads(monkeypatch)
+    job_pipeline = JobPipeline(prefetch_depth=1, upload_depth=1)
+
+    job_pipeline.prefetch(None, [("model", "a.wav")])
+    job_pipeline.prefetch(("model", "b.wav"), [("model", "c.wav")])
+    assert list(job_pipeline._prefetched) == ["c.wav"]
+    job_pipeline.drain()
+
+
+def test_submit_output_is_bounded():
+    job_pipeline = JobPipeline(prefetch_depth=0, upload_depth=1)
+    release = threading.Event()
+    stored = []
+
+    job_pipeline.submit_output(lambda: (release.wait(), stored.append(1)))
+    # The second result waits for the first one to be uploaded
+    second = threading.Thread(target=job_pipeline.submit_output, args=(lambda: stored.append(2),))
+    second.start()
+    second.join(timeout=0.2)
+    assert second.is_alive()
+
+    release.set()
+    second.join()
+    job_pipeline.drain()
+    assert stored == [1, 2]
+
+
+def test_submit_output_disabled():
+    job_pipeline = JobPipeline(prefetch_depth=0, upload_depth=0)
+    assert not job_pipeline.submit_output(lambda: None)
+
+
+class _RecordingConnection:
+    def __init__(self):
+        self.calls = []
+
+    def zrem(self, key, *members):
+        self.calls.append(("zrem", key, *members))
+
+    def sadd(self, key, *members):
+        self.calls.append(("sadd", key, *members))
+
+
+def test_submitted_job_is_finished_after_its_output():
+    connection = _RecordingConnection()
+    job = SimpleNamespace(id="job", meta={"user_id": 1, "input_s3_key": "input.wav"}, connection=connection)
+    job_pipeline = JobPipeline(prefetch_depth=0, upload_depth=1)
+    release = threading.Event()
+
+    assert job_pipeline.submit_output(release.wait, job)
+    # The job returned, its success callback leaves the slot and the input to the output thread
+    finish_job(job, connection, None)
+    assert connection.calls == []
+
+    release.set()
+    job_pipeline.drain()
+    assert connection.calls == [("zrem", "user:1:inflight_jobs", "job"), ("sadd", EXPIRED_INPUTS_KEY, "input.wav")]
+
+
+def _job_with_failing_output():
+    def store():
+        raise OSError("Upload failed")
+
+    pipeline.get_job_pipeline().submit_output(store, get_current_job())
+    return {"result_s3_key": "never-written.flac"}
+
+
+def test_failed_output_fails_the_finished_job(redis_conn, monkeypatch):
+    redis_conn.flushdb()
+    monkeypatch.setattr(config, "RETENTION_INTERVAL_S", 0)
+    monkeypatch.setattr(config, "WORKER_UPLOAD_DEPTH", 1)
+    pipeline.get_job_pipeline.cache_clear()
+    queue = Queue("enhance", connection=redis_conn)
+    job = queue.enqueue(_job_with_failing_output, meta={"user_id": 1, "input_s3_key": "input.wav"})
+    redis_conn.zadd("user:1:inflight_jobs", {job.id: 1e12})
+
+    PipelinedWorker([queue], connection=redis_conn).work(burst=True)
+    pipeline.get_job_pipeline().drain()
+    pipeline.get_job_pipeline.cache_clear()
+
+    job.refresh()
+    assert job.get_status() == JobStatus.FAILED
+    assert job.id in queue.failed_job_registry.get_job_ids()
+    assert job.id not in queue.finished_job_registry.get_job_ids()
+    assert "Upload failed" in job.latest_result().exc_string
+    # The slot and the input are released all the same
+    assert redis_conn.zcard("user:1:inflight_jobs") == 0
+    assert redis_conn.smembers(EXPIRED_INPUTS_KEY) == {b"input.wav"}
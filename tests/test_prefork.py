@@ -0,0 +1,32 @@
+import gc
+import os
+
+import pytest
+
+from src.workers.prefork import fork_workers
+
+
+@pytest.fixture(autouse=True)
+def unfreeze():
+    yield
+    gc.unfreeze()
+
+
+def test_fork_workers_runs_every_process(tmp_path):
+    parent = os.getpid()
+
+    def run_worker(index):
+        assert os.getpid() != parent
+        (tmp_path / str(index)).write_text(str(os.getppid()))
+
+    assert fork_workers(3, run_worker) == 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0", "1", "2"]
+    assert {path.read_text() for path in tmp_path.iterdir()} == {str(parent)}
+
+
+def test_fork_workers_reports_failed_processes():
+    def run_worker(index):
+        if index == 1:
+            raise RuntimeError("Worker failed")
+
+    assert fork_workers(2, run_worker) == 1
@@ -0,0 +1,32 @@
+from src import config
+from src.file_storages import s3
+
+
+def test_presigned_urls_are_reused_while_valid(monkeypatch):
+    signed = []
+
+    def generate_presigned_url(object_name, bucket=None, expiration=3600):
+        signed.append(object_name)
+        return f"http://s3/{object_name}?signature={len(signed)}"
+
+    monkeypatch.setattr(s3, "generate_presigned_url", generate_presigned_url)
+    monkeypatch.setattr(s3, "_presigned_urls", type(s3._presigned_urls)())
+
+    first = s3.get_presigned_url("result.wav")
+    assert s3.get_presigned_url("result.wav") == first
+    assert signed == ["result.wav"]
+
+    # A cached URL with less than the refresh margin of validity left is signed again
+    monkeypatch.setattr(config, "PRESIGNED_URL_REFRESH_S", config.PRESIGNED_URL_EXPIRATION_S)
+    assert s3.get_presigned_url("result.wav") != first
+    assert signed == ["result.wav", "result.wav"]
+
+
+def test_presigned_url_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(s3, "generate_presigned_url", lambda object_name, **kwargs: f"http://s3/{object_name}")
+    monkeypatch.setattr(s3, "_presigned_urls", type(s3._presigned_urls)())
+    monkeypatch.setattr(config, "PRESIGNED_URL_CACHE_SIZE", 2)
+
+    for object_name in ("a.wav", "b.wav", "c.wav"):
+        s3.get_presigned_url(object_name)
+    assert [object_name for _, object_name in s3._presigned_urls] == ["b.wav", "c.wav"]
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+import torch
+
+from src import config
+from src.workers.profiling import JobProfiler, create_profiler, profile_object_name, should_keep_profile
+
+
+def test_profiler_disabled_by_default(monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_MODE", "off")
+    assert create_profiler() is None
+    assert create_profiler(requested=True).mode == "cprofile"
+
+
+@pytest.mark.parametrize(
+    "requested, audio_s, wall_s, threshold, expected",
+    [
+        (True, 10.0, 1.0, 1.0, True),
+        (False, 10.0, 1.0, 1.0, False),
+        (False, 10.0, 20.0, 1.0, True),
+        (False, 10.0, 20.0, 0.0, False),
+    ],
+)
+def test_should_keep_profile(monkeypatch, requested, audio_s, wall_s, threshold, expected):
+    monkeypatch.setattr(config, "PROFILE_RTF_THRESHOLD", threshold)
+    assert should_keep_profile(requested, audio_s, wall_s) == expected
+
+
+@pytest.mark.parametrize("mode", ["cprofile", "torch"])
+def test_profiler_dumps_trace(tmp_path, mode):
+    profiler = JobProfiler(mode)
+    with profiler:
+        torch.randn(64, 64) @ torch.randn(64, 64)
+
+    path = profiler.dump(str(tmp_path / "profile"))
+    assert os.path.getsize(path) > 0
+    assert profile_object_name("result.wav", profiler) == f"result{profiler.extension}"
@@ -0,0 +1,102 @@
+import pytest
+
+from src import config
+from src.connections import _database_session
+from src.database.orm import Model, UsageHistory, User
+from src.file_storages import s3
+from src.workers.retention import (
+    ORPHAN_CURSOR_KEY,
+    apply_lifecycle_rules,
+    delete_orphaned_results,
+    referenced_results,
+    unreferenced_keys,
+)
+from tests.conftest import free_port
+
+
+def test_unreferenced_keys_keep_results_and_their_profiles():
+    keys = ["a.flac", "a.prof", "b.wav", "b.trace.json", "c.mp3", "fanout/job/output-000000.f32"]
+    assert unreferenced_keys(keys, {"a.flac", "b.wav"}) == ["c.mp3", "fanout/job/output-000000.f32"]
+
+
+def test_referenced_results_match_profiles_to_their_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_URL", f"sqlite:///{tmp_path}/app.db")
+    with _database_session() as db:
+        user, model = User(username="user", password="password"), Model(name="model", price=1.0)
+        db.add_all([user, model])
+        db.commit()
+        db.add_all(
+            [
+                UsageHistory(user_id=user.id, model_id=model.id, tokens_spent=1.0, result_s3_key=key)
+                for key in ("a.flac", "b.ogg", None)
+            ]
+        )
+        db.commit()
+
+    referenced = referenced_results(["a.flac", "b.prof", "c.wav"])
+    assert referenced == {"a.flac", "b.ogg"}
+    assert unreferenced_keys(["a.flac", "b.prof", "c.wav"], referenced) == ["c.wav"]
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    """In-process moto S3 server with the uploads and results buckets"""
+    moto_server = pytest.importorskip("moto.server")
+    port = free_port()
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    try:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr(config, "S3_HOST", "127.0.0.1")
+            monkeypatch.setattr(config, "S3_PORT", port)
+            s3_client = s3.get_s3_client()
+            for bucket in (config.S3_UPLOADS_BUCKET, config.S3_RESULTS_BUCKET):
+                s3_client.create_bucket(Bucket=bucket)
+            yield s3_client
+    finally:
+        server.stop()
+
+
+def test_lifecycle_rules_keep_the_rules_of_operators(monkeypatch, s3_server):
+    monkeypatch.setattr(config, "UPLOAD_RETENTION_DAYS", 0)
+    operator_rule = {"ID": "operator", "Filter": {"Prefix": "logs/"}, "Status": "Enabled", "Expiration": {"Days": 7}}
+    stale_rule = {"ID": "expire-uploads", "Filter": {"Prefix": ""}, "Status": "Enabled", "Expiration": {"Days": 3}}
+
+    s3.put_lifecycle_rules([operator_rule, stale_rule], bucket=config.S3_UPLOADS_BUCKET)
+
+    apply_lifecycle_rules()
+
+    # The rule no longer configured is dropped, the rule of the operator is kept
+    upload_rules = {rule["ID"] for rule in s3.get_lifecycle_rules(bucket=config.S3_UPLOADS_BUCKET)}
+    assert upload_rules == {"operator", "abort-incomplete-uploads"}
+    assert "expire-fanout-intermediates" in {rule["ID"] for rule in s3.get_lifecycle_rules(config.S3_RESULTS_BUCKET)}
+
+
+def test_lifecycle_rules_do_not_block_startup_without_s3(monkeypatch):
+    monkeypatch.setattr(config, "S3_HOST", "127.0.0.1")
+    monkeypatch.setattr(config, "S3_PORT", free_port())
+    apply_lifecycle_rules()
+
+
+def test_orphan_scan_resumes_where_the_previous_run_stopped(tmp_path, monkeypatch, s3_server, redis_conn):
+    redis_conn.flushdb()
+    monkeypatch.setattr(config, "DATABASE_URL", f"sqlite:///{tmp_path}/app.db")
+    monkeypatch.setattr(config, "ORPHAN_GRACE_S", -60)
+    monkeypatch.setattr(config, "RETENTION_BATCH_SIZE", 2)
+    for key in ("a.flac", "b.flac", "c.flac", "d.flac"):
+        s3_server.put_object(Bucket=config.S3_RESULTS_BUCKET, Key=key, Body=b"result")
+    with _database_session() as db:
+        user, model = User(username="user", password="password"), Model(name="model", price=1.0)
+        db.add_all([user, model])
+        db.commit()
+        db.add(UsageHistory(user_id=user.id, model_id=model.id, tokens_spent=1.0, result_s3_key="b.flac"))
+        db.commit()
+
+    assert delete_orphaned_results(redis_conn) == 2
+    assert redis_conn.get(ORPHAN_CURSOR_KEY) == b"c.flac"
+    # The second run lists only the keys after the cursor and reaches the end of the bucket
+    assert delete_orphaned_results(redis_conn) == 1
+    assert redis_conn.get(ORPHAN_CURSOR_KEY) is None
+
+    remaining = [obj["Key"] for objects in s3.list_objects(bucket=config.S3_RESULTS_BUCKET) for obj in objects]
+    assert remaining == ["b.flac"]
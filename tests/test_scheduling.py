@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+import redis
+from rq import Queue
+
+from src import config
+from src.workers.scheduling import (
+    WeightedWorker,
+    add_backlog,
+    get_capacity,
+    listen_queue_names,
+    queue_name,
+    record_real_time_factor,
+    select_priority_class,
+    weighted_order,
+)
+
+
+@pytest.mark.parametrize(
+    "file_size_mb, user_tier, expected",
+    [
+        (1.0, "free", "short"),
+        (config.QUEUE_LONG_FILE_SIZE_MB + 1.0, "free", "long"),
+        (config.QUEUE_LONG_FILE_SIZE_MB + 1.0, "paid", "priority"),
+    ],
+)
+def test_select_priority_class(file_size_mb, user_tier, expected):
+    assert select_priority_class(int(file_size_mb * 1024 * 1024), user_tier) == expected
+
+
+def test_select_priority_class_by_duration():
+    small, large = 1024, int((config.QUEUE_LONG_FILE_SIZE_MB + 1.0) * 1024 * 1024)
+    assert select_priority_class(small, "free", config.QUEUE_LONG_DURATION_S + 1.0) == "long"
+    assert select_priority_class(large, "free", 1.0) == "short"
+
+
+def test_weighted_order_prefers_heavier_queues():
+    redis_conn = redis.Redis()
+    queues = [Queue(name, connection=redis_conn) for name in listen_queue_names(["enhance"])]
+
+    first = Counter()
+    for _ in range(5000):
+        first[weighted_order(queues)[0].name.rsplit(":", 1)[-1]] += 1
+
+    total_weight = sum(config.QUEUE_PRIORITY_WEIGHTS.values())
+    for priority_class, weight in config.QUEUE_PRIORITY_WEIGHTS.items():
+        assert first[priority_class] / 5000 == pytest.approx(weight / total_weight, abs=0.05)
+
+
+def test_capacity_follows_backlog_audio_seconds(redis_conn, monkeypatch):
+    redis_conn.flushdb()
+    monkeypatch.setattr(config, "RETENTION_INTERVAL_S", 0)
+    queues = [Queue(name, connection=redis_conn) for name in listen_queue_names(["enhance"])]
+    for name, audio_s in [(queue_name("enhance", "short"), 30.0), (queue_name("enhance", "long"), 90.0)]:
+        Queue(name, connection=redis_conn).enqueue(len, args=("audio",), meta={"audio_duration_s": audio_s})
+        add_backlog(redis_conn, name, audio_s)
+    record_real_time_factor(redis_conn, "enhance", audio_s=10.0, wall_s=5.0)
+
+    worker = WeightedWorker(queues, connection=redis_conn)
+    worker.register_birth()
+    [capacity] = get_capacity(redis_conn, ["enhance"])
+    assert capacity["queued_jobs"] == 2
+    assert capacity["backlog_audio_s"] == pytest.approx(120.0)
+    assert capacity["active_workers"] == 1
+    assert capacity["drain_time_s"] == pytest.approx(60.0)
+
+    worker.register_death()
+    worker.work(burst=True)
+    [capacity] = get_capacity(redis_conn, ["enhance"])
+    assert capacity["backlog_audio_s"] == pytest.approx(0.0)
+    assert capacity["drain_time_s"] == 0.0
+
+
+def test_every_priority_class_needs_a_weight():
+    # A fresh interpreter, the weights are read once at import
+    env = {**os.environ, "QUEUE_PRIORITY_WEIGHTS": "priority=6,short=3"}
+    result = subprocess.run(
+        [sys.executable, "-c", "import src.workers.scheduling"], capture_output=True, text=True, env=env
+    )
+    assert result.returncode != 0
+    assert "no weight for the long class" in result.stderr
@@ -0,0 +1,54 @@
+import pytest
+
+from src import config
+from src.connections import _database_session
+from src.database.cache import FLUSHING_STATUSES_KEY, PENDING_STATUSES_KEY, update_task_status
+from src.database.orm import Model, UsageHistory, User
+from src.workers.status_flusher import flush_task_statuses
+
+
+@pytest.fixture
+def task_ids(tmp_path, monkeypatch, redis_conn):
+    redis_conn.flushdb()
+    monkeypatch.setattr(config, "DATABASE_URL", f"sqlite:///{tmp_path}/app.db")
+    with _database_session() as db:
+        user, model = User(username="user", password="password"), Model(name="model", price=1.0)
+        db.add_all([user, model])
+        db.commit()
+        tasks = [UsageHistory(user_id=user.id, model_id=model.id, tokens_spent=1.0) for _ in range(3)]
+        db.add_all(tasks)
+        db.commit()
+        return [task.id for task in tasks]
+
+
+def _statuses(task_ids):
+    with _database_session() as db:
+        return [db.get(UsageHistory, task_id).status for task_id in task_ids]
+
+
+def _result_s3_keys(task_ids):
+    with _database_session() as db:
+        return [db.get(UsageHistory, task_id).result_s3_key for task_id in task_ids]
+
+
+def test_flush_task_statuses(redis_conn, task_ids):
+    update_task_status(redis_conn, task_ids[0], "processing")
+    update_task_status(redis_conn, task_ids[0], "completed", "result.wav")
+    update_task_status(redis_conn, task_ids[1], "failed")
+
+    assert _statuses(task_ids) == ["pending", "pending", "pending"]
+    assert flush_task_statuses(redis_conn) == 2
+    assert _statuses(task_ids) == ["completed", "failed", "pending"]
+    assert _result_s3_keys(task_ids) == ["result.wav", None, None]
+    assert not redis_conn.exists(PENDING_STATUSES_KEY, FLUSHING_STATUSES_KEY)
+    assert flush_task_statuses(redis_conn) == 0
+
+
+def test_flush_recovers_interrupted_batch(redis_conn, task_ids):
+    # A flusher crashed after moving the batch aside, while new statuses kept coming in
+    redis_conn.hset(FLUSHING_STATUSES_KEY, task_ids[0], '{"status": "completed", "result_s3_key": "result.wav"}')
+    update_task_status(redis_conn, task_ids[1], "processing")
+
+    assert flush_task_statuses(redis_conn) == 2
+    assert _statuses(task_ids) == ["completed", "processing", "pending"]
+    assert _result_s3_keys(task_ids) == ["result.wav", None, None]